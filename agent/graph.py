@@ -5,28 +5,45 @@ LangGraph state definition, node functions, and compiled chatbot graph.
 
 This module owns:
   - ChatState: the typed graph state
-  - chat_node: the LLM inference node
+  - context_node / acontext_node: gathers memories + uploaded-doc context
+    once per turn, fanning the lookups out concurrently; re-entered only to
+    refresh memories after a memory tool writes to user_memory
+  - chat_node / achat_node: the LLM inference node (sync and async variants)
   - tool_node: the tool execution node
   - chatbot: the compiled, checkpointed graph (imported by server.py or app factory)
+  - refresh_summary: background fold of older turns into the rolling summary
 
-The checkpointer (PostgresSaver) is injected at startup via init_graph(),
+The checkpointer (AsyncPostgresSaver) is injected at startup via init_graph(),
 called from the app factory after the database pool is ready.
 """
 
-from typing import TypedDict, Annotated
-from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
-from langchain_core.runnables import RunnableConfig
+import asyncio
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypedDict, Annotated, NotRequired
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
 
-from core.config import LLM_MODEL
+from core.config import LLM_MODEL, PROMPT_LAYOUT, SUMMARY_TRIGGER_TURNS
 from core.logger import get_logger
-from tools.registry import ALL_TOOLS, build_llm_with_tools
+from tools.registry import ALL_TOOLS, build_llm_with_tools, tool_schema_tokens
+from tools.memory_tools import MEMORY_WRITE_TOOLS
 import memory.service as memory_service
+import threads.service as threads_service
 import tools.document_rag as document_rag
-from agent.prompts import build_system_prompt
+from agent.intent import is_small_talk
+from agent.prompts import DEFAULT_VARIANT, PromptVariant, build_system_prompt, build_turn_context, select_variant
+from agent.usage import record_prompt, record_usage
+from agent.history import (
+    messages_to_fold,
+    render_transcript,
+    trim_history_counted,
+    unsummarized_messages,
+)
 
 logger = get_logger(__name__)
 
@@ -38,6 +55,7 @@ logger = get_logger(__name__)
 #   - llm             → exported to threads_service for title generation
 llm = ChatOpenAI(
     streaming=True, 
+    stream_usage=True,      # usage (incl. cached prompt tokens) on streamed calls
     model=LLM_MODEL,
     timeout=30.0,
     max_retries=1
@@ -50,40 +68,211 @@ llm_with_tools = build_llm_with_tools(llm)
 # ---------------------------------------------------------------------------
 class ChatState(TypedDict):
     messages: Annotated[list[BaseMessage], add_messages]
+    # Written by context_node at the start of each turn and reused by every
+    # chat_node hop in that turn (including loops back from `tools`).
+    memories: NotRequired[str]
+    doc_context: NotRequired[str]
+    # ID of the HumanMessage the cached context was computed for.
+    context_for: NotRequired[str]
+    # Rolling summary of older turns, written by refresh_summary(), and the
+    # ID of the last message it covers. Later messages are sent verbatim.
+    summary: NotRequired[str]
+    summary_upto: NotRequired[str]
 
 # ---------------------------------------------------------------------------
 # Nodes
 # ---------------------------------------------------------------------------
-def chat_node(state: ChatState, config: RunnableConfig):
-    """LLM node: injects memories + uploaded-doc context, then invokes the LLM."""
-    messages  = state["messages"]
-    thread_id = config.get("configurable", {}).get("thread_id", "")
-    memories  = memory_service.get_all_memories()
-
-    # Auto-inject PDF context when this thread has uploaded documents.
-    # search_thread_documents() returns "" immediately if no uploads exist
-    # (COUNT short-circuit), so threads without PDFs pay zero overhead.
-    doc_context = ""
-    if thread_id:
-        last_human = next(
-            (m for m in reversed(messages) if isinstance(m, HumanMessage)), None
+def _last_human(messages: list[BaseMessage]) -> HumanMessage | None:
+    """Return the most recent HumanMessage, if any."""
+    return next(
+        (m for m in reversed(messages) if isinstance(m, HumanMessage)), None
+    )
+
+
+def _last_human_content(messages: list[BaseMessage]) -> str | None:
+    """Return the content of the most recent HumanMessage, if any."""
+    last_human = _last_human(messages)
+    return last_human.content if last_human else None
+
+
+def _previous_reply(messages: list[BaseMessage]) -> str | None:
+    """Return the text of the assistant's last reply before the latest user message."""
+    before_turn = False
+    for msg in reversed(messages):
+        if isinstance(msg, HumanMessage):
+            if before_turn:
+                return None
+            before_turn = True
+        elif before_turn and isinstance(msg, AIMessage) and isinstance(msg.content, str) and msg.content.strip():
+            return msg.content
+    return None
+
+
+def _has_cached_context(state: ChatState, last_human: HumanMessage | None) -> bool:
+    """True when state already holds context computed for this HumanMessage."""
+    return (
+        last_human is not None
+        and "doc_context" in state
+        and state.get("context_for") == last_human.id
+    )
+
+
+def _is_turn_start(messages: list[BaseMessage]) -> bool:
+    """True before the model has replied to the latest HumanMessage (first hop of a turn)."""
+    for m in reversed(messages):
+        if isinstance(m, HumanMessage):
+            return True
+        if isinstance(m, AIMessage):
+            return False
+    return False
+
+
+def _thread_id(config: RunnableConfig) -> str:
+    """Return the thread_id of a graph invocation ("" when unscoped)."""
+    return config.get("configurable", {}).get("thread_id", "")
+
+
+def _build_messages(
+    state: ChatState,
+    layout: str | None = None,
+    variant: PromptVariant = DEFAULT_VARIANT,
+) -> list[BaseMessage]:
+    """
+    Prepend the system prompt (memories, rolling summary) of the given prompt
+    variant to the token-budgeted window of messages the summary does not yet
+    cover. On the first hop of each turn the prompt's token cost per section
+    is logged and recorded for the variant (agent.usage.prompt_stats); later
+    tool hops are not, so tool-heavy threads don't outweigh the others.
+
+    With the "cache_friendly" layout (PROMPT_LAYOUT) the turn's memories
+    (ranked against this message) and doc context are sent as their own
+    SystemMessage right after the latest HumanMessage, so the system prompt
+    and earlier history form a prefix that stays identical from turn to turn
+    (and across hops within a turn) for provider prompt caching. The "legacy"
+    layout puts both in the system prompt instead.
+    """
+    memories = state.get("memories", "")
+    doc_context = state.get("doc_context", "")
+    summary = state.get("summary", "")
+    messages, history_tokens = trim_history_counted(
+        unsummarized_messages(state["messages"], state.get("summary_upto"))
+    )
+    if _is_turn_start(state["messages"]):
+        memory_count = len([m for m in memories.split('\n') if m.strip()]) if memories else 0
+        sections = variant.section_tokens(memories, summary, doc_context)
+        sections["history"] = history_tokens
+        sections["tools"] = tool_schema_tokens()
+        record_prompt(variant.name, sections)
+        logger.info(
+            f"chat_node: {len(messages)} message(s), {memory_count} memory fact(s), "
+            f"prompt variant '{variant.name}' ~{sum(sections.values())} tokens ("
+            + ", ".join(f"{name}={tokens}" for name, tokens in sections.items()) + ")"
         )
-        if last_human:
-            doc_context = document_rag.search_thread_documents(thread_id, last_human.content)
 
-    memory_count = len([m for m in memories.split('\n') if m.strip()]) if memories else 0
-    logger.debug(
-        f"chat_node: {len(messages)} message(s), {memory_count} memory fact(s), "
-        f"doc_context={'YES' if doc_context else 'NO'}"
+    if (layout or PROMPT_LAYOUT) == "legacy":
+        return [SystemMessage(content=build_system_prompt(memories, doc_context, summary, variant))] + messages
+
+    prompt = [SystemMessage(content=build_system_prompt("", summary=summary, variant=variant))] + messages
+    turn_context = build_turn_context(memories, doc_context, variant)
+    if turn_context:
+        turn_start = next(
+            (i for i in range(len(prompt) - 1, 0, -1) if isinstance(prompt[i], HumanMessage)),
+            len(prompt) - 1,
+        )
+        prompt.insert(turn_start + 1, SystemMessage(content=turn_context))
+    return prompt
+
+
+# Memory and RAG lookups are independent I/O — run them side by side.
+_context_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chat-context")
+
+
+def _search_docs(thread_id: str, messages: list[BaseMessage]) -> str:
+    """
+    Auto-inject PDF context when this thread has uploaded documents.
+    search_thread_documents() returns "" immediately if no uploads exist
+    (cached thread_documents registry), so threads without PDFs pay zero overhead.
+    Small-talk turns ("thanks!", "ok") skip retrieval entirely, unless they
+    answer a question the assistant just asked.
+    """
+    query = _last_human_content(messages)
+    if not thread_id or not query:
+        return ""
+    if is_small_talk(query, _previous_reply(messages)):
+        logger.debug("context: small-talk turn, skipping document retrieval")
+        return ""
+    return document_rag.search_thread_documents(thread_id, query)
+
+
+def context_node(state: ChatState, config: RunnableConfig):
+    """
+    Context-assembly node: fetch memories and doc context concurrently.
+    When the turn's context is already cached (re-entry after a memory tool),
+    only the invalidated memories are re-read; doc_context is reused.
+    """
+    last_human = _last_human(state["messages"])
+    query = last_human.content if last_human else None
+    if _has_cached_context(state, last_human):
+        return {"memories": memory_service.get_relevant_memories(query)}
+
+    thread_id = _thread_id(config)
+    memories_future = _context_executor.submit(memory_service.get_relevant_memories, query)
+    docs_future = _context_executor.submit(_search_docs, thread_id, state["messages"])
+    return {
+        "memories": memories_future.result(),
+        "doc_context": docs_future.result(),
+        "context_for": last_human.id if last_human else "",
+    }
+
+
+async def acontext_node(state: ChatState, config: RunnableConfig):
+    """Async variant of context_node used by chatbot.astream()."""
+    last_human = _last_human(state["messages"])
+    query = last_human.content if last_human else None
+    if _has_cached_context(state, last_human):
+        return {"memories": await asyncio.to_thread(memory_service.get_relevant_memories, query)}
+
+    thread_id = _thread_id(config)
+    memories, doc_context = await asyncio.gather(
+        asyncio.to_thread(memory_service.get_relevant_memories, query),
+        asyncio.to_thread(_search_docs, thread_id, state["messages"]),
     )
+    return {
+        "memories": memories,
+        "doc_context": doc_context,
+        "context_for": last_human.id if last_human else "",
+    }
+
 
-    system_prompt = build_system_prompt(memories, doc_context)
-    messages_to_invoke = [SystemMessage(content=system_prompt)] + messages
-    response = llm_with_tools.invoke(messages_to_invoke)
+def chat_node(state: ChatState, config: RunnableConfig):
+    """LLM node: injects the turn's memories + doc context, then invokes the LLM."""
+    response = llm_with_tools.invoke(_build_messages(state, variant=select_variant(_thread_id(config))))
+    record_usage(response)
+    return {"messages": [response]}
+
+
+async def achat_node(state: ChatState, config: RunnableConfig):
+    """Async variant of chat_node used by chatbot.astream()."""
+    response = await llm_with_tools.ainvoke(_build_messages(state, variant=select_variant(_thread_id(config))))
+    record_usage(response)
     return {"messages": [response]}
 
 tool_node = ToolNode(ALL_TOOLS)
 
+
+def route_after_tools(state: ChatState) -> str:
+    """
+    Send the turn back through `context` only if the tool batch that just ran
+    wrote to user_memory; otherwise the cached context is still valid.
+    """
+    for msg in reversed(state["messages"]):
+        if not isinstance(msg, ToolMessage):
+            break
+        if msg.name in MEMORY_WRITE_TOOLS:
+            return "context"
+    return "chat_node"
+
+
 # ---------------------------------------------------------------------------
 # Graph — compiled lazily via init_graph() so the checkpointer can be injected
 # ---------------------------------------------------------------------------
@@ -97,10 +286,88 @@ def init_graph(checkpointer):
     """
     global chatbot
     graph = StateGraph(ChatState)
-    graph.add_node("chat_node", chat_node)
+    # Sync callers (invoke/stream) run the plain functions; astream() awaits
+    # the async variants.
+    graph.add_node("context", RunnableLambda(context_node, afunc=acontext_node))
+    graph.add_node("chat_node", RunnableLambda(chat_node, afunc=achat_node))
     graph.add_node("tools", tool_node)
-    graph.add_edge(START, "chat_node")
+    # Context is gathered once per turn; tool loops return straight to
+    # chat_node unless a memory tool invalidated the cached memories.
+    graph.add_edge(START, "context")
+    graph.add_edge("context", "chat_node")
     graph.add_conditional_edges("chat_node", tools_condition)
-    graph.add_edge("tools", "chat_node")
+    graph.add_conditional_edges("tools", route_after_tools, ["context", "chat_node"])
     chatbot = graph.compile(checkpointer=checkpointer)
     return chatbot
+
+
+# Graph writes for one thread are serialized within the process: /chat holds
+# the lock for a whole turn, refresh_summary only to commit its update.
+_thread_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+
+
+def thread_lock(thread_id: str) -> asyncio.Lock:
+    """Return the lock that serializes checkpoint writes for a thread."""
+    lock = _thread_locks.get(thread_id)
+    if lock is None:
+        lock = _thread_locks[thread_id] = asyncio.Lock()
+    return lock
+
+
+def _count_turns(messages: list[BaseMessage]) -> int:
+    return sum(isinstance(m, HumanMessage) for m in messages)
+
+
+async def refresh_summary(thread_id: str) -> None:
+    """
+    Fold older turns of a thread into its rolling summary.
+    Scheduled after a /chat response has been streamed, so it never adds
+    latency to a turn. No-op until the thread exceeds SUMMARY_TRIGGER_TURNS
+    unsummarized turns; never raises.
+
+    The pending-turn counter in thread_metadata is checked first, so most
+    turns cost one indexed lookup rather than a checkpoint load. The summary
+    is written under thread_lock() and only if no turn is in flight and the
+    summary anchor is unchanged, so it never forks off a concurrent turn.
+    """
+    if chatbot is None:
+        return
+    config = {"configurable": {"thread_id": thread_id}}
+    try:
+        pending = await asyncio.to_thread(threads_service.get_pending_turns, thread_id)
+        if pending is not None and pending <= SUMMARY_TRIGGER_TURNS:
+            return
+
+        snapshot = await chatbot.aget_state(config)
+        if snapshot.next:
+            return  # turn still in flight (or interrupted) — try again next time
+        values = snapshot.values
+        messages = values.get("messages", [])
+        fold = messages_to_fold(messages, values.get("summary_upto"))
+        if not fold:
+            turns = _count_turns(unsummarized_messages(messages, values.get("summary_upto")))
+            await asyncio.to_thread(threads_service.set_pending_turns, thread_id, turns)
+            return
+
+        summary = await asyncio.to_thread(
+            threads_service.summarize_conversation,
+            values.get("summary", ""),
+            render_transcript(fold),
+        )
+        if not summary:
+            return
+
+        async with thread_lock(thread_id):
+            latest = await chatbot.aget_state(config)
+            if latest.next or latest.values.get("summary_upto") != values.get("summary_upto"):
+                return  # a turn (or another refresh) got there first — retry after the next turn
+            # Written as chat_node so routing (tools_condition on the final answer)
+            # still resolves to END and the next turn starts cleanly from START.
+            await chatbot.aupdate_state(
+                config, {"summary": summary, "summary_upto": fold[-1].id}, as_node="chat_node"
+            )
+        turns = _count_turns(unsummarized_messages(latest.values.get("messages", []), fold[-1].id))
+        await asyncio.to_thread(threads_service.set_pending_turns, thread_id, turns)
+        logger.info(f"Rolling summary updated for thread {thread_id}: folded {len(fold)} message(s)")
+    except Exception:
+        logger.exception("Failed to refresh summary for thread %s", thread_id)
@@ -0,0 +1,165 @@
+"""
+agent/history.py
+----------------
+Token-budgeted conversation window sent to the LLM on each chat_node hop.
+
+The checkpoint keeps the full thread (the UI renders it from /history);
+only the copy sent to the model is trimmed:
+  - The current turn (last HumanMessage onward) is always sent intact,
+    including any tool results the model is about to read.
+  - Bulky ToolMessage bodies from earlier turns are collapsed to
+    TOOL_RESULT_MAX_TOKENS — the model already answered from them.
+  - Older turns are then kept newest-first, whole turns at a time, until
+    HISTORY_MAX_TOKENS is reached. Cutting on HumanMessage boundaries means
+    no ToolMessage is ever sent without the AIMessage that requested it.
+
+Long threads are additionally compacted by a rolling summary: once a thread
+has more than SUMMARY_TRIGGER_TURNS unsummarized turns, everything but the
+last SUMMARY_KEEP_TURNS is folded into ChatState["summary"] in the
+background, and later prompts send that summary plus only the messages
+after ChatState["summary_upto"].
+"""
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+
+from core.config import (
+    HISTORY_MAX_TOKENS,
+    SUMMARY_KEEP_TURNS,
+    SUMMARY_TRIGGER_TURNS,
+    TOOL_RESULT_MAX_TOKENS,
+)
+from core.logger import get_logger
+from core.tokens import count_tokens, truncate_tokens
+
+logger = get_logger(__name__)
+
+# Approximate per-message framing overhead in the chat format (role, separators).
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+_TRUNCATION_MARKER = "\n…[earlier tool output truncated]"
+
+
+def _content_text(msg: BaseMessage) -> str:
+    """Return the textual content of a message (multi-part content flattened)."""
+    if isinstance(msg.content, str):
+        return msg.content
+    return " ".join(
+        part.get("text", "") if isinstance(part, dict) else str(part)
+        for part in msg.content
+    )
+
+
+def count_message_tokens(msg: BaseMessage) -> int:
+    """Approximate the prompt tokens a single message costs, including tool calls."""
+    tokens = _MESSAGE_OVERHEAD_TOKENS + count_tokens(_content_text(msg))
+    for call in getattr(msg, "tool_calls", None) or []:
+        tokens += count_tokens(call.get("name", "")) + count_tokens(str(call.get("args", "")))
+    return tokens
+
+
+def collapse_tool_message(msg: BaseMessage, max_tokens: int = TOOL_RESULT_MAX_TOKENS) -> BaseMessage:
+    """Return a copy of an oversized ToolMessage with its body truncated."""
+    if not isinstance(msg, ToolMessage) or not isinstance(msg.content, str):
+        return msg
+    if count_tokens(msg.content) <= max_tokens:
+        return msg
+    return msg.model_copy(
+        update={"content": truncate_tokens(msg.content, max_tokens) + _TRUNCATION_MARKER}
+    )
+
+
+def trim_history(
+    messages: list[BaseMessage],
+    max_tokens: int = HISTORY_MAX_TOKENS,
+    tool_max_tokens: int = TOOL_RESULT_MAX_TOKENS,
+) -> list[BaseMessage]:
+    """Return the messages to send to the LLM, bounded by max_tokens (see module docstring)."""
+    return trim_history_counted(messages, max_tokens, tool_max_tokens)[0]
+
+
+def trim_history_counted(
+    messages: list[BaseMessage],
+    max_tokens: int = HISTORY_MAX_TOKENS,
+    tool_max_tokens: int = TOOL_RESULT_MAX_TOKENS,
+) -> tuple[list[BaseMessage], int]:
+    """
+    Like trim_history(), also returning the window's token count, which is
+    tallied while trimming so callers need not tokenize the history again.
+    """
+    current_start = next(
+        (i for i in range(len(messages) - 1, -1, -1) if isinstance(messages[i], HumanMessage)),
+        0,
+    )
+    window = list(messages[current_start:])
+    used = sum(count_message_tokens(m) for m in window)
+
+    kept: list[BaseMessage] = []
+    turn: list[BaseMessage] = []
+    for msg in reversed(messages[:current_start]):
+        turn.insert(0, collapse_tool_message(msg, tool_max_tokens))
+        if not isinstance(msg, HumanMessage):
+            continue
+        cost = sum(count_message_tokens(m) for m in turn)
+        if used + cost > max_tokens:
+            break
+        kept = turn + kept
+        used += cost
+        turn = []
+
+    dropped = current_start - len(kept)
+    if dropped:
+        logger.debug(
+            f"trim_history: sending {len(kept) + len(window)} of {len(messages)} message(s) "
+            f"(~{used} tokens), dropped {dropped} older message(s)"
+        )
+    return kept + window, used
+
+
+# ---------------------------------------------------------------------------
+# Rolling summary
+# ---------------------------------------------------------------------------
+
+def unsummarized_messages(messages: list[BaseMessage], summary_upto: str | None) -> list[BaseMessage]:
+    """Return the messages after the one the rolling summary covers up to."""
+    if not summary_upto:
+        return messages
+    for i, msg in enumerate(messages):
+        if msg.id == summary_upto:
+            return messages[i + 1:]
+    # Summary anchor not found (e.g. state edited) — send the full history.
+    return messages
+
+
+def messages_to_fold(
+    messages: list[BaseMessage],
+    summary_upto: str | None,
+    trigger_turns: int = SUMMARY_TRIGGER_TURNS,
+    keep_turns: int = SUMMARY_KEEP_TURNS,
+) -> list[BaseMessage]:
+    """
+    Return the oldest unsummarized messages to fold into the summary, or []
+    while the thread has at most trigger_turns unsummarized turns.
+    """
+    pending = unsummarized_messages(messages, summary_upto)
+    turn_starts = [i for i, m in enumerate(pending) if isinstance(m, HumanMessage)]
+    if len(turn_starts) <= trigger_turns or len(turn_starts) <= keep_turns:
+        return []
+    return pending[:turn_starts[-keep_turns]] if keep_turns > 0 else pending
+
+
+def render_transcript(messages: list[BaseMessage], tool_max_tokens: int = TOOL_RESULT_MAX_TOKENS) -> str:
+    """Render messages as a plain-text transcript for the summarizer."""
+    lines = []
+    for msg in messages:
+        if isinstance(msg, HumanMessage):
+            lines.append(f"User: {_content_text(msg)}")
+        elif isinstance(msg, ToolMessage):
+            collapsed = collapse_tool_message(msg, tool_max_tokens)
+            lines.append(f"Tool ({msg.name}): {_content_text(collapsed)}")
+        elif isinstance(msg, AIMessage):
+            text = _content_text(msg).strip()
+            if text:
+                lines.append(f"Assistant: {text}")
+            for call in msg.tool_calls or []:
+                lines.append(f"Assistant called {call.get('name')} with {call.get('args')}")
+    return "\n".join(lines)
@@ -0,0 +1,45 @@
+"""
+agent/intent.py
+---------------
+Cheap, rule-based classification of the user's message, run before any
+retrieval so trivial turns cost no database or embedding calls.
+
+is_small_talk() recognises acknowledgements, greetings and sign-offs
+("thanks!", "ok 👍", "hi there") — messages no uploaded document can help
+answer. It errs towards False: anything that might be a question is searched,
+as is any reply to a question from the assistant ("yes" to "Shall I
+summarize section 4?" needs the document) and any text outside the English
+word list, including other scripts.
+"""
+
+import re
+
+_SMALL_TALK_WORDS = frozenset({
+    "thanks", "thank", "you", "thx", "ty", "cheers", "ok", "okay", "k", "kk",
+    "cool", "great", "nice", "awesome", "perfect", "good", "got", "it",
+    "sure", "yes", "yep", "yeah", "no", "nope", "nah", "alright", "right",
+    "hi", "hello", "hey", "yo", "bye", "goodbye", "later", "see", "ya",
+    "morning", "evening", "night", "lol", "haha", "wow", "fine", "much",
+    "so", "very", "a", "lot", "there", "all", "that's", "thats", "sounds",
+    "makes", "sense", "understood", "noted", "done",
+})
+
+# Any-script words, so "Что написано в документе" is words, not an empty list.
+_WORD = re.compile(r"[\w']+")
+
+# Longer messages are never treated as small talk.
+_MAX_WORDS = 6
+
+
+def is_small_talk(text: str | None, previous_reply: str | None = None) -> bool:
+    """
+    True when the message is only pleasantries/acknowledgements, or only
+    emoji and punctuation. Always False when previous_reply (the assistant's
+    last message) asked a question, since any answer to it may need context.
+    """
+    if not text or not text.strip():
+        return True
+    if "?" in text or (previous_reply and previous_reply.rstrip().endswith("?")):
+        return False
+    words = _WORD.findall(text.lower())
+    return len(words) <= _MAX_WORDS and all(word in _SMALL_TALK_WORDS for word in words)
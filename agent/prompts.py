@@ -6,9 +6,34 @@ System prompt construction for the chat agent.
 Keeping prompts isolated here means:
   - Prompt changes produce clean, readable diffs in version control.
   - You can iterate on prompt text without touching any graph or tool logic.
-  - A/B testing prompt variants requires only changes in this file.
+  - A/B testing prompt variants requires no code change at all (see below).
+
+Sections are ordered from most to least stable (base prompt, memories,
+summary, documents) so provider-side prefix caching can reuse the longest
+possible prefix. Memories are ranked against each message (top-K) and
+documents are retrieved per turn, so build_turn_context() lets both move
+after the history altogether (PROMPT_LAYOUT="cache_friendly").
+
+Prompt registry: each PromptVariant bundles a base prompt and the section
+templates. Templates are split around their placeholder once, when the
+variant is registered, so rendering is concatenation, and the token cost of
+the fixed text is counted then too; only the dynamic values (memories,
+summary, document passages) are counted per turn by section_tokens().
+The built-in variant is "default". PROMPT_VARIANTS_FILE can register more
+from JSON, and PROMPT_VARIANT selects which one a thread uses: a single
+name, or "name:weight,..." to split threads between variants. A thread
+always gets the same variant, so its cached prompt prefix stays valid.
 """
 
+import hashlib
+import json
+
+from core.config import PROMPT_VARIANT, PROMPT_VARIANTS_FILE
+from core.logger import get_logger
+from core.tokens import count_tokens
+
+logger = get_logger(__name__)
+
 BASE_SYSTEM_PROMPT = (
     "You are an advanced AI assistant. "
     "For questions you can answer directly from your training knowledge — such as "
@@ -39,6 +64,12 @@ _MEMORY_INJECTION_TEMPLATE = (
     "{memories}"
 )
 
+_SUMMARY_TEMPLATE = (
+    "\n\n## Summary of Earlier Conversation\n"
+    "{summary}\n\n"
+    "Older messages in this thread are not shown; rely on this summary for them."
+)
+
 _DOC_CONTEXT_TEMPLATE = (
     "\n\n## Context from Uploaded Documents\n"
     "{doc_context}\n\n"
@@ -50,15 +81,190 @@ _DOC_CONTEXT_TEMPLATE = (
 )
 
 
-def build_system_prompt(memories: str, doc_context: str = "") -> str:
+# ---------------------------------------------------------------------------
+# Registry
+# ---------------------------------------------------------------------------
+
+class PromptTemplate:
+    """A section template with a single {field} placeholder, pre-split for rendering."""
+
+    def __init__(self, text: str, field: str):
+        parts = text.split("{" + field + "}")
+        if len(parts) != 2:
+            raise ValueError(f"Prompt template must contain {{{field}}} exactly once")
+        self.text = text
+        self._head, self._tail = parts
+        self.static_tokens = count_tokens(self._head + self._tail)
+
+    def render(self, value: str) -> str:
+        return self._head + value + self._tail
+
+
+class PromptVariant:
+    """
+    A named set of prompt sections. Token counts of the fixed text are
+    computed once here; section_tokens() adds the per-turn values.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base: str = BASE_SYSTEM_PROMPT,
+        memories: str = _MEMORY_INJECTION_TEMPLATE,
+        summary: str = _SUMMARY_TEMPLATE,
+        doc_context: str = _DOC_CONTEXT_TEMPLATE,
+    ):
+        self.name = name
+        self.base = base
+        self.base_tokens = count_tokens(base)
+        self.memories = PromptTemplate(memories, "memories")
+        self.summary = PromptTemplate(summary, "summary")
+        self.doc_context = PromptTemplate(doc_context, "doc_context")
+
+    def system_prompt(self, memories: str, doc_context: str = "", summary: str = "") -> str:
+        prompt = self.base
+        if memories:
+            prompt += self.memories.render(memories)
+        if summary:
+            prompt += self.summary.render(summary)
+        if doc_context:
+            prompt += self.doc_context.render(doc_context)
+        return prompt
+
+    def turn_context(self, memories: str = "", doc_context: str = "") -> str:
+        """Render the per-turn sections (memories, then documents) as one block."""
+        block = ""
+        if memories:
+            block += self.memories.render(memories)
+        if doc_context:
+            block += self.doc_context.render(doc_context)
+        return block.lstrip()
+
+    def section_tokens(self, memories: str = "", summary: str = "", doc_context: str = "") -> dict[str, int]:
+        """Return the tokens each system-prompt section costs for these values."""
+
+        def cost(template: PromptTemplate, value: str) -> int:
+            return template.static_tokens + count_tokens(value) if value else 0
+
+        return {
+            "base": self.base_tokens,
+            "memories": cost(self.memories, memories),
+            "summary": cost(self.summary, summary),
+            "doc": cost(self.doc_context, doc_context),
+        }
+
+
+DEFAULT_VARIANT = PromptVariant("default")
+
+_variants: dict[str, PromptVariant] = {DEFAULT_VARIANT.name: DEFAULT_VARIANT}
+
+
+def register_variant(variant: PromptVariant) -> PromptVariant:
+    """Add (or replace) a variant in the registry."""
+    _variants[variant.name] = variant
+    return variant
+
+
+def get_variant(name: str) -> PromptVariant:
+    """Return a registered variant, or the default one if name is unknown."""
+    return _variants.get(name, DEFAULT_VARIANT)
+
+
+# Section names a variants file may set; each maps to a PromptVariant argument.
+_SECTIONS = ("base", "memories", "summary", "doc_context")
+
+
+def load_variants(path: str) -> int:
+    """
+    Register the variants in a JSON file of the form
+    {"name": {"base": ..., "memories": ..., "summary": ..., "doc_context": ...}}.
+    Omitted sections use the default text. Every entry is validated before
+    any is registered, so a bad file changes nothing. Returns the number
+    registered.
+    """
+    with open(path, encoding="utf-8") as f:
+        specs = json.load(f)
+    if not isinstance(specs, dict):
+        raise ValueError("Prompt variants file must contain a JSON object of variants")
+    for name, sections in specs.items():
+        if not isinstance(sections, dict):
+            raise ValueError(f"Prompt variant {name!r} must be a JSON object of sections")
+        unknown = set(sections) - set(_SECTIONS)
+        if unknown:
+            raise ValueError(f"Prompt variant {name!r} has unknown sections: {', '.join(sorted(unknown))}")
+        for section, text in sections.items():
+            if not isinstance(text, str):
+                raise ValueError(f"Prompt variant {name!r} section {section!r} must be a string")
+    variants = [PromptVariant(name, **sections) for name, sections in specs.items()]
+    for variant in variants:
+        register_variant(variant)
+    return len(variants)
+
+
+def _parse_split(spec: list[str]) -> list[tuple[str, int]]:
+    """Turn ["a:70", "b:30"] (or ["a"]) into (name, weight) pairs of registered variants."""
+    split = []
+    for entry in spec:
+        name, _, weight = (part.strip() for part in entry.partition(":"))
+        if name in _variants and (not weight or weight.isdigit() and int(weight) > 0):
+            split.append((name, int(weight) if weight else 1))
+    return split
+
+
+def select_variant(thread_id: str, spec: list[str] = PROMPT_VARIANT) -> PromptVariant:
+    """
+    Pick the prompt variant for a thread from a PROMPT_VARIANT-style spec.
+    The choice is a stable hash of thread_id, so a thread never switches.
+    """
+    split = _parse_split(spec)
+    if not split:
+        return DEFAULT_VARIANT
+    if len(split) == 1:
+        return _variants[split[0][0]]
+    bucket = int(hashlib.sha256(thread_id.encode()).hexdigest()[:8], 16) % sum(w for _, w in split)
+    for name, weight in split:
+        if bucket < weight:
+            return _variants[name]
+        bucket -= weight
+    return DEFAULT_VARIANT
+
+
+if PROMPT_VARIANTS_FILE:
+    try:
+        logger.info(f"Loaded {load_variants(PROMPT_VARIANTS_FILE)} prompt variant(s) from {PROMPT_VARIANTS_FILE}")
+    except (OSError, ValueError, TypeError) as e:
+        logger.error(f"Could not load prompt variants from {PROMPT_VARIANTS_FILE}: {e}")
+
+if len(_parse_split(PROMPT_VARIANT)) < len(PROMPT_VARIANT):
+    logger.warning(
+        f"PROMPT_VARIANT={','.join(PROMPT_VARIANT)} has unknown variants or invalid weights; "
+        f"those entries are ignored (registered: {', '.join(_variants)})"
+    )
+
+
+# ---------------------------------------------------------------------------
+# Builders
+# ---------------------------------------------------------------------------
+
+def build_turn_context(memories: str, doc_context: str, variant: PromptVariant = DEFAULT_VARIANT) -> str:
+    """
+    Return the turn's memories and uploaded-document passages as a standalone
+    message body ("" when both are empty), for the cache-friendly layout
+    where it follows the conversation history.
+    """
+    return variant.turn_context(memories, doc_context)
+
+
+def build_system_prompt(
+    memories: str,
+    doc_context: str = "",
+    summary: str = "",
+    variant: PromptVariant = DEFAULT_VARIANT,
+) -> str:
     """
     Construct the full system prompt.
     Memories are injected with a critical-override instruction.
+    summary (rolling summary of folded-away turns) follows when present.
     doc_context (from uploaded PDFs) is appended when present.
     """
-    prompt = BASE_SYSTEM_PROMPT
-    if memories:
-        prompt += _MEMORY_INJECTION_TEMPLATE.format(memories=memories)
-    if doc_context:
-        prompt += _DOC_CONTEXT_TEMPLATE.format(doc_context=doc_context)
-    return prompt
+    return variant.system_prompt(memories, doc_context, summary)
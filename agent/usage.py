@@ -0,0 +1,81 @@
+"""
+agent/usage.py
+--------------
+Token usage instrumentation for LLM calls, focused on provider prompt caching.
+
+OpenAI reports how many prompt tokens were served from its prefix cache in
+usage_metadata["input_token_details"]["cache_read"] (ChatOpenAI needs
+stream_usage=True for streamed calls to carry usage). record_usage() logs
+each call at INFO and keeps per-process totals, read with usage_stats()
+(served by GET /stats).
+
+record_prompt() accumulates the prompt token breakdown (base, memories,
+summary, doc, history, tools) of each turn's first model call for each
+prompt variant; prompt_stats() reports the mean per turn, the data for
+comparing A/B variants (also served by GET /stats).
+"""
+
+import threading
+
+from langchain_core.messages import BaseMessage
+
+from core.logger import get_logger
+
+logger = get_logger(__name__)
+
+_lock = threading.Lock()
+_totals = {"calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+_prompt_totals: dict[str, dict[str, int]] = {}
+
+
+def record_usage(message: BaseMessage) -> dict | None:
+    """Record the usage carried by an LLM response; returns it, or None if absent."""
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return None
+    input_tokens = usage.get("input_tokens", 0) or 0
+    cached = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+    output_tokens = usage.get("output_tokens", 0) or 0
+
+    with _lock:
+        _totals["calls"] += 1
+        _totals["input_tokens"] += input_tokens
+        _totals["cached_tokens"] += cached
+        _totals["output_tokens"] += output_tokens
+
+    logger.info(
+        f"LLM usage: {input_tokens} input token(s), {cached} cached "
+        f"({cached / input_tokens:.0%}), {output_tokens} output"
+        if input_tokens else f"LLM usage: {output_tokens} output token(s)"
+    )
+    return {"input_tokens": input_tokens, "cached_tokens": cached, "output_tokens": output_tokens}
+
+
+def usage_stats() -> dict:
+    """Return cumulative token counts and the share of input tokens read from cache."""
+    with _lock:
+        totals = dict(_totals)
+    totals["cache_hit_ratio"] = (
+        totals["cached_tokens"] / totals["input_tokens"] if totals["input_tokens"] else 0.0
+    )
+    return totals
+
+
+def record_prompt(variant: str, sections: dict[str, int]) -> None:
+    """Add one turn's prompt token breakdown to the totals of its variant."""
+    with _lock:
+        totals = _prompt_totals.setdefault(variant, {"turns": 0})
+        totals["turns"] += 1
+        for section, tokens in sections.items():
+            totals[section] = totals.get(section, 0) + tokens
+
+
+def prompt_stats() -> dict[str, dict]:
+    """Return, per prompt variant, the turn count and mean tokens per section."""
+    with _lock:
+        snapshot = {name: dict(totals) for name, totals in _prompt_totals.items()}
+    stats = {}
+    for name, totals in snapshot.items():
+        turns = totals.pop("turns")
+        stats[name] = {"turns": turns, **{section: tokens / turns for section, tokens in totals.items()}}
+    return stats
@@ -7,6 +7,9 @@ Usage (from any tool):
     from cache.service import cached
 
     result = cached("tool_name", my_function, ttl_seconds=300, arg1, arg2)
+
+cache_get() / cache_set() are raw string accessors for callers that manage
+their own keys and encoding (e.g. core.embeddings' query-embedding tier).
 """
 
 import hashlib
@@ -69,3 +72,24 @@ def cached(tool_name: str, func, ttl_seconds: int, *args, **kwargs):
     except Exception as e:
         logger.error(f"Cache error for {tool_name}: {e}. Falling back to direct execution.")
         return func(*args, **kwargs)
+
+
+def cache_get(key: str) -> str | None:
+    """Return the cached string for key, or None if absent, Redis is off, or on error."""
+    if not _redis_client:
+        return None
+    try:
+        return _redis_client.get(key)
+    except Exception as e:
+        logger.warning(f"Cache read failed for {key}: {e}")
+        return None
+
+
+def cache_set(key: str, value: str, ttl_seconds: int) -> None:
+    """Store a string under key with a TTL. No-op if Redis is off; errors are logged."""
+    if not _redis_client:
+        return
+    try:
+        _redis_client.setex(key, ttl_seconds, value)
+    except Exception as e:
+        logger.warning(f"Cache write failed for {key}: {e}")
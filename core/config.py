@@ -6,6 +6,7 @@ Every other module reads configuration from here, never directly from os.getenv(
 """
 
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load .env file once, at import time.
@@ -29,12 +30,88 @@ def _csv_env(name: str, default: str) -> list[str]:
     return [item.strip() for item in value.split(",") if item.strip()]
 
 
+def _int_env(name: str, default: int) -> int:
+    """Return an integer environment variable, falling back to the default."""
+    value = os.getenv(name, "").strip()
+    return int(value) if value else default
+
+
+def _float_env(name: str, default: float) -> float:
+    """Return a float environment variable, falling back to the default."""
+    value = os.getenv(name, "").strip()
+    return float(value) if value else default
+
+
 # ---------------------------------------------------------------------------
 # LLM
 # ---------------------------------------------------------------------------
 OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
 LLM_MODEL: str = os.getenv("LLM_MODEL", "gpt-4o")  # Override in .env to switch models.
 
+# Prompt assembly (agent.graph): "cache_friendly" sends the stable system
+# prompt (base + summary) first, then history, then the per-turn memories and
+# document context, so provider prompt caching covers the prefix; "legacy"
+# folds memories and document context into the system prompt.
+PROMPT_LAYOUT: str = os.getenv("PROMPT_LAYOUT", "cache_friendly")
+
+# Prompt variant(s) from the agent.prompts registry: one name for every thread,
+# or "name:weight,..." to split threads between variants for an A/B test (a
+# thread always gets the same one). PROMPT_VARIANTS_FILE optionally points to
+# a JSON file of extra variants, so new prompt text needs no code change.
+PROMPT_VARIANT: list[str] = _csv_env("PROMPT_VARIANT", "default")
+PROMPT_VARIANTS_FILE: str = os.getenv("PROMPT_VARIANTS_FILE", "")
+
+# Long-term memory injection budget: once user_memory holds more facts than
+# this, only the MEMORY_TOP_K most relevant to the user's message are sent.
+# Set to 0 to always inject every fact.
+MEMORY_TOP_K: int = _int_env("MEMORY_TOP_K", 25)
+
+# Conversation window: prompt-token budget for thread history sent per call,
+# and the size earlier turns' tool results are collapsed to.
+HISTORY_MAX_TOKENS: int = _int_env("HISTORY_MAX_TOKENS", 16000)
+TOOL_RESULT_MAX_TOKENS: int = _int_env("TOOL_RESULT_MAX_TOKENS", 300)
+
+# Embeddings (core.embeddings): requests are split into batches of at most
+# EMBED_BATCH_MAX_TOKENS tokens / EMBED_BATCH_MAX_INPUTS texts, with up to
+# EMBED_CONCURRENCY requests in flight per process (one kept free of batches
+# for chat queries); rate-limited or transient failures are retried
+# EMBED_MAX_RETRIES times with exponential backoff.
+EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBED_BATCH_MAX_TOKENS: int = _int_env("EMBED_BATCH_MAX_TOKENS", 20000)
+EMBED_BATCH_MAX_INPUTS: int = _int_env("EMBED_BATCH_MAX_INPUTS", 64)
+EMBED_CONCURRENCY: int = _int_env("EMBED_CONCURRENCY", 4)
+EMBED_MAX_RETRIES: int = _int_env("EMBED_MAX_RETRIES", 5)
+
+# Query embeddings are memoized per process (LRU of QUERY_EMBED_CACHE_SIZE
+# entries) and, when Upstash Redis is configured, shared across processes
+# for QUERY_EMBED_CACHE_TTL_SECONDS.
+QUERY_EMBED_CACHE_SIZE: int = _int_env("QUERY_EMBED_CACHE_SIZE", 1024)
+QUERY_EMBED_CACHE_TTL_SECONDS: int = _int_env("QUERY_EMBED_CACHE_TTL_SECONDS", 86400)
+
+# Retrieval over uploaded PDFs: "hybrid" fuses full-text and vector rankings
+# (identifier-like queries use full-text only, skipping the embedding call);
+# "vector" is cosine similarity alone.
+RAG_RETRIEVAL_MODE: str = os.getenv("RAG_RETRIEVAL_MODE", "hybrid")
+
+# Retrieval post-processing (tools/rerank.py): each search over-fetches
+# RAG_CANDIDATES chunks, merges adjacent ones, keeps up to RAG_MAX_PASSAGES
+# diverse passages (MMR) and caps the injected block at RAG_CONTEXT_MAX_TOKENS.
+RAG_CANDIDATES: int = _int_env("RAG_CANDIDATES", 20)
+RAG_MAX_PASSAGES: int = _int_env("RAG_MAX_PASSAGES", 4)
+RAG_CONTEXT_MAX_TOKENS: int = _int_env("RAG_CONTEXT_MAX_TOKENS", 1500)
+
+# Automatic PDF context: passages farther than RAG_MAX_DISTANCE (cosine) from
+# the message are never injected, and only those within RAG_DISTANCE_MARGIN of
+# the best match are kept, so K adapts to how many passages really match.
+RAG_MAX_DISTANCE: float = _float_env("RAG_MAX_DISTANCE", 0.75)
+RAG_DISTANCE_MARGIN: float = _float_env("RAG_DISTANCE_MARGIN", 0.1)
+
+# Rolling summary: once a thread has more than SUMMARY_TRIGGER_TURNS
+# unsummarized turns, all but the last SUMMARY_KEEP_TURNS are folded into a
+# running summary after the response is sent.
+SUMMARY_TRIGGER_TURNS: int = _int_env("SUMMARY_TRIGGER_TURNS", 20)
+SUMMARY_KEEP_TURNS: int = _int_env("SUMMARY_KEEP_TURNS", 6)
+
 # ---------------------------------------------------------------------------
 # API
 # ---------------------------------------------------------------------------
@@ -43,6 +120,43 @@ CORS_ALLOWED_ORIGINS: list[str] = _csv_env(
     "http://localhost:5173,http://127.0.0.1:5173",
 )
 
+# Sidebar /threads listings are cached in-process for this many seconds.
+# Writes in the same worker invalidate immediately; 0 disables the cache.
+THREADS_CACHE_TTL_SECONDS: int = _int_env("THREADS_CACHE_TTL_SECONDS", 5)
+
+# Scraped web pages are kept this many days. document_chunks' web_scrape
+# partition is split into weekly ranges so expiry drops whole partitions.
+WEB_CHUNK_TTL_DAYS: int = _int_env("WEB_CHUNK_TTL_DAYS", 30)
+
+# How often each worker expires web_scrape chunks and creates the coming
+# weeks' partitions (tools/scraper.py). 0 runs the cleanup at startup only.
+WEB_CLEANUP_INTERVAL_HOURS: int = _int_env("WEB_CLEANUP_INTERVAL_HOURS", 24)
+
+# Per-thread document registry lookups (checked on every chat hop) are cached
+# in-process for this many seconds. Ingests and deletes invalidate every
+# worker via LISTEN/NOTIFY; the TTL bounds staleness if a notification is
+# missed. 0 disables the cache.
+THREAD_DOCS_CACHE_TTL_SECONDS: int = _int_env("THREAD_DOCS_CACHE_TTL_SECONDS", 30)
+
+# PDF uploads are spooled to disk and ingested page by page, so memory use
+# does not grow with file size; this cap bounds disk use and ingest time.
+UPLOAD_MAX_MB: int = _int_env("UPLOAD_MAX_MB", 100)
+
+# Chunks embedded and written per batch during PDF ingestion. Each batch is
+# fanned out across EMBED_CONCURRENCY embedding requests.
+INGEST_BATCH_CHUNKS: int = _int_env("INGEST_BATCH_CHUNKS", 256)
+
+# Background ingestion (ingestion.service): worker threads per process, where
+# uploads wait on disk until processed, how often each process heartbeats its
+# running jobs and sweeps for abandoned ones, and how long a running job may
+# go without a heartbeat before it is treated as abandoned and re-queued.
+INGEST_WORKERS: int = _int_env("INGEST_WORKERS", 2)
+UPLOAD_SPOOL_DIR: str = os.getenv(
+    "UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "chatbot-uploads")
+)
+INGEST_HEARTBEAT_SECONDS: int = _int_env("INGEST_HEARTBEAT_SECONDS", 15)
+INGEST_STALE_SECONDS: int = _int_env("INGEST_STALE_SECONDS", 60)
+
 # ---------------------------------------------------------------------------
 # LangSmith (optional tracing/observability)
 # ---------------------------------------------------------------------------
@@ -64,3 +178,7 @@ UPSTASH_REDIS_REST_TOKEN: str = os.getenv("UPSTASH_REDIS_REST_TOKEN", "")
 # PostgreSQL
 # ---------------------------------------------------------------------------
 DATABASE_URL: str = _required_env("DATABASE_URL")
+
+# Async checkpointer pool. Checkpoint reads/writes are short, so a small pool
+# serves many concurrent streaming turns — raise it under heavy load.
+CHECKPOINT_POOL_MAX_SIZE: int = _int_env("CHECKPOINT_POOL_MAX_SIZE", 10)
@@ -5,32 +5,78 @@ PostgreSQL connection factory and business table migrations.
 
 This is the single place that knows how to connect to the database and
 ensure the schema is correct. All other modules receive a pool via
-dependency injection — they never import from this file directly.
+dependency injection — they never create connections themselves. The only
+other imports from this file are the document_chunks partition helpers,
+which tools/scraper.py runs as part of its TTL cleanup.
+
+document_chunks layout (see ARCHITECTURE.md, "document_chunks storage"):
+
+    document_chunks                 PARTITION BY LIST (source_type)
+    ├── document_chunks_pdf         'pdf_upload' — never expires
+    ├── document_chunks_web         'web_scrape' — PARTITION BY RANGE (created_at)
+    │   ├── document_chunks_web_pYYYYMMDD   one per ISO week (Monday, UTC)
+    │   └── document_chunks_web_default     rows outside every weekly range
+    └── document_chunks_other       DEFAULT — any other source_type
 """
 
+import re
+from datetime import date, datetime, timedelta, timezone
+
 import psycopg
-from psycopg_pool import ConnectionPool
-from core.config import DATABASE_URL
+from psycopg import sql
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+from core.config import DATABASE_URL, WEB_CHUNK_TTL_DAYS
 from core.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Weekly web_scrape partitions are created this far ahead of today, so rows
+# keep landing in a droppable partition between restarts.
+WEB_PARTITION_WEEKS_AHEAD = 4
+
+_WEB_PARTITION_NAME = re.compile(r"^document_chunks_web_p(\d{8})$")
 
-def create_pool(min_size: int = 1, max_size: int = 5) -> ConnectionPool:
+
+def create_pool(min_size: int = 1, max_size: int = 5, configure=None) -> ConnectionPool:
     """
     Create and return a connection pool for business table queries.
     The pool automatically recycles stale connections and reconnects on failure,
     preventing the 500 errors that occur when a long-running server's single
     persistent connection goes stale.
+    `configure` runs on every new connection (e.g. to register type adapters).
     """
     return ConnectionPool(
         DATABASE_URL,
         min_size=min_size,
         max_size=max_size,
+        configure=configure,
         open=True,          # Open the pool immediately at startup
     )
 
 
+async def create_async_pool(
+    min_size: int = 1,
+    max_size: int = 10,
+    kwargs: dict | None = None,
+) -> AsyncConnectionPool:
+    """
+    Create, open and return an asyncio connection pool.
+    Used by the async execution path (LangGraph's AsyncPostgresSaver) so
+    streaming chat turns wait on the event loop instead of pinning a
+    threadpool worker for the whole LLM response.
+    Must be awaited from inside the running event loop (FastAPI lifespan).
+    """
+    pool = AsyncConnectionPool(
+        DATABASE_URL,
+        min_size=min_size,
+        max_size=max_size,
+        kwargs=kwargs,
+        open=False,         # AsyncConnectionPool must be opened with await
+    )
+    await pool.open()
+    return pool
+
+
 def run_migrations(pool: ConnectionPool) -> bool:
     """
     Create business tables and run any pending schema migrations.
@@ -74,6 +120,44 @@ def run_migrations(pool: ConnectionPool) -> bool:
             ADD COLUMN IF NOT EXISTS is_pinned BOOLEAN DEFAULT FALSE
         """)
 
+        # Turns not yet folded into the rolling summary (agent.graph.refresh_summary);
+        # NULL means unknown and is recounted from the checkpoint.
+        conn.execute("""
+            ALTER TABLE thread_metadata
+            ADD COLUMN IF NOT EXISTS pending_turns INTEGER
+        """)
+
+        # ingest_jobs: background PDF ingestion queue (ingestion.service)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                id          UUID PRIMARY KEY,
+                thread_id   TEXT NOT NULL,
+                filename    TEXT NOT NULL,
+                file_path   TEXT NOT NULL,
+                file_hash   TEXT NOT NULL,
+                status      VARCHAR(20) NOT NULL,
+                pages_done  INTEGER NOT NULL DEFAULT 0,
+                pages_total INTEGER,
+                chunks      INTEGER NOT NULL DEFAULT 0,
+                error       TEXT,
+                created_at  TIMESTAMPTZ DEFAULT NOW(),
+                updated_at  TIMESTAMPTZ DEFAULT NOW()
+            )
+        """)
+        # Process running a job (ingestion.service); its heartbeat is updated_at.
+        conn.execute("ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS owner TEXT")
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_ingest_jobs_pending
+            ON ingest_jobs (status, created_at)
+            WHERE status IN ('queued', 'running')
+        """)
+
+        # Sidebar ordering + keyset pagination (threads.service.get_threads_page)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_thread_metadata_sidebar
+            ON thread_metadata (is_pinned DESC, last_updated DESC, thread_id DESC)
+        """)
+
         conn.commit()
 
         # ── RAG: pgvector extension + document_chunks table ────────────────
@@ -83,26 +167,48 @@ def run_migrations(pool: ConnectionPool) -> bool:
         # (basic chat still works) rather than crashing the server.
         try:
             conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            _migrate_document_chunks(conn)
+            # One row per ingested upload — the chat path checks this instead of
+            # counting document_chunks. Backfilled once when first created.
+            registry_missing = conn.execute(
+                "SELECT to_regclass('public.thread_documents') IS NULL"
+            ).fetchone()[0]
             conn.execute("""
-                CREATE TABLE IF NOT EXISTS document_chunks (
-                    id          UUID PRIMARY KEY,
-                    thread_id   TEXT,
-                    source_type VARCHAR(50) NOT NULL,
-                    content     TEXT NOT NULL,
-                    metadata    JSONB,
-                    embedding   vector(1536),
-                    created_at  TIMESTAMPTZ DEFAULT NOW()
+                CREATE TABLE IF NOT EXISTS thread_documents (
+                    thread_id   TEXT NOT NULL,
+                    file_hash   TEXT NOT NULL,
+                    filename    TEXT NOT NULL,
+                    chunk_count INTEGER NOT NULL,
+                    uploaded_at TIMESTAMPTZ DEFAULT NOW(),
+                    PRIMARY KEY (thread_id, file_hash)
                 )
             """)
-            # Fast URL lookup for deduplication — used on every read_webpage call
+            if registry_missing:
+                conn.execute("""
+                    INSERT INTO thread_documents (thread_id, file_hash, filename, chunk_count, uploaded_at)
+                    SELECT thread_id, metadata->>'file_hash', MIN(metadata->>'filename'),
+                           COUNT(*), MAX(created_at)
+                    FROM document_chunks
+                    WHERE source_type = 'pdf_upload'
+                      AND thread_id IS NOT NULL
+                      AND metadata->>'file_hash' IS NOT NULL
+                    GROUP BY thread_id, metadata->>'file_hash'
+                    ON CONFLICT DO NOTHING
+                """)
+            # Content-addressed embedding cache (see core.embeddings.CachedEmbeddings)
             conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_document_chunks_url
-                ON document_chunks ((metadata->>'url'))
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    content_hash TEXT NOT NULL,
+                    model        TEXT NOT NULL,
+                    embedding    vector(1536) NOT NULL,
+                    created_at   TIMESTAMPTZ DEFAULT NOW(),
+                    PRIMARY KEY (content_hash, model)
+                )
             """)
-            # HNSW index for sub-millisecond approximate cosine similarity search
+            # Relevance ranking for long-term memory (see memory.service)
             conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_document_chunks_embedding
-                ON document_chunks USING hnsw (embedding vector_cosine_ops)
+                ALTER TABLE user_memory
+                ADD COLUMN IF NOT EXISTS embedding vector(1536)
             """)
             conn.commit()
             vector_ready = True
@@ -118,3 +224,170 @@ def run_migrations(pool: ConnectionPool) -> bool:
 
     logger.info("Migration: all migrations complete")
     return vector_ready
+
+
+# ---------------------------------------------------------------------------
+# document_chunks — partitioned table, indexes and partition maintenance
+# ---------------------------------------------------------------------------
+
+def _week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def _web_partition_name(week: date) -> str:
+    return f"document_chunks_web_p{week:%Y%m%d}"
+
+
+def ensure_web_partitions(conn, start: date, end: date) -> None:
+    """
+    Create the weekly document_chunks_web partitions covering [start, end].
+    Idempotent. A week whose rows already sit in the default partition is
+    skipped with a warning (those rows are still found, and expire by DELETE).
+    """
+    week = _week_start(start)
+    while week <= end:
+        lower = datetime(week.year, week.month, week.day, tzinfo=timezone.utc)
+        try:
+            with conn.transaction():     # savepoint: one failed week does not abort the rest
+                conn.execute(
+                    sql.SQL(
+                        "CREATE TABLE IF NOT EXISTS {} PARTITION OF document_chunks_web "
+                        "FOR VALUES FROM ({}) TO ({})"
+                    ).format(
+                        sql.Identifier(_web_partition_name(week)),
+                        sql.Literal(lower),
+                        sql.Literal(lower + timedelta(days=7)),
+                    )
+                )
+        except psycopg.Error as e:
+            logger.warning(f"Could not create partition {_web_partition_name(week)}: {e}")
+        week += timedelta(days=7)
+
+
+def drop_expired_web_partitions(conn, ttl_days: int = WEB_CHUNK_TTL_DAYS, now: datetime | None = None) -> list[str]:
+    """
+    Drop weekly web_scrape partitions whose whole range is older than
+    ttl_days. Returns the names of the dropped partitions; the caller commits.
+    """
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=ttl_days)
+    rows = conn.execute(
+        """
+        SELECT c.relname
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('public.document_chunks_web')
+        """
+    ).fetchall()
+
+    dropped = []
+    for (name,) in rows:
+        match = _WEB_PARTITION_NAME.match(name)
+        if not match:
+            continue
+        week = datetime.strptime(match.group(1), "%Y%m%d").replace(tzinfo=timezone.utc)
+        if week + timedelta(days=7) <= cutoff:
+            conn.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(name)))
+            dropped.append(name)
+    return sorted(dropped)
+
+
+def _migrate_document_chunks(conn) -> None:
+    """
+    Create (or convert to) the partitioned document_chunks table and its indexes.
+    Runs inside the pgvector migration transaction; the caller commits.
+    """
+    legacy = conn.execute(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass('public.document_chunks')"
+    ).fetchone()
+    converting = legacy is not None and legacy[0] == "r"
+    if converting:
+        # Pre-partitioning table: move it aside and free its index names.
+        logger.info("Migration: converting document_chunks to a partitioned table")
+        conn.execute("ALTER TABLE document_chunks RENAME TO document_chunks_legacy")
+        conn.execute("ALTER TABLE document_chunks_legacy DROP CONSTRAINT IF EXISTS document_chunks_pkey")
+        conn.execute("DROP INDEX IF EXISTS idx_document_chunks_url")
+        conn.execute("DROP INDEX IF EXISTS idx_document_chunks_embedding")
+
+    # Primary keys of partitioned tables must include every partition key.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS document_chunks (
+            id          UUID NOT NULL,
+            thread_id   TEXT,
+            source_type VARCHAR(50) NOT NULL,
+            content     TEXT NOT NULL,
+            metadata    JSONB,
+            embedding   vector(1536),
+            created_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (id, source_type, created_at)
+        ) PARTITION BY LIST (source_type)
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS document_chunks_pdf
+        PARTITION OF document_chunks FOR VALUES IN ('pdf_upload')
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS document_chunks_web
+        PARTITION OF document_chunks FOR VALUES IN ('web_scrape')
+        PARTITION BY RANGE (created_at)
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS document_chunks_web_default
+        PARTITION OF document_chunks_web DEFAULT
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS document_chunks_other
+        PARTITION OF document_chunks DEFAULT
+    """)
+    # Full-text vector for hybrid retrieval (document_rag.search_uploads).
+    # Added separately so tables created before it gain the column too.
+    conn.execute("""
+        ALTER TABLE document_chunks
+        ADD COLUMN IF NOT EXISTS content_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', content)) STORED
+    """)
+    today = datetime.now(timezone.utc).date()
+    ensure_web_partitions(
+        conn,
+        today - timedelta(days=WEB_CHUNK_TTL_DAYS),
+        today + timedelta(weeks=WEB_PARTITION_WEEKS_AHEAD),
+    )
+
+    if converting:
+        # Expired web pages are not carried over — the TTL cleanup would delete them anyway.
+        cursor = conn.execute(
+            """
+            INSERT INTO document_chunks
+                (id, thread_id, source_type, content, metadata, embedding, created_at)
+            SELECT id, thread_id, source_type, content, metadata, embedding,
+                   COALESCE(created_at, NOW())
+            FROM document_chunks_legacy
+            WHERE source_type <> 'web_scrape'
+               OR created_at >= NOW() - make_interval(days => %s)
+            """,
+            (WEB_CHUNK_TTL_DAYS,),
+        )
+        conn.execute("DROP TABLE document_chunks_legacy")
+        logger.info(f"Migration: moved {cursor.rowcount} chunk(s) into partitioned document_chunks")
+
+    # Indexes are declared on the partitioned parents, so every partition —
+    # including weekly ones created later — gets its own copy.
+    # Thread-scoped PDF retrieval, delete_thread and per-file lookups.
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_document_chunks_pdf_thread_file
+        ON document_chunks_pdf (thread_id, (metadata->>'file_hash'))
+    """)
+    # Lexical half of hybrid retrieval — only uploads are searched by text.
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_document_chunks_pdf_tsv
+        ON document_chunks_pdf USING gin (content_tsv)
+    """)
+    # URL dedup and URL-scoped retrieval (read_webpage), newest first.
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_document_chunks_web_url
+        ON document_chunks_web ((metadata->>'url'), created_at)
+    """)
+    # HNSW for approximate cosine search: one graph per leaf partition, so
+    # builds stay bounded and dropping an expired week drops its graph too.
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_document_chunks_embedding
+        ON document_chunks USING hnsw (embedding vector_cosine_ops)
+    """)
@@ -0,0 +1,390 @@
+"""
+core/embeddings.py
+------------------
+Shared embedding client for document ingestion, web scraping and memory ranking.
+
+embed_documents() splits its input into batches bounded by
+EMBED_BATCH_MAX_TOKENS (counted with tiktoken) and EMBED_BATCH_MAX_INPUTS,
+sends up to EMBED_CONCURRENCY batches at once, and retries each batch with
+exponential backoff on rate limits and transient API errors. Results keep
+the input order. Per-batch latency is logged at DEBUG, each embed_documents()
+call is summarized at INFO, and request counts and latencies accumulate in
+embedding_stats() (served by GET /stats).
+
+The concurrency limit is per process: every request, batches and
+embed_query() alike, holds one of EMBED_CONCURRENCY slots while it is on the
+wire, so parallel ingest jobs and chat turns cannot multiply the request
+rate against the API. Slots are released while a request sleeps on backoff.
+Batches are queued on an executor with one worker fewer than the slot count,
+so a large ingest never occupies every slot; embed_query() runs on the
+caller's thread and takes the spare slot instead of waiting behind queued
+batches.
+
+Callers (scraper, PDF ingest, memory ranking) go through CachedEmbeddings:
+  - embed_documents() first looks each chunk up in the embedding_cache table
+    by the SHA-256 of its whitespace-normalized text and the model name, so
+    identical chunks (boilerplate, the same PDF in several threads) are
+    embedded only once.
+  - embed_query() is memoized on (model, text) in a process-local LRU and,
+    when Upstash Redis is configured, a shared Redis tier — tool loops and
+    re-asked questions skip the embedding round-trip. Concurrent misses on
+    the same text are coalesced into one request (the context node's memory
+    and document lookups embed the same message at once). Hit/miss counts
+    and the hit ratio come from query_cache_stats() (served by GET /stats).
+"""
+
+import base64
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import openai
+from langchain_openai import OpenAIEmbeddings
+
+from core.config import (
+    EMBED_BATCH_MAX_INPUTS,
+    EMBED_BATCH_MAX_TOKENS,
+    EMBED_CONCURRENCY,
+    EMBED_MAX_RETRIES,
+    EMBEDDING_MODEL,
+    QUERY_EMBED_CACHE_SIZE,
+    QUERY_EMBED_CACHE_TTL_SECONDS,
+)
+from cache.service import cache_get, cache_set
+from core.logger import get_logger
+from core.tokens import count_tokens, truncate_tokens
+from tools.vector_utils import to_vector
+
+logger = get_logger(__name__)
+
+# Per-input limit of the text-embedding-3 models.
+_MAX_INPUT_TOKENS = 8191
+
+_RETRYABLE = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+_pool = None                # embedding cache; None disables it
+_instance = None
+_cached_instance = None
+_instance_lock = threading.Lock()
+
+
+def set_connection(pool) -> None:
+    """Inject the pool holding embedding_cache (requires pgvector). None disables the cache."""
+    global _pool
+    _pool = pool
+
+
+def _retry_after(error: Exception) -> float | None:
+    """Return the server's Retry-After hint in seconds, if it sent one."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class BatchedEmbeddings:
+    """
+    Drop-in for OpenAIEmbeddings (embed_documents / embed_query) that adds
+    token-budgeted batching, bounded concurrency and retry with backoff.
+    """
+
+    def __init__(
+        self,
+        client,
+        max_batch_tokens: int = EMBED_BATCH_MAX_TOKENS,
+        max_batch_inputs: int = EMBED_BATCH_MAX_INPUTS,
+        concurrency: int = EMBED_CONCURRENCY,
+        max_retries: int = EMBED_MAX_RETRIES,
+        backoff_seconds: float = 1.0,
+    ):
+        self._client = client
+        self._max_batch_tokens = max_batch_tokens
+        self._max_batch_inputs = max_batch_inputs
+        self._max_retries = max_retries
+        self._backoff_seconds = backoff_seconds
+        # In-flight API requests; batch workers are one fewer, which keeps a
+        # slot free for latency-sensitive queries.
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency - 1), thread_name_prefix="embed")
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "texts": 0, "tokens": 0, "retries": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+    def _record(self, texts: int, tokens: int, elapsed_ms: float) -> None:
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            self._stats["texts"] += texts
+            self._stats["tokens"] += tokens
+            self._stats["total_ms"] += elapsed_ms
+            self._stats["max_ms"] = max(self._stats["max_ms"], elapsed_ms)
+
+    def stats(self) -> dict:
+        """Return request, text and token counts plus mean/max request latency (ms)."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        total_ms = stats.pop("total_ms")
+        stats["mean_ms"] = total_ms / stats["requests"] if stats["requests"] else 0.0
+        return stats
+
+    def _batches(self, texts: list[str]) -> list[tuple[list[str], int]]:
+        """Split texts into (batch, token_count) pairs within the per-request budget."""
+        batches: list[tuple[list[str], int]] = []
+        batch: list[str] = []
+        batch_tokens = 0
+        for text in texts:
+            tokens = count_tokens(text)
+            if tokens > _MAX_INPUT_TOKENS:
+                text = truncate_tokens(text, _MAX_INPUT_TOKENS)
+                tokens = _MAX_INPUT_TOKENS
+            if batch and (
+                batch_tokens + tokens > self._max_batch_tokens
+                or len(batch) >= self._max_batch_inputs
+            ):
+                batches.append((batch, batch_tokens))
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append((batch, batch_tokens))
+        return batches
+
+    def _with_retry(self, fn, arg):
+        for attempt in range(self._max_retries + 1):
+            try:
+                with self._slots:
+                    return fn(arg)
+            except _RETRYABLE as e:
+                if attempt == self._max_retries:
+                    raise
+                delay = _retry_after(e) or self._backoff_seconds * 2 ** attempt * (0.5 + random.random())
+                with self._stats_lock:
+                    self._stats["retries"] += 1
+                logger.warning(
+                    f"Embedding request failed ({type(e).__name__}), "
+                    f"retry {attempt + 1}/{self._max_retries} in {delay:.1f}s"
+                )
+                time.sleep(delay)
+
+    def _embed_batch(self, index: int, total: int, batch: list[str], tokens: int) -> list[list[float]]:
+        started = time.perf_counter()
+        vectors = self._with_retry(self._client.embed_documents, batch)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._record(len(batch), tokens, elapsed_ms)
+        logger.debug(
+            f"Embedding batch {index + 1}/{total}: {len(batch)} text(s), ~{tokens} tokens "
+            f"in {elapsed_ms:.0f} ms"
+        )
+        return vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed texts in concurrent token-budgeted batches, preserving order."""
+        if not texts:
+            return []
+        started = time.perf_counter()
+        batches = self._batches(list(texts))
+        futures = [
+            self._executor.submit(self._embed_batch, i, len(batches), batch, tokens)
+            for i, (batch, tokens) in enumerate(batches)
+        ]
+        vectors: list[list[float]] = []
+        for future in futures:
+            vectors.extend(future.result())
+        logger.info(
+            f"Embedded {len(texts)} text(s) in {len(batches)} batch(es), "
+            f"~{sum(tokens for _, tokens in batches)} tokens, in {(time.perf_counter() - started) * 1000:.0f} ms"
+        )
+        return vectors
+
+    def _embed_query(self, text: str) -> list[float]:
+        started = time.perf_counter()
+        vector = self._with_retry(self._client.embed_query, text)
+        self._record(1, count_tokens(text), (time.perf_counter() - started) * 1000)
+        return vector
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed a single query string, with retry, without queueing behind batches."""
+        return self._embed_query(truncate_tokens(text, _MAX_INPUT_TOKENS))
+
+
+def content_hash(text: str) -> str:
+    """Return the cache key for a chunk: SHA-256 of its whitespace-normalized text."""
+    return hashlib.sha256(" ".join(text.split()).encode()).hexdigest()
+
+
+class CachedEmbeddings:
+    """
+    Wrap an embedding client with the content-addressed embedding_cache table.
+    Cache failures are logged and fall back to embedding — they never fail a caller.
+    """
+
+    def __init__(self, inner, model: str = EMBEDDING_MODEL, query_cache_size: int = QUERY_EMBED_CACHE_SIZE):
+        self._inner = inner
+        self._model = model
+        self._query_cache: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._query_cache_size = query_cache_size
+        self._query_lock = threading.Lock()
+        self._inflight: dict[str, Future] = {}
+        self._stats = {"lru_hits": 0, "redis_hits": 0, "coalesced": 0, "misses": 0}
+
+    def _lookup(self, hashes: list[str]) -> dict:
+        with _pool.connection() as conn:
+            cursor = conn.execute(
+                """
+                SELECT content_hash, embedding FROM embedding_cache
+                WHERE model = %s AND content_hash = ANY(%s)
+                """,
+                (self._model, hashes),
+            )
+            return dict(cursor.fetchall())
+
+    def _store(self, entries: dict) -> None:
+        with _pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.executemany(
+                    """
+                    INSERT INTO embedding_cache (content_hash, model, embedding)
+                    VALUES (%s, %s, %s) ON CONFLICT DO NOTHING
+                    """,
+                    [(key, self._model, to_vector(vector)) for key, vector in entries.items()],
+                )
+            conn.commit()
+
+    def embed_documents(self, texts: list[str]) -> list:
+        """Embed texts, sending only chunks not already cached (each once) to the API."""
+        if _pool is None or not texts:
+            return self._inner.embed_documents(texts)
+
+        keys = [content_hash(t) for t in texts]
+        try:
+            cached = self._lookup(list(set(keys)))
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed, embedding everything: {e}")
+            cached = {}
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        if missing:
+            fresh = dict(zip(missing, self._inner.embed_documents(list(missing.values()))))
+            try:
+                self._store(fresh)
+            except Exception as e:
+                logger.warning(f"Embedding cache write failed: {e}")
+            cached.update(fresh)
+
+        logger.debug(f"Embedding cache: {len(texts) - len(missing)} of {len(texts)} chunk(s) hit")
+        return [cached[key] for key in keys]
+
+    def _remember_query(self, key: str, vector: np.ndarray) -> None:
+        with self._query_lock:
+            self._query_cache[key] = vector
+            self._query_cache.move_to_end(key)
+            while len(self._query_cache) > self._query_cache_size:
+                self._query_cache.popitem(last=False)
+
+    def _count(self, outcome: str) -> None:
+        with self._query_lock:
+            self._stats[outcome] += 1
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """
+        Embed a query, served from the LRU, then Redis, then the API. A caller
+        that misses while the same text is already being fetched waits for
+        that result instead of sending a duplicate request.
+        """
+        key = f"embed:q:{self._model}:{hashlib.sha256(text.encode()).hexdigest()}"
+
+        with self._query_lock:
+            vector = self._query_cache.get(key)
+            if vector is not None:
+                self._query_cache.move_to_end(key)
+                self._stats["lru_hits"] += 1
+                return vector
+            pending = self._inflight.get(key)
+            if pending is None:
+                self._inflight[key] = future = Future()
+            else:
+                self._stats["coalesced"] += 1
+        if pending is not None:
+            return pending.result()
+
+        try:
+            vector = self._fetch_query(key, text)
+            future.set_result(vector)
+            return vector
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._query_lock:
+                self._inflight.pop(key, None)
+
+    def _fetch_query(self, key: str, text: str) -> np.ndarray:
+        """Resolve an LRU miss from Redis or the API, filling both tiers."""
+        encoded = cache_get(key)
+        if encoded:
+            try:
+                vector = np.frombuffer(base64.b64decode(encoded), dtype="<f4")
+                self._count("redis_hits")
+                self._remember_query(key, vector)
+                return vector
+            except ValueError as e:
+                logger.warning(f"Ignoring corrupt cached query embedding: {e}")
+
+        self._count("misses")
+        vector = to_vector(self._inner.embed_query(text))
+        self._remember_query(key, vector)
+        cache_set(key, base64.b64encode(vector.astype("<f4").tobytes()).decode(), QUERY_EMBED_CACHE_TTL_SECONDS)
+        return vector
+
+    def query_cache_stats(self) -> dict:
+        """Return query-embedding cache counters, hit ratio and current LRU size."""
+        with self._query_lock:
+            stats = {**self._stats, "size": len(self._query_cache)}
+        hits = stats["lru_hits"] + stats["redis_hits"] + stats["coalesced"]
+        lookups = hits + stats["misses"]
+        stats["hit_ratio"] = hits / lookups if lookups else 0.0
+        return stats
+
+
+def get_embeddings() -> BatchedEmbeddings:
+    """Return the process-wide embedding client, creating it on first use."""
+    global _instance
+    with _instance_lock:
+        if _instance is None:
+            _instance = BatchedEmbeddings(
+                OpenAIEmbeddings(
+                    model=EMBEDDING_MODEL,
+                    max_retries=0,                      # retried here, per batch
+                    check_embedding_ctx_length=False,   # inputs are pre-truncated above
+                )
+            )
+        return _instance
+
+
+def get_cached_embeddings() -> CachedEmbeddings:
+    """Return the process-wide cached client (chunk cache + query-embedding LRU)."""
+    global _cached_instance
+    inner = get_embeddings()
+    with _instance_lock:
+        if _cached_instance is None:
+            _cached_instance = CachedEmbeddings(inner)
+        return _cached_instance
+
+
+def embedding_stats() -> dict:
+    """Return request counters and latency of the shared embedding client."""
+    return get_embeddings().stats()
+
+
+def query_cache_stats() -> dict:
+    """Return hit/miss counters of the shared query-embedding cache."""
+    return get_cached_embeddings().query_cache_stats()
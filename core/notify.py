@@ -0,0 +1,75 @@
+"""
+core/notify.py
+--------------
+Cross-process cache invalidation over Postgres LISTEN/NOTIFY.
+
+Services that cache table contents in-process issue pg_notify(channel,
+payload) in the same transaction as each write; a ChangeListener per
+channel holds a dedicated LISTEN connection in a background thread and
+calls on_change(payload) for every notification, so other uvicorn workers
+drop their copy as soon as the write commits.
+
+on_change(None) means "assume everything changed": it is called on every
+(re)connect and disconnect, since notifications sent while the listener was
+not connected are lost.
+"""
+
+import threading
+from collections.abc import Callable
+
+import psycopg
+
+from core.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class ChangeListener:
+    """Background LISTEN on one channel, reconnecting with backoff on failure."""
+
+    def __init__(self, channel: str, on_change: Callable[[str | None], None], name: str):
+        self.channel = channel
+        self._on_change = on_change
+        self._name = name
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def _loop(self, conninfo: str) -> None:
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(conninfo, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {self.channel}")
+                    # Notifications may have been missed while disconnected.
+                    self._on_change(None)
+                    backoff = 1
+                    while not self._stop.is_set():
+                        for notify in conn.notifies(timeout=5.0):
+                            self._on_change(notify.payload or None)
+            except Exception as e:
+                logger.warning(f"Change listener on {self.channel} disconnected: {e}. Retrying in {backoff}s.")
+                self._on_change(None)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def start(self, conninfo: str) -> None:
+        """Start the background LISTEN thread. Safe to call more than once."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._loop, args=(conninfo,), name=self._name, daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Signal the LISTEN thread to exit and wait briefly for it."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self._thread = None
+
+
+def notify(conn, channel: str, payload: str = "") -> None:
+    """Queue a notification on channel; Postgres delivers it when conn commits."""
+    conn.execute("SELECT pg_notify(%s, %s)", (channel, payload))
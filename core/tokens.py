@@ -0,0 +1,25 @@
+"""
+core/tokens.py
+--------------
+Shared tiktoken encoder for token counting and truncation.
+
+Loaded once at import time and reused by the scraper's text splitter,
+the conversation-window trimmer, and prompt accounting.
+"""
+
+import tiktoken
+
+_enc = tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    """Return the number of tokens in text."""
+    return len(_enc.encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Return text cut to at most max_tokens tokens."""
+    tokens = _enc.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return _enc.decode(tokens[:max_tokens])
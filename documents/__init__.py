@@ -0,0 +1 @@
+# documents package
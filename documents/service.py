@@ -0,0 +1,173 @@
+"""
+documents/service.py
+--------------------
+The thread_documents registry: one row per PDF upload that finished ingesting
+(thread, file hash, filename, chunk count, upload time).
+
+Lookups run once per chat turn in the context node ("does this thread have
+uploads?"), for upload dedup and for GET /threads/{id}/files, so they are
+served from an in-process cache instead of scanning document_chunks. Every registry write issues a
+NOTIFY on DOCUMENTS_CHANNEL, carrying the thread ID, in the same transaction;
+start_change_listener() LISTENs on that channel so other uvicorn workers drop
+their copy too, the same way memory/service.py keeps user_memory coherent.
+THREAD_DOCS_CACHE_TTL_SECONDS bounds staleness if a notification is missed.
+Each invalidation bumps a version, and a read only caches its rows if no
+invalidation landed while it was querying, so a read racing a NOTIFY cannot
+put pre-write rows back for a whole TTL.
+
+Writes take the caller's connection and leave the commit to the caller, so
+ingest_pdf and delete_thread keep the registry in step with document_chunks;
+callers drop this worker's entry with invalidate_thread_documents() once
+they have committed.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from core.config import THREAD_DOCS_CACHE_TTL_SECONDS
+from core.logger import get_logger
+from core.notify import ChangeListener, notify
+
+logger = get_logger(__name__)
+
+_pool = None
+
+DOCUMENTS_CHANNEL = "thread_documents_changed"
+
+# thread_documents rows keyed by thread_id → (expires_at, rows).
+_DOCS_CACHE_SIZE = 1024
+_docs_cache: OrderedDict[str, tuple[float, list[dict]]] = OrderedDict()
+_docs_lock = threading.Lock()
+# Invalidation versions: _epoch moves on a full clear, _versions per thread
+# (reset with the epoch, so it only holds threads changed since the last clear).
+_epoch = 0
+_versions: dict[str, int] = {}
+
+
+def set_connection(pool) -> None:
+    """Inject the connection pool. Must be called once at startup."""
+    global _pool
+    _pool = pool
+    invalidate_thread_documents()
+
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+
+def invalidate_thread_documents(thread_id: str | None = None) -> None:
+    """Drop the cached registry rows for one thread, or for all threads."""
+    global _epoch
+    with _docs_lock:
+        if thread_id is None:
+            _docs_cache.clear()
+            _versions.clear()
+            _epoch += 1
+        else:
+            _docs_cache.pop(thread_id, None)
+            _versions[thread_id] = _versions.get(thread_id, 0) + 1
+
+
+def _version(thread_id: str) -> tuple[int, int]:
+    """Return the thread's invalidation version; call with _docs_lock held."""
+    return _epoch, _versions.get(thread_id, 0)
+
+
+def _notify_change(conn, thread_id: str) -> None:
+    """Queue a cross-worker invalidation of one thread; Postgres delivers it on commit."""
+    notify(conn, DOCUMENTS_CHANNEL, thread_id)
+
+
+# ---------------------------------------------------------------------------
+# Cross-process invalidation (LISTEN/NOTIFY, core/notify.py)
+# ---------------------------------------------------------------------------
+
+# The payload is the thread ID; None (reconnect) drops every thread.
+_listener = ChangeListener(DOCUMENTS_CHANNEL, invalidate_thread_documents, name="documents-listener")
+
+
+def start_change_listener(conninfo: str) -> None:
+    """Start the background LISTEN thread. Safe to call more than once."""
+    _listener.start(conninfo)
+
+
+def stop_change_listener() -> None:
+    """Signal the LISTEN thread to exit and wait briefly for it."""
+    _listener.stop()
+
+
+# ---------------------------------------------------------------------------
+# Reads
+# ---------------------------------------------------------------------------
+
+def get_thread_documents(thread_id: str, fresh: bool = False) -> list[dict]:
+    """
+    Return this thread's uploads, newest first, as dicts with filename,
+    file_hash, chunks and uploaded_at. Served from the in-process cache
+    unless fresh=True. Raises on database errors.
+    """
+    now = time.monotonic()
+    with _docs_lock:
+        if not fresh:
+            entry = _docs_cache.get(thread_id)
+            if entry is not None and entry[0] > now:
+                _docs_cache.move_to_end(thread_id)
+                return entry[1]
+        version = _version(thread_id)
+
+    with _pool.connection() as conn:
+        cursor = conn.execute(
+            """
+            SELECT filename, file_hash, chunk_count, uploaded_at
+            FROM thread_documents
+            WHERE thread_id = %s
+            ORDER BY uploaded_at DESC
+            """,
+            (thread_id,),
+        )
+        rows = [
+            {"filename": row[0], "file_hash": row[1], "chunks": row[2], "uploaded_at": row[3]}
+            for row in cursor.fetchall()
+        ]
+
+    if THREAD_DOCS_CACHE_TTL_SECONDS > 0:
+        with _docs_lock:
+            # An invalidation that landed while we were reading makes these rows stale.
+            if _version(thread_id) != version:
+                return rows
+            _docs_cache[thread_id] = (now + THREAD_DOCS_CACHE_TTL_SECONDS, rows)
+            _docs_cache.move_to_end(thread_id)
+            while len(_docs_cache) > _DOCS_CACHE_SIZE:
+                _docs_cache.popitem(last=False)
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# Writes — run on the caller's connection; the caller commits
+# ---------------------------------------------------------------------------
+
+def register_document(conn, thread_id: str, file_hash: str, filename: str, chunk_count: int) -> bool:
+    """
+    Add an upload to the registry. Returns False if this file is already
+    registered for the thread (a concurrent ingest won), in which case
+    nothing is written.
+    """
+    cursor = conn.execute(
+        """
+        INSERT INTO thread_documents (thread_id, file_hash, filename, chunk_count)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (thread_id, file_hash) DO NOTHING
+        """,
+        (thread_id, file_hash, filename, chunk_count),
+    )
+    if cursor.rowcount <= 0:
+        return False
+    _notify_change(conn, thread_id)
+    return True
+
+
+def delete_thread_documents(conn, thread_id: str) -> None:
+    """Remove every registry row for a thread."""
+    conn.execute("DELETE FROM thread_documents WHERE thread_id = %s", (thread_id,))
+    _notify_change(conn, thread_id)
@@ -3,7 +3,7 @@ import { Send, Square, Paperclip, Loader2, CheckCircle2, AlertCircle } from 'luc
 import clsx from 'clsx';
 import { chatService } from '../../services/chatService';
 
-const MAX_FILE_SIZE_MB = 10;
+const MAX_FILE_SIZE_MB = 100;  // keep in sync with UPLOAD_MAX_MB on the server
 
 /** Map backend status → UI feedback */
 const UPLOAD_MESSAGES = {
@@ -22,9 +22,9 @@ export function streamReducer(state, action) {
       return {
         ...state,
         status: 'SUCCESS',
-        // Stamp a stable id on each message loaded from history so MessageList
-        // can use key={msg.id} instead of key={index}.
-        messages: action.payload.map((msg) => ({ ...msg, id: crypto.randomUUID() })),
+        // History messages carry their server-side id; stamp one on any that
+        // lack it so MessageList can use key={msg.id} instead of key={index}.
+        messages: action.payload.map((msg) => ({ ...msg, id: msg.id ?? crypto.randomUUID() })),
         error: null,
       };
     case 'START_STREAM':
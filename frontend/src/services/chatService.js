@@ -28,12 +28,33 @@ export const chatService = {
         return response.data;
     },
 
-    uploadFile: async (file, threadId) => {
+    // Uploads are ingested by a background job; resolves once the job finishes.
+    uploadFile: async (file, threadId, { onProgress } = {}) => {
         const formData = new FormData();
         formData.append('file', file);
         formData.append('thread_id', threadId);
         const response = await apiClient.post('/upload', formData);
-        return response.data;
+        return chatService.waitForUpload(response.data.job_id, { onProgress });
+    },
+
+    // Poll an ingestion job. Resolves with the job on success/duplicate and
+    // rejects (axios-style error with response.data.detail) on empty/failed,
+    // or once maxWaitMs passes without the job finishing.
+    waitForUpload: async (jobId, { onProgress, intervalMs = 1000, maxWaitMs = 10 * 60 * 1000 } = {}) => {
+        const uploadError = (detail) => {
+            const error = new Error(detail);
+            error.response = { data: { detail } };
+            return error;
+        };
+        const deadline = Date.now() + maxWaitMs;
+        while (Date.now() < deadline) {
+            const { data } = await apiClient.get(`/upload/${jobId}`);
+            onProgress?.(data);
+            if (data.status === 'success' || data.status === 'duplicate') return data;
+            if (data.status === 'empty' || data.status === 'failed') throw uploadError(data.message);
+            await new Promise((resolve) => setTimeout(resolve, intervalMs));
+        }
+        throw uploadError('Processing the file is taking longer than expected. Please try again later.');
     },
 
     getThreadFiles: async (threadId) => {
@@ -0,0 +1 @@
+# ingestion package
@@ -0,0 +1,338 @@
+"""
+ingestion/service.py
+--------------------
+Background job queue for PDF ingestion.
+
+/upload spools the file to UPLOAD_SPOOL_DIR, calls enqueue_job() and returns the
+job id straight away; a fixed pool of INGEST_WORKERS threads runs
+document_rag.ingest_pdf() off the request path and records progress
+(pages read, chunks stored) in the ingest_jobs table, which
+GET /upload/{job_id} reads via get_job().
+
+Jobs live in Postgres, so they survive restarts. A worker claims a job with
+a conditional UPDATE that records this process as its owner, so a job is
+never processed twice even when several processes resume it. A monitor
+thread heartbeats the owner's running jobs every INGEST_HEARTBEAT_SECONDS
+and sweeps with resume_pending(), which re-queues running jobs whose owner
+stopped heartbeating for INGEST_STALE_SECONDS (the process died) and picks
+up queued jobs. On shutdown, stop_workers() stops the workers ahead of any
+queued work; a job still running is abandoned at its next batch, or reset
+to queued if its worker does not exit in time.
+
+The connection is injected via set_connection() once at startup.
+"""
+
+import os
+import queue
+import socket
+import threading
+import uuid
+
+from core.config import INGEST_HEARTBEAT_SECONDS, INGEST_STALE_SECONDS, INGEST_WORKERS
+from core.logger import get_logger
+from tools import document_rag
+
+logger = get_logger(__name__)
+
+_pool = None
+
+_queue: queue.Queue = queue.Queue()
+_workers: list[threading.Thread] = []
+_monitor: threading.Thread | None = None
+_STOP = object()
+_stopping = threading.Event()
+
+# Job ids waiting in _queue, so sweeps do not queue the same job twice.
+_enqueued: set[str] = set()
+_enqueued_lock = threading.Lock()
+
+# Recorded on claimed jobs; heartbeats and shutdown only touch this process's jobs.
+_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class _Interrupted(Exception):
+    """Raised from the progress callback to abandon a job on shutdown."""
+
+
+def set_connection(pool) -> None:
+    """Inject the connection pool. Must be called before any function is used."""
+    global _pool
+    _pool = pool
+
+
+# ---------------------------------------------------------------------------
+# Jobs
+# ---------------------------------------------------------------------------
+
+def _put(job_id: str) -> bool:
+    """Hand a job to the workers unless it is already waiting. Returns True if queued."""
+    with _enqueued_lock:
+        if job_id in _enqueued:
+            return False
+        _enqueued.add(job_id)
+    _queue.put(job_id)
+    return True
+
+
+def enqueue_job(path: str, filename: str, thread_id: str, file_hash: str) -> str:
+    """
+    Record a queued job for a spooled upload and hand it to the workers.
+    If the same file is already queued or running for this thread, the
+    spooled copy is discarded and the existing job id is returned.
+    """
+    with _pool.connection() as conn:
+        existing = conn.execute(
+            """
+            SELECT id FROM ingest_jobs
+            WHERE thread_id = %s AND file_hash = %s AND status IN ('queued', 'running')
+            LIMIT 1
+            """,
+            (thread_id, file_hash),
+        ).fetchone()
+        if existing:
+            _remove_file(path)
+            return str(existing[0])
+
+        job_id = str(uuid.uuid4())
+        conn.execute(
+            """
+            INSERT INTO ingest_jobs (id, thread_id, filename, file_path, file_hash, status)
+            VALUES (%s, %s, %s, %s, %s, 'queued')
+            """,
+            (job_id, thread_id, filename, path, file_hash),
+        )
+        conn.commit()
+
+    _put(job_id)
+    logger.info(f"Ingest job {job_id} queued for '{filename}' in thread {thread_id}")
+    return job_id
+
+
+def get_job(job_id: str) -> dict | None:
+    """Return a job's status and progress, or None if no such job exists."""
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        return None
+    with _pool.connection() as conn:
+        row = conn.execute(
+            """
+            SELECT id, thread_id, filename, status, pages_done, pages_total, chunks, error
+            FROM ingest_jobs WHERE id = %s
+            """,
+            (job_id,),
+        ).fetchone()
+    if row is None:
+        return None
+    return {
+        "job_id": str(row[0]),
+        "thread_id": row[1],
+        "filename": row[2],
+        "status": row[3],
+        "pages_done": row[4],
+        "pages_total": row[5],
+        "chunks": row[6],
+        "error": row[7],
+    }
+
+
+def _claim(job_id: str) -> tuple | None:
+    """Atomically move a queued job to running. Returns its row, or None if taken."""
+    with _pool.connection() as conn:
+        row = conn.execute(
+            """
+            UPDATE ingest_jobs SET status = 'running', owner = %s, updated_at = NOW()
+            WHERE id = %s AND status = 'queued'
+            RETURNING file_path, filename, thread_id, file_hash
+            """,
+            (_OWNER, job_id),
+        ).fetchone()
+        conn.commit()
+    return row
+
+
+def _update(job_id: str, **fields) -> None:
+    columns = ", ".join(f"{name} = %s" for name in fields)
+    with _pool.connection() as conn:
+        conn.execute(
+            f"UPDATE ingest_jobs SET {columns}, updated_at = NOW() WHERE id = %s",
+            (*fields.values(), job_id),
+        )
+        conn.commit()
+
+
+def _release_owned(job_id: str | None = None) -> int:
+    """
+    Reset this process's running jobs (or just job_id) to queued, for another
+    worker or the next start to pick up. Returns the number of jobs reset.
+    """
+    sql = "UPDATE ingest_jobs SET status = 'queued', owner = NULL, updated_at = NOW() WHERE status = 'running' AND owner = %s"
+    params: tuple = (_OWNER,)
+    if job_id is not None:
+        sql += " AND id = %s"
+        params += (job_id,)
+    with _pool.connection() as conn:
+        cursor = conn.execute(sql, params)
+        conn.commit()
+    return cursor.rowcount
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove spooled upload {path}: {e}")
+
+
+def run_job(job_id: str) -> None:
+    """
+    Claim and process one job. Never raises — failures are recorded on the job.
+    A job interrupted by stop_workers() goes back to queued with its spooled file.
+    """
+    claimed = _claim(job_id)
+    if claimed is None:
+        return
+    path, filename, thread_id, file_hash = claimed
+    requeued = False
+
+    def progress(pages_done: int, pages_total: int, chunks: int) -> None:
+        _update(job_id, pages_done=pages_done, pages_total=pages_total, chunks=chunks)
+        if _stopping.is_set():
+            raise _Interrupted()
+
+    try:
+        if not os.path.exists(path):
+            raise FileNotFoundError("spooled upload is missing (was the server moved or cleaned?)")
+        result = document_rag.ingest_pdf(path, filename, thread_id, file_hash, progress=progress)
+        _update(job_id, status=result["status"], chunks=result["chunks"])
+        logger.info(f"Ingest job {job_id} finished: {result['status']} ({result['chunks']} chunks)")
+    except _Interrupted:
+        try:
+            requeued = _release_owned(job_id) > 0
+            logger.info(f"Ingest job {job_id} interrupted by shutdown; re-queued")
+        except Exception:
+            logger.exception(f"Could not re-queue interrupted ingest job {job_id}")
+    except Exception as e:
+        logger.exception(f"Ingest job {job_id} failed for '{filename}'")
+        try:
+            _update(job_id, status="failed", error=str(e)[:500])
+        except Exception:
+            logger.exception(f"Could not record failure for ingest job {job_id}")
+    finally:
+        if not requeued:
+            _remove_file(path)
+
+
+# ---------------------------------------------------------------------------
+# Worker pool
+# ---------------------------------------------------------------------------
+
+def _worker_loop() -> None:
+    while not _stopping.is_set():
+        job_id = _queue.get()
+        try:
+            if job_id is _STOP:
+                return
+            with _enqueued_lock:
+                _enqueued.discard(job_id)
+            if _stopping.is_set():
+                return      # stays queued in Postgres for the next start
+            run_job(job_id)
+        finally:
+            _queue.task_done()
+
+
+def _heartbeat() -> None:
+    """Mark this process's running jobs as alive."""
+    with _pool.connection() as conn:
+        conn.execute(
+            "UPDATE ingest_jobs SET updated_at = NOW() WHERE status = 'running' AND owner = %s",
+            (_OWNER,),
+        )
+        conn.commit()
+
+
+def _monitor_loop(interval: float) -> None:
+    while not _stopping.wait(interval):
+        try:
+            _heartbeat()
+            resume_pending()
+        except Exception as e:
+            logger.warning(f"Ingest job sweep failed: {e}")
+
+
+def resume_pending() -> int:
+    """
+    Re-queue running jobs whose owner has not heartbeated for
+    INGEST_STALE_SECONDS, then hand every queued job not already waiting here
+    to the workers. Returns the number of jobs queued.
+    """
+    with _pool.connection() as conn:
+        cursor = conn.execute(
+            """
+            UPDATE ingest_jobs SET status = 'queued', owner = NULL, updated_at = NOW()
+            WHERE status = 'running'
+              AND updated_at < NOW() - make_interval(secs => %s)
+            """,
+            (INGEST_STALE_SECONDS,),
+        )
+        abandoned = cursor.rowcount
+        rows = conn.execute(
+            "SELECT id FROM ingest_jobs WHERE status = 'queued' ORDER BY created_at"
+        ).fetchall()
+        conn.commit()
+    queued = sum(_put(str(row[0])) for row in rows)
+    if abandoned > 0:
+        logger.info(f"Re-queued {abandoned} abandoned ingest job(s)")
+    if queued:
+        logger.info(f"Resumed {queued} pending ingest job(s)")
+    return queued
+
+
+def start_workers(count: int = INGEST_WORKERS, heartbeat_seconds: float = INGEST_HEARTBEAT_SECONDS) -> None:
+    """Start the ingestion worker threads and the heartbeat/sweep monitor. Safe to call more than once."""
+    global _monitor
+    if any(t.is_alive() for t in _workers):
+        return
+    _stopping.clear()
+    _workers.clear()
+    for i in range(count):
+        worker = threading.Thread(target=_worker_loop, name=f"ingest-worker-{i}", daemon=True)
+        worker.start()
+        _workers.append(worker)
+    _monitor = threading.Thread(
+        target=_monitor_loop, args=(heartbeat_seconds,), name="ingest-monitor", daemon=True
+    )
+    _monitor.start()
+
+
+def stop_workers(timeout: float = 10) -> None:
+    """
+    Stop the workers ahead of any queued work. A worker mid-job abandons it
+    at its next batch; jobs still running after timeout are reset to queued.
+    Queued jobs stay 'queued' in Postgres and are resumed on the next start.
+    """
+    global _monitor
+    _stopping.set()
+    for _ in _workers:
+        _queue.put(_STOP)
+    for worker in _workers:
+        worker.join(timeout=timeout)
+    if _monitor is not None:
+        _monitor.join(timeout=timeout)
+    _monitor = None
+    _workers.clear()
+    with _enqueued_lock:
+        _enqueued.clear()
+    while not _queue.empty():
+        _queue.get_nowait()
+        _queue.task_done()
+    if _pool is not None:
+        try:
+            released = _release_owned()
+            if released:
+                logger.info(f"Re-queued {released} ingest job(s) still running at shutdown")
+        except Exception:
+            logger.exception("Could not re-queue ingest jobs at shutdown")
@@ -3,22 +3,31 @@ langgraph_tool_backend.py
 -------------------------
 Application startup and dependency wiring.
 
-Importing this module is intentionally side-effect free. Call init_backend()
+Importing this module is intentionally side-effect free. Await init_backend()
 from FastAPI lifespan startup to open pools, run migrations, inject service
 dependencies, and compile the LangGraph agent.
+
+The checkpointer runs on an asyncio pool (AsyncPostgresSaver) so /chat can
+drive the graph with astream() on the event loop; business services keep
+their sync pool and are called from the threadpool for short queries only.
 """
 
-from langgraph.checkpoint.postgres import PostgresSaver
-from psycopg_pool import ConnectionPool
+import threading
+
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 
-from core.config import DATABASE_URL
-from core.database import create_pool, run_migrations
+from core.config import CHECKPOINT_POOL_MAX_SIZE, DATABASE_URL
+from core.database import create_async_pool, create_pool, run_migrations
+import core.embeddings as embeddings
 import memory.service as memory_service
 import tools.memory_tools as memory_tools
 import threads.service as threads_service
+import documents.service as document_service
+import ingestion.service as ingestion_service
 import tools.scraper as scraper_tools
 import tools.document_rag as document_rag
 from agent.graph import llm, init_graph
+from tools.vector_utils import register_vector
 
 business_pool = None
 lg_pool = None
@@ -27,7 +36,7 @@ chatbot = None
 vector_ready = False
 
 
-def init_backend() -> None:
+async def init_backend() -> None:
     """Open pools, run migrations, inject dependencies, and compile the graph."""
     global business_pool, lg_pool, checkpointer, chatbot, vector_ready
 
@@ -35,38 +44,59 @@ def init_backend() -> None:
         return
 
     # Keep business queries and LangGraph checkpoint writes on separate pools.
-    business_pool = create_pool()
+    business_pool = create_pool(configure=register_vector)
     vector_ready = run_migrations(business_pool)
+    if vector_ready:
+        # Connections opened before CREATE EXTENSION lack the vector adapters.
+        business_pool.drain()
+        embeddings.set_connection(business_pool)
 
     memory_service.set_connection(business_pool)
+    memory_service.set_embeddings(embeddings.get_cached_embeddings())
+    memory_service.set_vector_available(vector_ready)
+    memory_service.start_change_listener(DATABASE_URL)
+    # Index facts saved before relevance ranking existed, off the startup path.
+    threading.Thread(
+        target=memory_service.backfill_embeddings, name="memory-backfill", daemon=True
+    ).start()
     memory_tools.set_connection(business_pool)
     threads_service.set_connection(business_pool)
     threads_service.set_llm(llm)
     scraper_tools.set_connection(business_pool)
     scraper_tools.set_vector_available(vector_ready)
+    scraper_tools.start_cleanup_scheduler()
+    document_service.set_connection(business_pool)
+    document_service.start_change_listener(DATABASE_URL)
     document_rag.set_connection(business_pool)
     document_rag.set_vector_available(vector_ready)
+    ingestion_service.set_connection(business_pool)
+    if vector_ready:
+        ingestion_service.start_workers()
+        ingestion_service.resume_pending()
 
-    lg_pool = ConnectionPool(
-        DATABASE_URL,
-        min_size=1,
-        max_size=5,
-        open=True,
+    lg_pool = await create_async_pool(
+        max_size=CHECKPOINT_POOL_MAX_SIZE,
         kwargs={"autocommit": True},
     )
-    checkpointer = PostgresSaver(lg_pool)
-    checkpointer.setup()
+    checkpointer = AsyncPostgresSaver(lg_pool)
+    await checkpointer.setup()
     chatbot = init_graph(checkpointer)
 
 
-def shutdown_backend() -> None:
-    """Close database pools if they were opened."""
+async def shutdown_backend() -> None:
+    """Stop background listeners and close database pools if they were opened."""
     global business_pool, lg_pool, checkpointer, chatbot, vector_ready
 
+    memory_service.stop_change_listener()
+    document_service.stop_change_listener()
+    scraper_tools.stop_cleanup_scheduler()
+    ingestion_service.stop_workers()
+    embeddings.set_connection(None)
+
     if business_pool is not None:
         business_pool.close()
     if lg_pool is not None:
-        lg_pool.close()
+        await lg_pool.close()
 
     business_pool = None
     lg_pool = None
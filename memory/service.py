@@ -11,19 +11,154 @@ This module is intentionally free of LangChain / LangGraph imports so that:
 The connection is injected via set_connection() once at startup, using the
 same pattern as tools/memory_tools.py to avoid circular imports until
 core/database.py is extracted in Step 7.
+
+Reads are served from an in-process cache of the user_memory table. Every
+write invalidates it locally and issues a NOTIFY on MEMORY_CHANNEL in the
+same transaction; start_change_listener() LISTENs on that channel so other
+uvicorn workers drop their copy too.
+
+When an embeddings client is injected (set_embeddings) and pgvector is
+available, each fact is stored with an embedding and get_relevant_memories()
+injects only the top-K facts most similar to the user's message once the
+table outgrows that budget.
 """
 
+import threading
+
+from core.config import MEMORY_TOP_K
 from core.logger import get_logger
+from core.notify import ChangeListener, notify
+from tools.vector_utils import to_vector
 
 logger = get_logger(__name__)
 
 _pool = None
+_embeddings = None          # any object with embed_query / embed_documents
+_vector_available = False
+
+MEMORY_CHANNEL = "user_memory_changed"
+
+# Cached view of user_memory: {"rows": [...], "prompt": str}, or None when stale.
+_cache: dict | None = None
+_cache_version = 0
+_cache_lock = threading.Lock()
 
 
 def set_connection(pool) -> None:  # accepts a psycopg_pool.ConnectionPool
     """Inject the connection pool. Must be called before any function is used."""
     global _pool
     _pool = pool
+    invalidate_cache()
+
+
+def set_embeddings(embeddings) -> None:
+    """Inject the embeddings client used to index facts for relevance ranking."""
+    global _embeddings
+    _embeddings = embeddings
+    invalidate_cache()
+
+
+def set_vector_available(is_available: bool) -> None:
+    """Record whether the user_memory.embedding column (pgvector) exists."""
+    global _vector_available
+    _vector_available = is_available
+    invalidate_cache()
+
+
+def _ranking_enabled() -> bool:
+    return _embeddings is not None and _vector_available
+
+
+def _format_rows(rows: list[dict]) -> str:
+    return "\n".join(
+        f"- [ID: {row['id']}] {row['fact']} (Saved: {row['saved']})" for row in rows
+    )
+
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+
+def invalidate_cache() -> None:
+    """Drop the cached memory view; the next read reloads it from Postgres."""
+    global _cache, _cache_version
+    with _cache_lock:
+        _cache = None
+        _cache_version += 1
+
+
+def _load_cache() -> dict:
+    """Return the cached memory view, reloading it from the database if stale."""
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            return _cache
+        version = _cache_version
+
+    ranking = _ranking_enabled()
+    with _pool.connection() as conn:
+        if ranking:
+            cursor = conn.execute(
+                """
+                SELECT id, fact, DATE(created_at), embedding IS NOT NULL
+                FROM user_memory ORDER BY created_at ASC
+                """
+            )
+        else:
+            cursor = conn.execute(
+                "SELECT id, fact, DATE(created_at) FROM user_memory ORDER BY created_at ASC"
+            )
+        rows = []
+        for row in cursor.fetchall():
+            entry = {"id": row[0], "fact": row[1], "saved": row[2]}
+            if ranking:
+                entry["indexed"] = row[3]
+            rows.append(entry)
+
+    view = {"rows": rows, "prompt": _format_rows(rows)}
+    with _cache_lock:
+        # A write that landed while we were reading makes this snapshot stale.
+        if version == _cache_version:
+            _cache = view
+    return view
+
+
+def _notify_change(conn) -> None:
+    """Queue a cross-worker invalidation; Postgres delivers it on commit."""
+    notify(conn, MEMORY_CHANNEL)
+
+
+# ---------------------------------------------------------------------------
+# Cross-process invalidation (LISTEN/NOTIFY, core/notify.py)
+# ---------------------------------------------------------------------------
+
+_listener = ChangeListener(MEMORY_CHANNEL, lambda _payload: invalidate_cache(), name="memory-listener")
+
+
+def start_change_listener(conninfo: str) -> None:
+    """Start the background LISTEN thread. Safe to call more than once."""
+    _listener.start(conninfo)
+
+
+def stop_change_listener() -> None:
+    """Signal the LISTEN thread to exit and wait briefly for it."""
+    _listener.stop()
+
+
+# ---------------------------------------------------------------------------
+# Reads
+# ---------------------------------------------------------------------------
+
+def get_memory_rows() -> list[dict]:
+    """
+    Return all stored facts as dicts with id, fact and saved (date) keys,
+    plus an `indexed` flag when relevance ranking is enabled.
+    """
+    try:
+        return list(_load_cache()["rows"])
+    except Exception as e:
+        logger.error(f"Error retrieving memories: {e}")
+        return []
 
 
 def get_all_memories() -> str:
@@ -32,29 +167,90 @@ def get_all_memories() -> str:
     Returns an empty string if no memories exist.
     """
     try:
+        return _load_cache()["prompt"]
+    except Exception as e:
+        logger.error(f"Error retrieving memories: {e}")
+    return ""
+
+
+def get_relevant_memories(query: str | None, top_k: int = MEMORY_TOP_K) -> str:
+    """
+    Return the top_k facts most similar to `query`, formatted like get_all_memories().
+
+    Falls back to every fact (no embedding call) when the table is within the
+    budget, ranking is disabled (top_k <= 0, no embeddings, no pgvector), or
+    there is no query. Facts saved before embeddings existed cannot be ranked
+    and are always included until backfill_embeddings() has indexed them.
+    """
+    try:
+        view = _load_cache()
+        rows = view["rows"]
+        if top_k <= 0 or len(rows) <= top_k or not query or not _ranking_enabled():
+            return view["prompt"]
+
+        query_embedding = _embeddings.embed_query(query)
         with _pool.connection() as conn:
             cursor = conn.execute(
-                "SELECT id, fact, DATE(created_at) FROM user_memory ORDER BY created_at ASC"
+                """
+                SELECT id FROM user_memory
+                WHERE embedding IS NOT NULL
+                ORDER BY embedding <=> %s::vector
+                LIMIT %s
+                """,
+                (to_vector(query_embedding), top_k),
             )
-            facts = [
-                f"- [ID: {row[0]}] {row[1]} (Saved: {row[2]})"
-                for row in cursor.fetchall()
-            ]
-            if facts:
-                return "\n".join(facts)
+            selected = {row[0] for row in cursor.fetchall()}
+
+        # Keep chronological order so the injected block reads naturally.
+        chosen = [r for r in rows if r["id"] in selected or not r.get("indexed", True)]
+        logger.debug(f"Memory ranking: injecting {len(chosen)} of {len(rows)} fact(s)")
+        return _format_rows(chosen)
     except Exception as e:
-        logger.error(f"Error retrieving memories: {e}")
-    return ""
+        logger.error(f"Error ranking memories, injecting all: {e}")
+        return get_all_memories()
+
+
+# ---------------------------------------------------------------------------
+# Writes — each one invalidates the local cache and notifies other workers
+# ---------------------------------------------------------------------------
+
+def _embed_fact(fact: str):
+    """
+    Return the embedding array for a fact, or None if it cannot be embedded.
+    Facts are stored content, not queries: they go through embed_documents()
+    so they never occupy the query-embedding cache or skew its hit ratio.
+    """
+    if not _ranking_enabled():
+        return None
+    try:
+        return to_vector(_embeddings.embed_documents([fact])[0])
+    except Exception as e:
+        # The fact is still saved; it is simply always injected until backfilled.
+        logger.warning(f"Could not embed memory fact: {e}")
+        return None
 
 
 def save_fact(fact: str) -> str:
     """Insert a new fact into user_memory. Returns a status string."""
     try:
+        embedding = _embed_fact(fact)
         with _pool.connection() as conn:
-            cursor = conn.execute(
-                "INSERT INTO user_memory (fact) VALUES (%s) ON CONFLICT (fact) DO NOTHING", (fact,)
-            )
+            if _ranking_enabled():
+                cursor = conn.execute(
+                    """
+                    INSERT INTO user_memory (fact, embedding) VALUES (%s, %s::vector)
+                    ON CONFLICT (fact) DO NOTHING
+                    """,
+                    (fact, embedding),
+                )
+            else:
+                cursor = conn.execute(
+                    "INSERT INTO user_memory (fact) VALUES (%s) ON CONFLICT (fact) DO NOTHING", (fact,)
+                )
+            if cursor.rowcount:
+                _notify_change(conn)
             conn.commit()
+            invalidate_cache()
             return "Already remembered." if cursor.rowcount == 0 else "Fact remembered."
     except Exception as e:
         logger.error(f"Error saving memory: {e}")
@@ -64,12 +260,26 @@ def save_fact(fact: str) -> str:
 def update_fact(memory_id: int, new_fact: str) -> str:
     """Update an existing fact by ID. Returns a status string."""
     try:
+        embedding = _embed_fact(new_fact)
         with _pool.connection() as conn:
-            cursor = conn.execute(
-                "UPDATE user_memory SET fact = %s, created_at = CURRENT_TIMESTAMP WHERE id = %s",
-                (new_fact, memory_id),
-            )
+            if _ranking_enabled():
+                cursor = conn.execute(
+                    """
+                    UPDATE user_memory
+                    SET fact = %s, embedding = %s::vector, created_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                    """,
+                    (new_fact, embedding, memory_id),
+                )
+            else:
+                cursor = conn.execute(
+                    "UPDATE user_memory SET fact = %s, created_at = CURRENT_TIMESTAMP WHERE id = %s",
+                    (new_fact, memory_id),
+                )
+            if cursor.rowcount:
+                _notify_change(conn)
             conn.commit()
+            invalidate_cache()
             if cursor.rowcount == 0:
                 return f"No memory found with ID {memory_id}."
             return "Memory updated successfully."
@@ -85,10 +295,51 @@ def forget_fact(memory_id: int) -> str:
             cursor = conn.execute(
                 "DELETE FROM user_memory WHERE id = %s", (memory_id,)
             )
+            if cursor.rowcount:
+                _notify_change(conn)
             conn.commit()
+            invalidate_cache()
             if cursor.rowcount == 0:
                 return f"No memory found with ID {memory_id}."
             return "Memory forgotten."
     except Exception as e:
         logger.error(f"Error forgetting memory: {e}")
         return f"Error forgetting memory: {e}"
+
+
+def backfill_embeddings(batch_size: int = 100) -> int:
+    """
+    Embed facts stored before relevance ranking existed (embedding IS NULL),
+    batch_size facts per embedding call. Returns the number of facts indexed.
+    Never raises.
+    """
+    if not _pool or not _ranking_enabled():
+        return 0
+    indexed = 0
+    try:
+        while True:
+            with _pool.connection() as conn:
+                cursor = conn.execute(
+                    "SELECT id, fact FROM user_memory WHERE embedding IS NULL ORDER BY id LIMIT %s",
+                    (batch_size,),
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                vectors = _embeddings.embed_documents([row[1] for row in rows])
+                for (memory_id, _fact), vector in zip(rows, vectors):
+                    conn.execute(
+                        "UPDATE user_memory SET embedding = %s::vector WHERE id = %s",
+                        (to_vector(vector), memory_id),
+                    )
+                _notify_change(conn)
+                conn.commit()
+            invalidate_cache()
+            indexed += len(rows)
+            if len(rows) < batch_size:
+                break
+    except Exception as e:
+        logger.error(f"Memory backfill failed: {e}")
+    if indexed:
+        logger.info(f"Memory backfill: embedded {indexed} fact(s)")
+    return indexed
@@ -1,10 +1,13 @@
+import hashlib
 import json
+import os
+import tempfile
 from contextlib import asynccontextmanager
 from langsmith import uuid7
 from typing import List, Optional
 
 import uvicorn
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, UploadFile, File, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from starlette.concurrency import run_in_threadpool
@@ -13,13 +16,19 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from pydantic import BaseModel, Field
 import langgraph_tool_backend as backend
-from core.config import CORS_ALLOWED_ORIGINS
+from agent.graph import refresh_summary, thread_lock
+from agent.usage import prompt_stats, usage_stats
+from core.config import CORS_ALLOWED_ORIGINS, UPLOAD_MAX_MB, UPLOAD_SPOOL_DIR
+from core.embeddings import embedding_stats, query_cache_stats
 from core.logger import get_logger
-from threads.service import get_all_threads, generate_title, save_title, update_timestamp, delete_thread, pin_thread, rename_thread
-from tools.scraper import cleanup_old_chunks
-from tools.document_rag import ingest_pdf, is_vector_available, list_thread_files
+from threads.service import (
+    get_all_threads, get_threads_page, generate_title, save_title, update_timestamp, delete_thread, pin_thread, rename_thread,
+    latest_checkpoint_id, format_history, get_cached_history, cache_history, paginate_history,
+)
+from ingestion.service import enqueue_job, get_job
+from tools.document_rag import is_vector_available, list_thread_files
 from openai import APITimeoutError
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+from langchain_core.messages import HumanMessage, AIMessage
 
 logger = get_logger(__name__)
 
@@ -33,13 +42,13 @@ limiter = Limiter(key_func=get_remote_address)
 @asynccontextmanager
 async def lifespan(app):
     """Run startup tasks then yield; close all pools cleanly on shutdown."""
-    backend.init_backend()
-    # Purge web_scrape chunks older than 30 days on every startup
-    cleanup_old_chunks()
+    # Also starts the web_scrape TTL cleanup, which runs now and then every
+    # WEB_CLEANUP_INTERVAL_HOURS.
+    await backend.init_backend()
 
     yield
     logger.info("Server shutting down — closing database pools.")
-    backend.shutdown_backend()
+    await backend.shutdown_backend()
 
 
 app = FastAPI(title="LangGraph Chatbot API", lifespan=lifespan)
@@ -72,6 +81,7 @@ class RenameRequest(BaseModel):
 
 class ThreadResponse(BaseModel):
     threads: List[ThreadItem]
+    next_cursor: Optional[str] = None
 
 
 def ndjson_event(event_type: str, content) -> str:
@@ -82,6 +92,60 @@ def ndjson_event(event_type: str, content) -> str:
     ) + "\n"
 
 
+class UploadTooLarge(Exception):
+    pass
+
+
+async def spool_upload(
+    file: UploadFile,
+    max_bytes: int,
+    directory: str | None = None,
+    block_size: int = 1024 * 1024,
+) -> tuple[str, str]:
+    """
+    Copy an upload to a temp file in `directory` in fixed-size blocks, hashing it on the way.
+    Disk writes run in the threadpool so a slow disk never blocks the event loop.
+    Returns (path, sha256 hex digest); the caller deletes the file.
+    Raises UploadTooLarge (after removing the partial file) past max_bytes.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(suffix=".pdf", dir=directory, delete=False) as tmp:
+        try:
+            while block := await file.read(block_size):
+                size += len(block)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                digest.update(block)
+                await run_in_threadpool(tmp.write, block)
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    return tmp.name, digest.hexdigest()
+
+
+async def load_history(thread_id: str) -> list[dict]:
+    """Deserialize a thread's latest checkpoint into the formatted history and cache it."""
+    config = {'configurable': {'thread_id': thread_id}}
+    state = await backend.chatbot.aget_state(config)
+    formatted_messages = format_history(state.values.get('messages', []))
+    snapshot_id = (state.config or {}).get('configurable', {}).get('checkpoint_id')
+    if snapshot_id:
+        cache_history(thread_id, snapshot_id, formatted_messages)
+    return formatted_messages
+
+
+async def warm_history_cache(thread_id: str) -> None:
+    """Re-cache a thread's history after a turn so the next /history load is a hit."""
+    try:
+        await load_history(thread_id)
+    except Exception:
+        logger.exception("Failed to cache history for thread %s", thread_id)
+
+
 def generate_and_save_title(thread_id: str, message: str) -> None:
     """Generate and persist a title without blocking chat response setup."""
     try:
@@ -92,12 +156,25 @@ def generate_and_save_title(thread_id: str, message: str) -> None:
 
 @app.get("/threads", response_model=ThreadResponse)
 @limiter.limit("60/minute")
-async def get_threads(request: Request):
-    """Retrieve all available chat threads."""
+async def get_threads(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    cursor: Optional[str] = None,
+):
+    """
+    Retrieve chat threads, pinned first then most recently updated.
+
+    Pagination: `limit` returns one page; pass the returned `next_cursor` as
+    `cursor` to fetch the next one. Without `limit` every thread is returned.
+    """
     try:
-        threads = get_all_threads()
-        # threads is now a list of dicts {'id': str, 'title': str}
-        return {"threads": threads}
+        if limit is None:
+            threads = await run_in_threadpool(get_all_threads)
+            return {"threads": threads}
+        threads, next_cursor = await run_in_threadpool(get_threads_page, limit, cursor)
+        return {"threads": threads, "next_cursor": next_cursor}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except Exception:
         logger.exception("Failed to retrieve threads")
         raise HTTPException(status_code=500, detail="Failed to retrieve threads")
@@ -148,13 +225,21 @@ async def rename_thread_endpoint(request: Request, thread_id: str, body: RenameR
         raise HTTPException(status_code=500, detail="Failed to rename thread")
 
 
-@app.post("/upload")
+_JOB_MESSAGES = {
+    "duplicate": "This file has already been uploaded to this conversation.",
+    "empty": "The PDF contains no extractable text. Image-only PDFs are not supported.",
+    "failed": "Failed to process the uploaded file.",
+}
+
+
+@app.post("/upload", status_code=202)
 @limiter.limit("10/minute")
 async def upload_file(request: Request, file: UploadFile = File(...), thread_id: str = Form(...)):
     """
-    Upload a PDF file and ingest it into the vector store for this thread.
-    The file is chunked, embedded, and stored with source_type='pdf_upload'
-    so it is immune to the 30-day TTL applied to web_scrape chunks.
+    Upload a PDF file and queue it for ingestion into this thread's vector store.
+    Returns a job id immediately; poll GET /upload/{job_id} for progress. The
+    file is chunked, embedded, and stored with source_type='pdf_upload' so it
+    is immune to the 30-day TTL applied to web_scrape chunks.
     """
     # Validate file type
     if not (file.filename or "").lower().endswith(".pdf"):
@@ -166,27 +251,42 @@ async def upload_file(request: Request, file: UploadFile = File(...), thread_id:
             detail="Document upload is unavailable because vector search is not configured.",
         )
 
-    # Read and validate size (max 10 MB)
-    file_bytes = await file.read()
-    if len(file_bytes) > 10 * 1024 * 1024:
-        raise HTTPException(status_code=413, detail="File size exceeds the 10 MB limit.")
+    # Spool to disk (hashing as we go) so memory stays flat for large files.
+    # The spooled file must outlive this request: the ingest worker reads it.
+    try:
+        path, file_hash = await spool_upload(file, UPLOAD_MAX_MB * 1024 * 1024, UPLOAD_SPOOL_DIR)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail=f"File size exceeds the {UPLOAD_MAX_MB} MB limit.")
 
     try:
-        result = await run_in_threadpool(ingest_pdf, file_bytes, file.filename, thread_id)
+        job_id = await run_in_threadpool(enqueue_job, path, file.filename, thread_id, file_hash)
     except Exception:
-        logger.exception("Failed to ingest PDF '%s' for thread %s", file.filename, thread_id)
+        os.unlink(path)
+        logger.exception("Failed to queue PDF '%s' for thread %s", file.filename, thread_id)
         raise HTTPException(status_code=500, detail="Failed to process the uploaded file.")
 
-    if result["status"] == "empty":
-        raise HTTPException(
-            status_code=422,
-            detail="The PDF contains no extractable text. Image-only PDFs are not supported.",
-        )
-    if result["status"] == "duplicate":
-        return {"status": "duplicate", "message": "This file has already been uploaded to this conversation."}
+    logger.info("Queued '%s' for thread %s as job %s", file.filename, thread_id, job_id)
+    return {"status": "queued", "job_id": job_id, "filename": file.filename}
 
-    logger.info("Uploaded '%s' (%d chunks) to thread %s", file.filename, result["chunks"], thread_id)
-    return {"status": "success", "filename": result["filename"], "chunks": result["chunks"]}
+
+@app.get("/upload/{job_id}")
+@limiter.limit("120/minute")
+async def get_upload_job(request: Request, job_id: str):
+    """
+    Report an ingestion job's status (queued, running, success, duplicate,
+    empty, failed) and progress: pages read, pages in the PDF, chunks embedded.
+    """
+    try:
+        job = await run_in_threadpool(get_job, job_id)
+    except Exception:
+        logger.exception("Failed to read ingest job %s", job_id)
+        raise HTTPException(status_code=500, detail="Failed to retrieve upload status.")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found.")
+    job.pop("error", None)   # internal detail — logged, not exposed
+    if job["status"] in _JOB_MESSAGES:
+        job["message"] = _JOB_MESSAGES[job["status"]]
+    return job
 
 
 @app.get("/threads/{thread_id}/files")
@@ -207,62 +307,78 @@ async def get_thread_files(request: Request, thread_id: str):
 
 @app.get("/history/{thread_id}")
 @limiter.limit("60/minute")
-async def get_history(request: Request, thread_id: str):
-    """Retrieve message history for a specific thread."""
+async def get_history(
+    request: Request,
+    thread_id: str,
+    before: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+):
+    """
+    Retrieve message history for a specific thread.
+
+    Pagination: `limit` returns only the newest `limit` messages; pass the
+    returned `next_before` cursor (a message ID) as `before` to fetch the
+    next-older page. Without `limit` the full history is returned (cursor is
+    then null).
+
+    The formatted list is cached per checkpoint ID and re-cached after every
+    /chat turn, so opening a thread costs one indexed lookup instead of
+    loading the whole checkpoint.
+    """
     try:
-        config = {'configurable': {'thread_id': thread_id}}
-        state = backend.chatbot.get_state(config)
-        messages = state.values.get('messages', [])
-        
-        formatted_messages = []
-        for msg in messages:
-            if isinstance(msg, HumanMessage):
-                role = "user"
-            elif isinstance(msg, ToolMessage):
-                role = "tool"
-            else:
-                role = "assistant"
-                
-            # Skip empty assistant messages (tool call triggers)
-            if role == "assistant" and not msg.content.strip():
-                continue
-                
-            formatted_messages.append({
-                "role": role,
-                "content": msg.content,
-                "name": getattr(msg, 'name', 'tool') if role == "tool" else None
-            })
-            
-        return {"messages": formatted_messages}
+        checkpoint_id = await run_in_threadpool(latest_checkpoint_id, thread_id)
+        formatted_messages = (
+            get_cached_history(thread_id, checkpoint_id) if checkpoint_id else None
+        )
+        if formatted_messages is None:
+            formatted_messages = await load_history(thread_id)
+
+        page, next_before = paginate_history(formatted_messages, before, limit)
+        return {"messages": page, "next_before": next_before}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except Exception:
         logger.exception("Failed to retrieve history for thread %s", thread_id)
         raise HTTPException(status_code=500, detail="Failed to retrieve chat history")
 
+@app.get("/stats")
+@limiter.limit("60/minute")
+async def get_stats(request: Request):
+    """
+    Report this worker's performance counters since startup (they are
+    process-local; each uvicorn worker keeps its own).
+    """
+    return {
+        "embeddings": embedding_stats(),
+        "query_embedding_cache": query_cache_stats(),
+        "llm_usage": usage_stats(),
+        "prompt_variants": prompt_stats(),
+    }
+
+
 @app.post("/chat")
 @limiter.limit("20/minute")
-def chat_endpoint(request: Request, body: ChatRequest, background_tasks: BackgroundTasks):
+async def chat_endpoint(request: Request, body: ChatRequest, background_tasks: BackgroundTasks):
     """
     Stream chat response as newline-delimited JSON.
     If thread_id is not provided, a new one is generated.
+
+    The graph is driven with astream() on the event loop, so an in-flight
+    turn holds no threadpool worker while waiting on the LLM. The turn runs
+    under the thread's lock so a background summary write cannot fork it.
     """
-    thread_id = body.thread_id
-    is_new_thread = False
-    
-    if not thread_id:
-        thread_id = str(uuid7())
-        is_new_thread = True
-    else:
-        # Check if the thread exists in metadata; if not, it's a new client-generated thread
-        with backend.business_pool.connection() as conn:
-            cursor = conn.execute("SELECT 1 FROM thread_metadata WHERE thread_id = %s", (thread_id,))
-            if not cursor.fetchone():
-                is_new_thread = True
-
-    # Update timestamp for every interaction
-    update_timestamp(thread_id)
+    thread_id = body.thread_id or str(uuid7())
+
+    # One upsert both refreshes the timestamp and tells us whether the
+    # thread (server- or client-generated ID) is new and needs a title.
+    is_new_thread = await run_in_threadpool(update_timestamp, thread_id)
 
     if is_new_thread:
         background_tasks.add_task(generate_and_save_title, thread_id, body.message)
+    # Runs after the stream completes — folds old turns into the rolling summary,
+    # then caches the final checkpoint's history for the next /history load.
+    background_tasks.add_task(refresh_summary, thread_id)
+    background_tasks.add_task(warm_history_cache, thread_id)
     
     config = {
         'configurable': {'thread_id': thread_id},
@@ -270,22 +386,23 @@ def chat_endpoint(request: Request, body: ChatRequest, background_tasks: Backgro
         "run_name": "chat_turn"
     }
 
-    def event_generator():
+    async def event_generator():
         # First yield the thread_id so the frontend knows where to continue
         yield ndjson_event("thread_id", thread_id)
         
         try:
-            for message_chunk, _metadata in backend.chatbot.stream(
-                {'messages': [HumanMessage(content=body.message)]},
-                config=config,
-                stream_mode='messages'
-            ):
-                if isinstance(message_chunk, AIMessage):
-                    content = message_chunk.content
-                    if not isinstance(content, str):
-                        content = json.dumps(content, ensure_ascii=False)
-                    yield ndjson_event("chunk", content)
-                    
+            async with thread_lock(thread_id):
+                async for message_chunk, _metadata in backend.chatbot.astream(
+                    {'messages': [HumanMessage(content=body.message)]},
+                    config=config,
+                    stream_mode='messages'
+                ):
+                    if isinstance(message_chunk, AIMessage):
+                        content = message_chunk.content
+                        if not isinstance(content, str):
+                            content = json.dumps(content, ensure_ascii=False)
+                        yield ndjson_event("chunk", content)
+
         except APITimeoutError:
             logger.error("OpenAI API timeout for thread %s", thread_id)
             yield ndjson_event("error", "The AI provider timed out. Please try again later.")
@@ -1,7 +1,11 @@
+import asyncio
 import pytest
-from unittest.mock import patch, MagicMock
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
-from agent.graph import chat_node
+from unittest.mock import patch, MagicMock, AsyncMock
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from agent.history import trim_history, trim_history_counted, count_message_tokens, messages_to_fold
+from agent.intent import is_small_talk
+from agent.graph import chat_node, achat_node, context_node, acontext_node, init_graph, refresh_summary
 
 # All tests pass a config dict. Tests that don't need thread-scoped RAG
 # pass an empty configurable dict so document_rag is never called.
@@ -17,7 +21,7 @@ EMPTY_CONFIG = {"configurable": {}}
 @patch("agent.graph.memory_service")
 def test_agent_routes_to_tools(mock_memory, mock_llm, mock_doc_rag):
     """Verify that if the LLM decides to use a tool, it outputs an AIMessage with tool_calls."""
-    mock_memory.get_all_memories.return_value = ""
+    mock_memory.get_relevant_memories.return_value = ""
     mock_doc_rag.search_thread_documents.return_value = ""
 
     fake_tool_call = {
@@ -44,7 +48,7 @@ def test_agent_routes_to_tools(mock_memory, mock_llm, mock_doc_rag):
 @patch("agent.graph.memory_service")
 def test_agent_responds_directly(mock_memory, mock_llm, mock_doc_rag):
     """Verify that if the LLM just answers, it outputs standard text with no tool_calls."""
-    mock_memory.get_all_memories.return_value = ""
+    mock_memory.get_relevant_memories.return_value = ""
     mock_doc_rag.search_thread_documents.return_value = ""
 
     mock_llm.invoke.return_value = AIMessage(
@@ -74,7 +78,7 @@ def test_chat_node_injects_doc_context_when_thread_has_uploads(
     When search_thread_documents returns a non-empty string,
     the SystemMessage content passed to the LLM must contain the PDF context.
     """
-    mock_memory.get_all_memories.return_value = ""
+    mock_memory.get_relevant_memories.return_value = ""
     mock_doc_rag.search_thread_documents.return_value = (
         "[From: report.pdf]\nRevenue was $5M in Q4 2024."
     )
@@ -83,6 +87,7 @@ def test_chat_node_injects_doc_context_when_thread_has_uploads(
     state = {"messages": [HumanMessage(content="What was the Q4 revenue?")]}
     config = {"configurable": {"thread_id": "thread-xyz"}}
 
+    state.update(context_node(state, config))
     result = chat_node(state, config)
 
     # doc_rag was called with the correct thread + query
@@ -90,12 +95,35 @@ def test_chat_node_injects_doc_context_when_thread_has_uploads(
         "thread-xyz", "What was the Q4 revenue?"
     )
 
-    # The SystemMessage sent to the LLM includes the doc context
+    # Doc context follows the user's message, leaving the system prompt
+    # (the cacheable prefix) unchanged by per-turn retrieval.
     call_args = mock_llm.invoke.call_args[0][0]
-    system_msg = call_args[0]
+    system_msg, human_msg, doc_msg = call_args
     assert isinstance(system_msg, SystemMessage)
-    assert "report.pdf" in system_msg.content
-    assert "Revenue was $5M" in system_msg.content
+    assert "Uploaded Documents" not in system_msg.content
+    assert human_msg.content == "What was the Q4 revenue?"
+    assert isinstance(doc_msg, SystemMessage)
+    assert "report.pdf" in doc_msg.content
+    assert "Revenue was $5M" in doc_msg.content
+
+
+@patch("agent.graph.document_rag")
+@patch("agent.graph.llm_with_tools")
+@patch("agent.graph.memory_service")
+def test_legacy_prompt_layout_keeps_doc_context_in_system_prompt(mock_memory, mock_llm, mock_doc_rag):
+    mock_memory.get_relevant_memories.return_value = ""
+    mock_doc_rag.search_thread_documents.return_value = "[From: report.pdf]\nRevenue was $5M."
+    mock_llm.invoke.return_value = AIMessage(content="ok")
+    state = {"messages": [HumanMessage(content="What was the Q4 revenue?")]}
+    config = {"configurable": {"thread_id": "thread-xyz"}}
+    state.update(context_node(state, config))
+
+    with patch("agent.graph.PROMPT_LAYOUT", "legacy"):
+        chat_node(state, config)
+
+    call_args = mock_llm.invoke.call_args[0][0]
+    assert len(call_args) == 2
+    assert "Revenue was $5M" in call_args[0].content
 
 
 @patch("agent.graph.document_rag")
@@ -108,13 +136,14 @@ def test_chat_node_no_doc_context_when_thread_has_no_uploads(
     When search_thread_documents returns an empty string (no uploads),
     the system prompt must NOT contain the 'Uploaded Documents' section.
     """
-    mock_memory.get_all_memories.return_value = ""
+    mock_memory.get_relevant_memories.return_value = ""
     mock_doc_rag.search_thread_documents.return_value = ""
     mock_llm.invoke.return_value = AIMessage(content="Paris is the capital of France.")
 
     state = {"messages": [HumanMessage(content="Capital of France?")]}
     config = {"configurable": {"thread_id": "thread-empty"}}
 
+    state.update(context_node(state, config))
     result = chat_node(state, config)
 
     call_args = mock_llm.invoke.call_args[0][0]
@@ -132,11 +161,424 @@ def test_chat_node_does_not_call_doc_rag_without_thread_id(
     """
     When config has no thread_id, search_thread_documents must NOT be called.
     """
-    mock_memory.get_all_memories.return_value = ""
+    mock_memory.get_relevant_memories.return_value = ""
     mock_llm.invoke.return_value = AIMessage(content="Answer.")
 
     state = {"messages": [HumanMessage(content="Hello")]}
 
+    state.update(context_node(state, EMPTY_CONFIG))
     result = chat_node(state, EMPTY_CONFIG)
 
     mock_doc_rag.search_thread_documents.assert_not_called()
+
+
+@patch("agent.graph.document_rag")
+@patch("agent.graph.memory_service")
+def test_context_node_skips_doc_rag_for_small_talk(mock_memory, mock_doc_rag):
+    """Acknowledgements and greetings never pay for a document search."""
+    mock_memory.get_relevant_memories.return_value = ""
+    config = {"configurable": {"thread_id": "thread-xyz"}}
+
+    result = context_node({"messages": [HumanMessage(content="Thanks, got it! 👍")]}, config)
+
+    assert result["doc_context"] == ""
+    mock_doc_rag.search_thread_documents.assert_not_called()
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("thanks!", True),
+    ("ok", True),
+    ("hi there", True),
+    ("ok?", False),
+    ("What is the notice period?", False),
+    ("summarize the document", False),
+    ("1234", False),
+    ("👍", True),
+    ("Что написано в документе", False),
+    ("总结一下这个文件", False),
+])
+def test_is_small_talk(text, expected):
+    assert is_small_talk(text) is expected
+
+
+def test_is_small_talk_answer_to_assistant_question_is_not_small_talk():
+    assert is_small_talk("yes", previous_reply="Here is the summary.") is True
+    assert is_small_talk("yes", previous_reply="Shall I summarize section 4? ") is False
+
+
+@patch("agent.graph.document_rag")
+@patch("agent.graph.memory_service")
+def test_context_node_searches_docs_for_reply_to_a_question(mock_memory, mock_doc_rag):
+    mock_memory.get_relevant_memories.return_value = ""
+    mock_doc_rag.search_thread_documents.return_value = ""
+    config = {"configurable": {"thread_id": "thread-xyz"}}
+    messages = [
+        HumanMessage(content="What does the contract cover?"),
+        AIMessage(content="It covers three services. Want the renewal terms too?"),
+        HumanMessage(content="yes"),
+    ]
+
+    context_node({"messages": messages}, config)
+
+    mock_doc_rag.search_thread_documents.assert_called_once_with("thread-xyz", "yes")
+
+
+# ---------------------------------------------------------------------------
+# Async execution path — achat_node (driven by chatbot.astream)
+# ---------------------------------------------------------------------------
+
+@patch("agent.graph.document_rag")
+@patch("agent.graph.llm_with_tools")
+@patch("agent.graph.memory_service")
+def test_achat_node_awaits_llm_with_doc_context(mock_memory, mock_llm, mock_doc_rag):
+    """achat_node must use ainvoke (never the blocking invoke) and inject doc context."""
+    mock_memory.get_relevant_memories.return_value = "- [ID: 1] Likes tea (Saved: 2025-01-01)"
+    mock_doc_rag.search_thread_documents.return_value = "[From: report.pdf]\nRevenue was $5M."
+    mock_llm.ainvoke = AsyncMock(return_value=AIMessage(content="Revenue was $5M."))
+
+    state = {"messages": [HumanMessage(content="What was revenue?")]}
+    config = {"configurable": {"thread_id": "thread-xyz"}}
+
+    async def run_turn():
+        state.update(await acontext_node(state, config))
+        return await achat_node(state, config)
+
+    result = asyncio.run(run_turn())
+
+    assert result["messages"][0].content == "Revenue was $5M."
+    mock_llm.invoke.assert_not_called()
+    mock_doc_rag.search_thread_documents.assert_called_once_with("thread-xyz", "What was revenue?")
+
+    system_msg, _human, turn_msg = mock_llm.ainvoke.call_args[0][0]
+    assert isinstance(system_msg, SystemMessage)
+    # Top-K memories change per message, so they travel with the doc context
+    # after the history instead of in the cached system-prompt prefix.
+    assert "Likes tea" not in system_msg.content
+    assert isinstance(turn_msg, SystemMessage)
+    assert "Likes tea" in turn_msg.content
+    assert turn_msg.content.index("Likes tea") < turn_msg.content.index("report.pdf")
+
+
+@patch("agent.graph.document_rag")
+@patch("agent.graph.llm_with_tools")
+@patch("agent.graph.memory_service")
+def test_context_gathered_once_per_turn_across_tool_loop(mock_memory, mock_llm, mock_doc_rag):
+    """A tool call loops back to chat_node without re-fetching memories or doc context."""
+    mock_memory.get_relevant_memories.return_value = ""
+    mock_doc_rag.search_thread_documents.return_value = "[From: report.pdf]\nRevenue was $5M."
+    mock_llm.ainvoke = AsyncMock(side_effect=[
+        AIMessage(content="", tool_calls=[{
+            "name": "calculator",
+            "args": {"first_num": 2, "second_num": 3, "operation": "add"},
+            "id": "call_1",
+        }]),
+        AIMessage(content="2 + 3 = 5"),
+    ])
+
+    chatbot = init_graph(InMemorySaver())
+    config = {"configurable": {"thread_id": "thread-loop"}}
+    result = asyncio.run(chatbot.ainvoke(
+        {"messages": [HumanMessage(content="What is 2 + 3?")]}, config
+    ))
+
+    assert result["messages"][-1].content == "2 + 3 = 5"
+    assert mock_llm.ainvoke.call_count == 2
+    mock_memory.get_relevant_memories.assert_called_once()
+    mock_doc_rag.search_thread_documents.assert_called_once()
+    # Both LLM hops saw the same doc context, directly after the question,
+    # so the second hop's prompt extends the first one's unchanged.
+    first, second = (call[0][0] for call in mock_llm.ainvoke.call_args_list)
+    assert "Revenue was $5M" in first[2].content
+    assert [m.content for m in second[:3]] == [m.content for m in first]
+    assert isinstance(second[3], AIMessage) and isinstance(second[4], ToolMessage)
+
+
+def test_record_usage_tracks_cached_prompt_tokens():
+    from agent import usage
+
+    before = usage.usage_stats()
+    usage.record_usage(AIMessage(content="hi", usage_metadata={
+        "input_tokens": 2000, "output_tokens": 50, "total_tokens": 2050,
+        "input_token_details": {"cache_read": 1536},
+    }))
+    assert usage.record_usage(AIMessage(content="no usage")) is None
+
+    after = usage.usage_stats()
+    assert after["calls"] - before["calls"] == 1
+    assert after["cached_tokens"] - before["cached_tokens"] == 1536
+    assert 0 < after["cache_hit_ratio"] <= 1
+
+
+@patch("agent.graph.document_rag")
+@patch("agent.graph.llm_with_tools")
+@patch("agent.graph.memory_service")
+def test_memory_tool_refreshes_memories_but_not_doc_context(mock_memory, mock_llm, mock_doc_rag):
+    """After save_memory runs, the next hop sees fresh memories; doc RAG is not re-run."""
+    mock_memory.get_relevant_memories.side_effect = ["", "- [ID: 1] Lives in Paris (Saved: 2025-01-01)"]
+    mock_doc_rag.search_thread_documents.return_value = ""
+    mock_llm.ainvoke = AsyncMock(side_effect=[
+        AIMessage(content="", tool_calls=[{
+            "name": "save_memory",
+            "args": {"fact": "Lives in Paris"},
+            "id": "call_1",
+        }]),
+        AIMessage(content="Noted!"),
+    ])
+
+    chatbot = init_graph(InMemorySaver())
+    config = {"configurable": {"thread_id": "thread-memory"}}
+    with patch("tools.memory_tools.memory_service.save_fact", return_value="Fact remembered."):
+        asyncio.run(chatbot.ainvoke(
+            {"messages": [HumanMessage(content="I live in Paris")]}, config
+        ))
+
+    assert mock_memory.get_relevant_memories.call_count == 2
+    mock_doc_rag.search_thread_documents.assert_called_once()
+    first_hop, second_hop = (c[0][0] for c in mock_llm.ainvoke.call_args_list)
+    assert first_hop[0].content == second_hop[0].content   # system prefix unchanged
+    turn_msg = second_hop[2]
+    assert isinstance(turn_msg, SystemMessage) and "Lives in Paris" in turn_msg.content
+
+
+# ---------------------------------------------------------------------------
+# Prompt registry — variants and token accounting
+# ---------------------------------------------------------------------------
+
+def test_prompt_variant_renders_sections_and_counts_their_tokens():
+    from agent import prompts
+    from core.tokens import count_tokens
+
+    variant = prompts.DEFAULT_VARIANT
+    expected = (
+        prompts.BASE_SYSTEM_PROMPT
+        + prompts._MEMORY_INJECTION_TEMPLATE.format(memories="- likes tea")
+        + prompts._SUMMARY_TEMPLATE.format(summary="Talked about tea.")
+    )
+    assert prompts.build_system_prompt("- likes tea", summary="Talked about tea.") == expected
+
+    sections = variant.section_tokens(memories="- likes tea", summary="")
+    assert sections["base"] == count_tokens(prompts.BASE_SYSTEM_PROMPT)
+    assert sections["memories"] == count_tokens(prompts._MEMORY_INJECTION_TEMPLATE.format(memories="- likes tea"))
+    assert sections["summary"] == sections["doc"] == 0
+
+    with pytest.raises(ValueError):
+        prompts.PromptTemplate("no placeholder", "memories")
+
+
+def test_select_variant_is_sticky_per_thread_and_follows_weights(tmp_path):
+    from agent import prompts
+
+    path = tmp_path / "variants.json"
+    path.write_text('{"terse": {"base": "Be brief."}}')
+    try:
+        assert prompts.load_variants(str(path)) == 1
+        terse = prompts.get_variant("terse")
+        assert terse.system_prompt("") == "Be brief."
+        assert terse.doc_context.text == prompts._DOC_CONTEXT_TEMPLATE
+
+        spec = ["default:1", "terse:1"]
+        chosen = [prompts.select_variant(f"thread-{i}", spec).name for i in range(200)]
+        assert 50 < chosen.count("terse") < 150
+        assert [prompts.select_variant(f"thread-{i}", spec).name for i in range(200)] == chosen
+
+        assert prompts.select_variant("thread-1", ["terse"]) is terse
+        assert prompts.select_variant("thread-1", ["missing", "terse:0"]) is prompts.DEFAULT_VARIANT
+    finally:
+        prompts._variants.pop("terse", None)
+
+
+def test_load_variants_registers_nothing_when_any_entry_is_invalid(tmp_path):
+    from agent import prompts
+
+    path = tmp_path / "variants.json"
+    path.write_text('{"good": {"base": "Be brief."}, "bad": {"memories": "no placeholder"}}')
+
+    with pytest.raises(ValueError):
+        prompts.load_variants(str(path))
+    assert "good" not in prompts._variants
+
+    path.write_text('["not", "an", "object"]')
+    with pytest.raises(ValueError):
+        prompts.load_variants(str(path))
+
+
+@pytest.mark.parametrize("content", [
+    '{"x": {"memories": 5}}',
+    '{"x": "Be brief."}',
+    '{"x": {"greeting": "Hi"}}',
+])
+def test_load_variants_rejects_malformed_entries_with_value_error(tmp_path, content):
+    from agent import prompts
+
+    path = tmp_path / "variants.json"
+    path.write_text(content)
+
+    # ValueError is what the import-time loader catches, so a bad file can't crash startup.
+    with pytest.raises(ValueError):
+        prompts.load_variants(str(path))
+    assert "x" not in prompts._variants
+
+
+@patch("agent.graph.record_prompt")
+@patch("agent.graph.document_rag")
+@patch("agent.graph.llm_with_tools")
+@patch("agent.graph.memory_service")
+def test_chat_node_records_prompt_token_breakdown(mock_memory, mock_llm, mock_doc_rag, mock_record):
+    from agent import usage
+
+    mock_memory.get_relevant_memories.return_value = "- [ID: 1] Likes tea (Saved: 2024-01-01)"
+    mock_doc_rag.search_thread_documents.return_value = "[From: report.pdf]\nRevenue was $5M."
+    mock_llm.invoke.return_value = AIMessage(content="ok")
+
+    state = {"messages": [HumanMessage(content="What was the revenue?")]}
+    config = {"configurable": {"thread_id": "thread-xyz"}}
+    state.update(context_node(state, config))
+    chat_node(state, config)
+
+    variant, sections = mock_record.call_args[0]
+    assert variant == "default"
+    assert set(sections) == {"base", "memories", "summary", "doc", "history", "tools"}
+    assert sections["summary"] == 0
+    assert all(sections[name] > 0 for name in ("base", "memories", "doc", "history", "tools"))
+
+    # A tool hop in the same turn is not recorded again.
+    mock_record.reset_mock()
+    state["messages"] += [
+        AIMessage(content="", tool_calls=[{"name": "save_memory", "args": {}, "id": "call-1"}]),
+        ToolMessage(content="saved", tool_call_id="call-1"),
+    ]
+    chat_node(state, config)
+    mock_record.assert_not_called()
+
+    usage.record_prompt("stats-test", {"base": 100, "history": 10})
+    usage.record_prompt("stats-test", {"base": 100, "history": 30})
+    assert usage.prompt_stats()["stats-test"] == {"turns": 2, "base": 100, "history": 20}
+
+
+# ---------------------------------------------------------------------------
+# Conversation window — trim_history
+# ---------------------------------------------------------------------------
+
+def _turn(i, tool_output=None):
+    """One past turn: question, optional tool round-trip, answer."""
+    msgs = [HumanMessage(content=f"question {i}", id=f"h{i}")]
+    if tool_output is not None:
+        msgs.append(AIMessage(content="", id=f"t{i}", tool_calls=[{"name": "search_tool", "args": {"query": "q"}, "id": f"c{i}"}]))
+        msgs.append(ToolMessage(content=tool_output, id=f"r{i}", tool_call_id=f"c{i}", name="search_tool"))
+    msgs.append(AIMessage(content=f"answer {i}", id=f"a{i}"))
+    return msgs
+
+
+def test_trim_history_keeps_everything_within_budget():
+    messages = _turn(1) + _turn(2) + [HumanMessage(content="now")]
+    assert trim_history(messages, max_tokens=10_000) == messages
+
+
+def test_trim_history_counted_reports_tokens_of_the_window_it_returns():
+    messages = _turn(1, tool_output="word " * 500) + _turn(2) + [HumanMessage(content="now", id="h3")]
+
+    trimmed, tokens = trim_history_counted(messages, max_tokens=10_000, tool_max_tokens=50)
+
+    assert trimmed == trim_history(messages, max_tokens=10_000, tool_max_tokens=50)
+    assert tokens == sum(count_message_tokens(m) for m in trimmed)
+
+
+def test_trim_history_drops_oldest_whole_turns():
+    messages = _turn(1) + _turn(2) + _turn(3) + [HumanMessage(content="now")]
+    budget = sum(count_message_tokens(m) for m in _turn(3) + [messages[-1]])
+
+    trimmed = trim_history(messages, max_tokens=budget)
+
+    assert trimmed == _turn(3) + [messages[-1]]
+    assert isinstance(trimmed[0], HumanMessage)
+
+
+def test_trim_history_always_keeps_current_turn_tool_output():
+    big = "x" * 5000
+    current = _turn(9, tool_output=big)[:-1]   # tool result not yet answered
+    messages = _turn(1) + current
+
+    trimmed = trim_history(messages, max_tokens=10, tool_max_tokens=50)
+
+    assert trimmed == current
+    assert trimmed[-1].content == big
+
+
+def test_trim_history_collapses_old_tool_output():
+    messages = _turn(1, tool_output="y" * 5000) + [HumanMessage(content="now")]
+
+    trimmed = trim_history(messages, max_tokens=10_000, tool_max_tokens=50)
+
+    tool_msg = next(m for m in trimmed if isinstance(m, ToolMessage))
+    assert len(tool_msg.content) < 200
+    assert "truncated" in tool_msg.content
+    # The stored message is untouched — only the prompt copy is collapsed.
+    assert len(messages[2].content) == 5000
+
+
+# ---------------------------------------------------------------------------
+# Rolling summary
+# ---------------------------------------------------------------------------
+
+def test_messages_to_fold_waits_for_trigger_then_keeps_recent_turns():
+    five_turns = [m for i in range(5) for m in _turn(i)]
+
+    assert messages_to_fold(five_turns, None, trigger_turns=5, keep_turns=2) == []
+
+    six_turns = five_turns + _turn(5)
+    fold = messages_to_fold(six_turns, None, trigger_turns=5, keep_turns=2)
+    assert fold == [m for i in range(4) for m in _turn(i)]
+
+    # Already-summarized turns are not folded again.
+    assert messages_to_fold(six_turns, fold[-1].id, trigger_turns=5, keep_turns=2) == []
+
+
+@patch("agent.graph.threads_service")
+@patch("agent.graph.document_rag")
+@patch("agent.graph.llm_with_tools")
+@patch("agent.graph.memory_service")
+def test_refresh_summary_replaces_folded_turns_in_prompt(
+    mock_memory, mock_llm, mock_doc_rag, mock_threads
+):
+    """After a summary is written, later prompts carry it instead of the folded turns."""
+    mock_memory.get_relevant_memories.return_value = ""
+    mock_doc_rag.search_thread_documents.return_value = ""
+    mock_threads.summarize_conversation.return_value = "User asked three questions."
+    mock_threads.get_pending_turns.return_value = None   # unknown — recount from the checkpoint
+    mock_llm.ainvoke = AsyncMock(return_value=AIMessage(content="ok"))
+
+    chatbot = init_graph(InMemorySaver())
+    config = {"configurable": {"thread_id": "thread-summary"}}
+    history = [m for i in range(4) for m in _turn(i)]
+
+    async def run():
+        await chatbot.aupdate_state(config, {"messages": history}, as_node="chat_node")
+        with patch("agent.graph.messages_to_fold", side_effect=lambda msgs, upto: msgs[:6]):
+            await refresh_summary("thread-summary")
+        await chatbot.ainvoke({"messages": [HumanMessage(content="next")]}, config)
+        return await chatbot.aget_state(config)
+
+    snapshot = asyncio.run(run())
+
+    assert snapshot.values["summary"] == "User asked three questions."
+    assert snapshot.values["summary_upto"] == history[5].id
+    sent = mock_llm.ainvoke.call_args[0][0]
+    assert "User asked three questions." in sent[0].content
+    assert [m.content for m in sent[1:]] == ["question 3", "answer 3", "next"]
+    # One turn was left unsummarized when the summary was written.
+    mock_threads.set_pending_turns.assert_called_once_with("thread-summary", 1)
+
+
+@patch("agent.graph.threads_service")
+def test_refresh_summary_skips_checkpoint_load_below_trigger(mock_threads):
+    """A thread under SUMMARY_TRIGGER_TURNS pending turns costs only the counter lookup."""
+    mock_threads.get_pending_turns.return_value = 3
+    chatbot = MagicMock()
+    chatbot.aget_state = AsyncMock()
+
+    with patch("agent.graph.chatbot", chatbot):
+        asyncio.run(refresh_summary("thread-short"))
+
+    mock_threads.get_pending_turns.assert_called_once_with("thread-short")
+    chatbot.aget_state.assert_not_called()
+    mock_threads.summarize_conversation.assert_not_called()
@@ -1,5 +1,9 @@
+import hashlib
+import json
+import os
 from fastapi.testclient import TestClient
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock, AsyncMock
+from langchain_core.messages import AIMessageChunk
 from server import app
 
 client = TestClient(app)
@@ -19,6 +23,24 @@ def test_get_threads_endpoint(mock_get_all_threads):
     assert data["threads"][0]["id"] == "thread-123"
 
 
+@patch("server.get_threads_page")
+def test_get_threads_endpoint_paginated(mock_page):
+    mock_page.return_value = ([{"id": "thread-123", "title": "Mock Thread", "is_pinned": False}], "abc")
+
+    response = client.get("/threads?limit=1&cursor=xyz")
+
+    assert response.status_code == 200
+    assert response.json()["next_cursor"] == "abc"
+    mock_page.assert_called_once_with(1, "xyz")
+
+
+@patch("server.get_threads_page", side_effect=ValueError("bad"))
+def test_get_threads_endpoint_bad_cursor(mock_page):
+    response = client.get("/threads?limit=1&cursor=bad")
+
+    assert response.status_code == 400
+
+
 @patch("server.delete_thread")
 def test_delete_thread_endpoint(mock_delete_thread):
     """Verify that deleting a thread returns a success message."""
@@ -92,23 +114,26 @@ def test_rename_thread_endpoint_failure(mock_rename_thread):
 FAKE_PDF_BYTES = b"%PDF-1.4 minimal fake pdf content"
 
 
-@patch("server.ingest_pdf")
-def test_upload_endpoint_success(mock_ingest):
-    """Verify a valid PDF upload returns 200 with filename and chunk count."""
-    mock_ingest.return_value = {"status": "success", "chunks": 12, "filename": "report.pdf"}
+@patch("server.enqueue_job", return_value="job-123")
+def test_upload_endpoint_queues_job(mock_enqueue, tmp_path):
+    """Verify a valid PDF upload is spooled to disk and queued, returning 202 with a job id."""
+    with patch("server.UPLOAD_SPOOL_DIR", str(tmp_path)):
+        response = client.post(
+            "/upload",
+            data={"thread_id": "thread-abc"},
+            files={"file": ("report.pdf", FAKE_PDF_BYTES, "application/pdf")},
+        )
 
-    response = client.post(
-        "/upload",
-        data={"thread_id": "thread-abc"},
-        files={"file": ("report.pdf", FAKE_PDF_BYTES, "application/pdf")},
-    )
-
-    assert response.status_code == 200
+    assert response.status_code == 202
     body = response.json()
-    assert body["status"] == "success"
-    assert body["chunks"] == 12
-    assert body["filename"] == "report.pdf"
-    mock_ingest.assert_called_once_with(FAKE_PDF_BYTES, "report.pdf", "thread-abc")
+    assert body == {"status": "queued", "job_id": "job-123", "filename": "report.pdf"}
+    # The spooled copy stays on disk for the worker, hashed in transit.
+    path, filename, thread_id, file_hash = mock_enqueue.call_args[0]
+    assert (filename, thread_id) == ("report.pdf", "thread-abc")
+    assert file_hash == hashlib.sha256(FAKE_PDF_BYTES).hexdigest()
+    assert os.path.dirname(path) == str(tmp_path)
+    with open(path, "rb") as f:
+        assert f.read() == FAKE_PDF_BYTES
 
 
 def test_upload_endpoint_wrong_file_type():
@@ -122,56 +147,88 @@ def test_upload_endpoint_wrong_file_type():
     assert "PDF" in response.json()["detail"]
 
 
-def test_upload_endpoint_file_too_large():
-    """Verify that files over 10 MB are rejected with 413."""
-    big_content = b"x" * (11 * 1024 * 1024)   # 11 MB
-    response = client.post(
-        "/upload",
-        data={"thread_id": "thread-abc"},
-        files={"file": ("large.pdf", big_content, "application/pdf")},
-    )
+@patch("server.enqueue_job")
+@patch("server.UPLOAD_MAX_MB", 1)
+def test_upload_endpoint_file_too_large(mock_enqueue, tmp_path):
+    """Verify that files over UPLOAD_MAX_MB are rejected with 413 and nothing is left on disk."""
+    big_content = b"x" * (2 * 1024 * 1024)   # 2 MB
+    with patch("server.UPLOAD_SPOOL_DIR", str(tmp_path)):
+        response = client.post(
+            "/upload",
+            data={"thread_id": "thread-abc"},
+            files={"file": ("large.pdf", big_content, "application/pdf")},
+        )
     assert response.status_code == 413
-    assert "10 MB" in response.json()["detail"]
+    assert "1 MB" in response.json()["detail"]
+    mock_enqueue.assert_not_called()
+    assert list(tmp_path.iterdir()) == []
+
+
+@patch("server.enqueue_job", side_effect=Exception("DB is down"))
+def test_upload_endpoint_queue_failure(mock_enqueue, tmp_path):
+    """Verify that failing to queue the job returns 500 and removes the spooled file."""
+    with patch("server.UPLOAD_SPOOL_DIR", str(tmp_path)):
+        response = client.post(
+            "/upload",
+            data={"thread_id": "thread-abc"},
+            files={"file": ("report.pdf", FAKE_PDF_BYTES, "application/pdf")},
+        )
+    assert response.status_code == 500
+    assert list(tmp_path.iterdir()) == []
 
 
-@patch("server.ingest_pdf")
-def test_upload_endpoint_duplicate(mock_ingest):
-    """Verify that uploading the same PDF twice returns a duplicate message."""
-    mock_ingest.return_value = {"status": "duplicate", "chunks": 0}
+# ---------------------------------------------------------------------------
+# GET /upload/{job_id}
+# ---------------------------------------------------------------------------
 
-    response = client.post(
-        "/upload",
-        data={"thread_id": "thread-abc"},
-        files={"file": ("report.pdf", FAKE_PDF_BYTES, "application/pdf")},
-    )
+def _job(status, **fields):
+    return {
+        "job_id": "job-123", "thread_id": "thread-abc", "filename": "report.pdf",
+        "status": status, "pages_done": 0, "pages_total": None, "chunks": 0, "error": None,
+        **fields,
+    }
+
+
+@patch("server.get_job")
+def test_upload_job_reports_progress(mock_get_job):
+    mock_get_job.return_value = _job("running", pages_done=40, pages_total=300, chunks=128)
+
+    response = client.get("/upload/job-123")
 
     assert response.status_code == 200
-    assert response.json()["status"] == "duplicate"
+    body = response.json()
+    assert body["status"] == "running"
+    assert (body["pages_done"], body["pages_total"], body["chunks"]) == (40, 300, 128)
+    assert "message" not in body
 
 
-@patch("server.ingest_pdf")
-def test_upload_endpoint_empty_pdf(mock_ingest):
-    """Verify that image-only PDFs (no extractable text) return 422."""
-    mock_ingest.return_value = {"status": "empty", "chunks": 0}
+@patch("server.get_job")
+def test_upload_job_duplicate_has_message(mock_get_job):
+    """Verify that uploading the same PDF twice reports a duplicate message."""
+    mock_get_job.return_value = _job("duplicate")
 
-    response = client.post(
-        "/upload",
-        data={"thread_id": "thread-abc"},
-        files={"file": ("scanned.pdf", FAKE_PDF_BYTES, "application/pdf")},
-    )
+    body = client.get("/upload/job-123").json()
 
-    assert response.status_code == 422
+    assert body["status"] == "duplicate"
+    assert "already been uploaded" in body["message"]
 
 
-@patch("server.ingest_pdf", side_effect=Exception("DB is down"))
-def test_upload_endpoint_ingest_failure(mock_ingest):
-    """Verify that an unexpected ingest exception returns 500."""
-    response = client.post(
-        "/upload",
-        data={"thread_id": "thread-abc"},
-        files={"file": ("report.pdf", FAKE_PDF_BYTES, "application/pdf")},
-    )
-    assert response.status_code == 500
+@patch("server.get_job")
+def test_upload_job_failure_hides_internal_error(mock_get_job):
+    """Verify a failed job reports a generic message, not the raw exception text."""
+    mock_get_job.return_value = _job("failed", error="psycopg.OperationalError: secret-host")
+
+    body = client.get("/upload/job-123").json()
+
+    assert body["status"] == "failed"
+    assert "error" not in body
+    assert "secret-host" not in json.dumps(body)
+
+
+@patch("server.get_job", return_value=None)
+def test_upload_job_not_found(mock_get_job):
+    response = client.get("/upload/unknown")
+    assert response.status_code == 404
 
 
 # ---------------------------------------------------------------------------
@@ -192,3 +249,121 @@ def test_get_thread_files_endpoint(mock_list_files):
     assert "files" in body
     assert body["files"][0]["filename"] == "report.pdf"
     mock_list_files.assert_called_once_with("thread-abc")
+
+
+# ---------------------------------------------------------------------------
+# POST /chat
+# ---------------------------------------------------------------------------
+
+@patch("server.refresh_summary")
+@patch("server.update_timestamp", return_value=False)
+@patch("server.backend")
+def test_chat_endpoint_streams_from_astream(mock_backend, mock_update, mock_summary):
+    """Verify /chat drives chatbot.astream and emits NDJSON thread_id + chunk events."""
+    async def fake_astream(inputs, config, stream_mode):
+        assert config["configurable"]["thread_id"] == "thread-abc"
+        yield AIMessageChunk(content="Hello"), {}
+        yield AIMessageChunk(content=" world"), {}
+
+    mock_backend.chatbot.astream = fake_astream
+    mock_backend.chatbot.aget_state = AsyncMock(return_value=MagicMock(values={"messages": []}, config={}))
+
+    response = client.post("/chat", json={"message": "Hi", "thread_id": "thread-abc"})
+
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines() if line]
+    assert events[0] == {"type": "thread_id", "content": "thread-abc"}
+    assert [e["content"] for e in events[1:]] == ["Hello", " world"]
+    mock_update.assert_called_once_with("thread-abc")
+    mock_summary.assert_called_once_with("thread-abc")
+    # The turn's checkpoint is loaded once, after the stream, to warm /history.
+    mock_backend.chatbot.aget_state.assert_awaited_once()
+
+
+@patch("server.generate_and_save_title")
+@patch("server.refresh_summary")
+@patch("server.update_timestamp", return_value=True)
+@patch("server.backend")
+def test_chat_endpoint_titles_new_thread(mock_backend, mock_update, mock_summary, mock_title):
+    """A thread the upsert reports as new gets a title generated in the background."""
+    async def fake_astream(inputs, config, stream_mode):
+        yield AIMessageChunk(content="Hi"), {}
+
+    mock_backend.chatbot.astream = fake_astream
+
+    response = client.post("/chat", json={"message": "Hello there", "thread_id": "thread-new"})
+
+    assert response.status_code == 200
+    mock_title.assert_called_once_with("thread-new", "Hello there")
+
+
+# ---------------------------------------------------------------------------
+# GET /history/{id}
+# ---------------------------------------------------------------------------
+
+CACHED_HISTORY = [
+    {"id": f"msg-{i}", "role": "user", "content": f"message {i}", "name": None} for i in range(5)
+]
+
+
+@patch("server.get_cached_history", return_value=CACHED_HISTORY)
+@patch("server.latest_checkpoint_id", return_value="ckpt-1")
+@patch("server.backend")
+def test_history_served_from_cache_without_loading_state(mock_backend, mock_ckpt, mock_cached):
+    """A cache hit for the latest checkpoint must not deserialize graph state."""
+    response = client.get("/history/thread-abc")
+
+    assert response.status_code == 200
+    assert response.json() == {"messages": CACHED_HISTORY, "next_before": None}
+    mock_cached.assert_called_once_with("thread-abc", "ckpt-1")
+    mock_backend.chatbot.aget_state.assert_not_called()
+
+
+@patch("server.get_cached_history", return_value=CACHED_HISTORY)
+@patch("server.latest_checkpoint_id", return_value="ckpt-1")
+def test_history_cursor_pagination(mock_ckpt, mock_cached):
+    """limit returns the newest page; next_before walks back to the start."""
+    first = client.get("/history/thread-abc", params={"limit": 2}).json()
+    assert [m["content"] for m in first["messages"]] == ["message 3", "message 4"]
+    assert first["next_before"] == "msg-3"
+
+    second = client.get("/history/thread-abc", params={"limit": 2, "before": "msg-3"}).json()
+    assert [m["content"] for m in second["messages"]] == ["message 1", "message 2"]
+
+    last = client.get("/history/thread-abc", params={"limit": 2, "before": second["next_before"]}).json()
+    assert [m["content"] for m in last["messages"]] == ["message 0"]
+    assert last["next_before"] is None
+
+    unknown = client.get("/history/thread-abc", params={"limit": 2, "before": "msg-gone"})
+    assert unknown.status_code == 400
+
+
+# ---------------------------------------------------------------------------
+# GET /stats
+# ---------------------------------------------------------------------------
+
+@patch("server.query_cache_stats", return_value={"lru_hits": 4, "misses": 1, "hit_ratio": 0.8})
+@patch("server.embedding_stats", return_value={"requests": 3, "mean_ms": 120.0})
+def test_stats_reports_embedding_counters(mock_embedding_stats, mock_query_cache_stats):
+    response = client.get("/stats")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["embeddings"] == {"requests": 3, "mean_ms": 120.0}
+    assert body["query_embedding_cache"]["hit_ratio"] == 0.8
+
+
+@patch("server.usage_stats", return_value={"calls": 2, "input_tokens": 900, "cached_tokens": 600, "cache_hit_ratio": 0.667})
+def test_stats_reports_llm_prompt_cache_usage(mock_usage_stats):
+    response = client.get("/stats")
+
+    assert response.status_code == 200
+    assert response.json()["llm_usage"]["cache_hit_ratio"] == 0.667
+
+
+@patch("server.prompt_stats", return_value={"default": {"turns": 4, "base": 600.0, "history": 1200.0}})
+def test_stats_reports_prompt_breakdown_per_variant(mock_prompt_stats):
+    response = client.get("/stats")
+
+    assert response.status_code == 200
+    assert response.json()["prompt_variants"]["default"]["turns"] == 4
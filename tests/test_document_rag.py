@@ -1,13 +1,19 @@
 import json
 import hashlib
+import numpy as np
 import pytest
 from unittest.mock import MagicMock, patch, PropertyMock
+import documents.service as document_service
+from documents.service import get_thread_documents
+from tools import document_rag
 from tools.document_rag import (
     ingest_pdf,
     search_thread_documents,
+    retrieve,
     list_thread_files,
-    set_connection,
     _is_already_ingested,
+    search_uploads,
+    _is_identifier_query,
 )
 
 
@@ -15,6 +21,12 @@ from tools.document_rag import (
 # Helpers
 # ---------------------------------------------------------------------------
 
+def set_connection(pool):
+    """Wire one pool into document_rag and the registry, as startup does."""
+    document_rag.set_connection(pool)
+    document_service.set_connection(pool)
+
+
 def _make_mock_pool(fetchone_return=None, fetchall_return=None, rowcount=0):
     pool = MagicMock()
     conn = MagicMock()
@@ -47,17 +59,68 @@ def test_is_already_ingested_returns_false_when_no_pool():
 
 
 def test_is_already_ingested_returns_true_when_row_found():
-    pool, conn, cursor = _make_mock_pool(fetchone_return=(1,))
+    pool, conn, cursor = _make_mock_pool(fetchall_return=[("report.pdf", "abc123", 4, None)])
     set_connection(pool)
     assert _is_already_ingested("abc123", "thread-1") is True
+    assert "FROM thread_documents" in conn.execute.call_args[0][0]
 
 
 def test_is_already_ingested_returns_false_when_no_row():
-    pool, conn, cursor = _make_mock_pool(fetchone_return=None)
+    pool, conn, cursor = _make_mock_pool(fetchall_return=[("report.pdf", "other", 4, None)])
     set_connection(pool)
     assert _is_already_ingested("abc123", "thread-1") is False
 
 
+def test_is_already_ingested_bypasses_registry_cache():
+    pool, conn, cursor = _make_mock_pool(fetchall_return=[])
+    set_connection(pool)
+    assert get_thread_documents("thread-1") == []
+
+    cursor.fetchall.return_value = [("report.pdf", "abc123", 4, None)]   # ingested by another worker
+
+    assert get_thread_documents("thread-1") == []   # cached
+    assert _is_already_ingested("abc123", "thread-1") is True
+
+
+def test_registry_notification_invalidates_only_that_thread():
+    pool, conn, cursor = _make_mock_pool(fetchall_return=[])
+    set_connection(pool)
+    get_thread_documents("thread-1")
+    get_thread_documents("thread-2")
+
+    # Another worker registered an upload for thread-1 (delivered by the listener).
+    document_service.invalidate_thread_documents("thread-1")
+    cursor.fetchall.return_value = [("report.pdf", "abc123", 4, None)]
+
+    assert get_thread_documents("thread-1")[0]["file_hash"] == "abc123"
+    assert get_thread_documents("thread-2") == []   # still cached
+    assert conn.execute.call_count == 3
+
+
+def test_read_racing_an_invalidation_is_not_cached():
+    pool, conn, cursor = _make_mock_pool()
+    set_connection(pool)
+
+    def stale_rows():
+        # Another worker's upload commits, and its NOTIFY arrives, mid-query.
+        document_service.invalidate_thread_documents("thread-1")
+        return []
+
+    cursor.fetchall.side_effect = stale_rows
+    assert get_thread_documents("thread-1") == []
+
+    cursor.fetchall.side_effect = None
+    cursor.fetchall.return_value = [("report.pdf", "abc123", 4, None)]
+    assert get_thread_documents("thread-1")[0]["file_hash"] == "abc123"
+
+
+def test_duplicate_registration_does_not_notify():
+    pool, conn, cursor = _make_mock_pool(rowcount=0)
+
+    assert document_service.register_document(conn, "thread-1", "abc123", "report.pdf", 4) is False
+    assert all("pg_notify" not in c[0][0] for c in conn.execute.call_args_list)
+
+
 # ---------------------------------------------------------------------------
 # ingest_pdf
 # ---------------------------------------------------------------------------
@@ -65,9 +128,27 @@ def test_is_already_ingested_returns_false_when_no_row():
 MINIMAL_PDF_TEXT = "This is a test document with enough content to chunk properly."
 
 
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / "report.pdf"
+    path.write_bytes(b"%PDF-1.4 fake")
+    return str(path)
+
+
+def _mock_doc(*page_texts):
+    doc = MagicMock()
+    pages = []
+    for text in page_texts:
+        page = MagicMock()
+        page.get_text.return_value = text
+        pages.append(page)
+    doc.__iter__ = MagicMock(return_value=iter(pages))
+    return doc
+
+
 @patch("tools.document_rag._is_already_ingested", return_value=True)
-def test_ingest_pdf_returns_duplicate_when_hash_exists(mock_dedup):
-    result = ingest_pdf(b"%PDF-1.4 fake", "report.pdf", "thread-1")
+def test_ingest_pdf_returns_duplicate_when_hash_exists(mock_dedup, pdf_path):
+    result = ingest_pdf(pdf_path, "report.pdf", "thread-1")
     assert result["status"] == "duplicate"
     assert result["chunks"] == 0
 
@@ -75,47 +156,141 @@ def test_ingest_pdf_returns_duplicate_when_hash_exists(mock_dedup):
 @patch("tools.document_rag._is_already_ingested", return_value=False)
 @patch("tools.document_rag._embeddings")
 @patch("tools.document_rag.fitz")
-def test_ingest_pdf_success(mock_fitz, mock_embeddings, mock_dedup):
+def test_ingest_pdf_success(mock_fitz, mock_embeddings, mock_dedup, pdf_path):
     # Simulate PyMuPDF returning one page of text
-    mock_doc = MagicMock()
-    mock_page = MagicMock()
-    mock_page.get_text.return_value = MINIMAL_PDF_TEXT * 5   # enough text to produce a chunk
-    mock_doc.__iter__ = MagicMock(return_value=iter([mock_page]))
-    mock_fitz.open.return_value = mock_doc
+    mock_fitz.open.return_value = _mock_doc(MINIMAL_PDF_TEXT * 5)   # enough text to produce a chunk
 
     # Simulate embeddings returning a 1536-dim vector
     mock_embeddings.embed_documents.return_value = [[0.1] * 1536]
 
-    pool, conn, cursor = _make_mock_pool()
+    pool, conn, cursor = _make_mock_pool(rowcount=1)
     set_connection(pool)
 
-    result = ingest_pdf(b"%PDF-1.4 fake", "report.pdf", "thread-1")
+    result = ingest_pdf(pdf_path, "report.pdf", "thread-1")
 
     assert result["status"] == "success"
     assert result["chunks"] >= 1
     assert result["filename"] == "report.pdf"
-    insert_args = conn.execute.call_args[0][1]
-    assert isinstance(insert_args[4], str)
-    assert insert_args[4].startswith("[0.1,")
-    conn.commit.assert_called_once()
+    # Chunks are bulk-written with one COPY, not an INSERT per chunk.
+    copy = conn.cursor.return_value.__enter__.return_value.copy.return_value.__enter__.return_value
+    rows = [c[0][0] for c in copy.write_row.call_args_list]
+    assert len(rows) == result["chunks"]
+    assert rows[0][1:3] == ("thread-1", "pdf_upload")
+    metadata = rows[0][4]
+    assert metadata.pop("ingest_id")
+    assert metadata == {
+        "filename": "report.pdf",
+        "file_hash": hashlib.sha256(b"%PDF-1.4 fake").hexdigest(),   # hashed from disk
+        "chunk_index": 0,
+    }
+    assert rows[0][5].dtype == np.float32
+    assert rows[0][5].shape == (1536,)
+    # The upload is registered only after its last batch has been written,
+    # notifying other workers in the same transaction.
+    (sql, params), (notify_sql, notify_params) = [c[0] for c in conn.execute.call_args_list[-2:]]
+    assert "INSERT INTO thread_documents" in sql
+    assert params[0] == "thread-1" and params[2:] == ("report.pdf", result["chunks"])
+    assert "pg_notify" in notify_sql and notify_params[1] == "thread-1"
+    # Leftover cleanup, the batch, and the registry row each commit on their own.
+    assert conn.commit.call_count == 3
 
 
 @patch("tools.document_rag._is_already_ingested", return_value=False)
+@patch("tools.document_rag._embeddings")
 @patch("tools.document_rag.fitz")
-def test_ingest_pdf_empty_returns_empty_status(mock_fitz, mock_dedup):
+def test_ingest_pdf_rolls_back_when_concurrent_ingest_registered_first(mock_fitz, mock_embeddings, mock_dedup, pdf_path):
+    mock_fitz.open.return_value = _mock_doc(MINIMAL_PDF_TEXT * 5)
+    mock_embeddings.embed_documents.return_value = [[0.1] * 1536]
+    pool, conn, cursor = _make_mock_pool(rowcount=0)   # ON CONFLICT DO NOTHING
+    set_connection(pool)
+
+    result = ingest_pdf(pdf_path, "report.pdf", "thread-1", file_hash="abc")
+
+    assert result == {"status": "duplicate", "chunks": 0}
+    conn.rollback.assert_called_once()
+    # Only this run's chunks are removed, not the winning ingest's.
+    sql, params = conn.execute.call_args[0]
+    assert sql.lstrip().startswith("DELETE FROM document_chunks") and "ingest_id" in sql
+    assert params[:2] == ("thread-1", "abc")
+
+
+@patch("tools.document_rag._is_already_ingested", return_value=False)
+@patch("tools.document_rag._embeddings")
+@patch("tools.document_rag.fitz")
+def test_ingest_pdf_embeds_without_holding_a_connection(mock_fitz, mock_embeddings, mock_dedup, pdf_path):
+    """The embedding API is never called while a pooled connection is checked out."""
+    mock_fitz.open.return_value = _mock_doc(MINIMAL_PDF_TEXT * 5)
+    pool, conn, cursor = _make_mock_pool(rowcount=1)
+    checked_out = []
+    pool.connection.return_value.__enter__.side_effect = lambda: checked_out.append(1) or conn
+    pool.connection.return_value.__exit__.side_effect = lambda *exc: checked_out.pop() and None
+    mock_embeddings.embed_documents.side_effect = (
+        lambda texts: [[0.1] * 1536 for _ in texts] if not checked_out else pytest.fail("connection held")
+    )
+    set_connection(pool)
+
+    assert ingest_pdf(pdf_path, "report.pdf", "thread-1", file_hash="abc")["status"] == "success"
+
+
+@patch("tools.document_rag.INGEST_BATCH_CHUNKS", 1)
+@patch("tools.document_rag._is_already_ingested", return_value=False)
+@patch("tools.document_rag._embeddings")
+@patch("tools.document_rag.fitz")
+def test_ingest_pdf_failure_discards_written_chunks(mock_fitz, mock_embeddings, mock_dedup, pdf_path):
+    paragraph = "word " * 150
+    mock_fitz.open.return_value = _mock_doc(paragraph, paragraph)
+    mock_embeddings.embed_documents.side_effect = [[[0.1] * 1536], RuntimeError("API down")]
+    pool, conn, cursor = _make_mock_pool(rowcount=1)
+    set_connection(pool)
+
+    with pytest.raises(RuntimeError):
+        ingest_pdf(pdf_path, "big.pdf", "thread-1", file_hash="abc")
+
+    sql = conn.execute.call_args[0][0]
+    assert "DELETE FROM document_chunks" in sql and "ingest_id" in sql
+
+
+@patch("tools.document_rag._is_already_ingested", return_value=False)
+@patch("tools.document_rag.fitz")
+def test_ingest_pdf_empty_returns_empty_status(mock_fitz, mock_dedup, pdf_path):
     # Simulate PDF with no extractable text (image-only)
-    mock_doc = MagicMock()
-    mock_page = MagicMock()
-    mock_page.get_text.return_value = "   "   # whitespace only
-    mock_doc.__iter__ = MagicMock(return_value=iter([mock_page]))
-    mock_fitz.open.return_value = mock_doc
+    mock_fitz.open.return_value = _mock_doc("   ")   # whitespace only
 
-    result = ingest_pdf(b"%PDF-1.4 fake", "scanned.pdf", "thread-1")
+    result = ingest_pdf(pdf_path, "scanned.pdf", "thread-1", file_hash="abc")
 
     assert result["status"] == "empty"
     assert result["chunks"] == 0
 
 
+@patch("tools.document_rag.INGEST_BATCH_CHUNKS", 2)
+@patch("tools.document_rag._is_already_ingested", return_value=False)
+@patch("tools.document_rag._embeddings")
+@patch("tools.document_rag.fitz")
+def test_ingest_pdf_embeds_and_writes_in_batches(mock_fitz, mock_embeddings, mock_dedup, pdf_path):
+    paragraph = "word " * 150   # ~750 chars, one chunk per page
+    mock_fitz.open.return_value = _mock_doc(paragraph, paragraph, "", paragraph)
+    mock_embeddings.embed_documents.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+
+    pool, conn, cursor = _make_mock_pool(rowcount=1)
+    set_connection(pool)
+
+    mock_fitz.open.return_value.page_count = 4
+    progress = MagicMock()
+
+    result = ingest_pdf(pdf_path, "big.pdf", "thread-1", file_hash="abc", progress=progress)
+
+    assert progress.call_args_list[-1][0] == (4, 4, result["chunks"])
+    batch_sizes = [len(c[0][0]) for c in mock_embeddings.embed_documents.call_args_list]
+    assert max(batch_sizes) <= 2
+    assert sum(batch_sizes) == result["chunks"] >= 3
+    copy = conn.cursor.return_value.__enter__.return_value.copy.return_value.__enter__.return_value
+    indexes = [c[0][0][4]["chunk_index"] for c in copy.write_row.call_args_list]
+    assert indexes == list(range(result["chunks"]))
+    # One short transaction per batch, plus leftover cleanup and registration.
+    assert conn.commit.call_count == len(batch_sizes) + 2
+    mock_fitz.open.return_value.close.assert_called_once()
+
+
 # ---------------------------------------------------------------------------
 # search_thread_documents
 # ---------------------------------------------------------------------------
@@ -127,34 +302,36 @@ def test_search_returns_empty_string_when_no_pool():
 
 
 def test_search_returns_empty_string_when_no_uploads():
-    pool, conn, cursor = _make_mock_pool(fetchone_return=(0,))   # COUNT = 0
+    pool, conn, cursor = _make_mock_pool(fetchall_return=[])   # empty registry
     set_connection(pool)
 
-    result = search_thread_documents("thread-1", "any query")
+    assert search_thread_documents("thread-1", "any query") == ""
+    assert search_thread_documents("thread-1", "another query") == ""
 
-    assert result == ""
-    # Should NOT call embed (short-circuit after COUNT check)
-    # We verify by checking no further DB calls were made beyond the COUNT
+    # Should NOT search or embed (short-circuit after the registry check),
+    # and the second message is answered from the registry cache.
     assert conn.execute.call_count == 1
+    assert "FROM thread_documents" in conn.execute.call_args[0][0]
 
 
+@patch("tools.document_rag.RAG_RETRIEVAL_MODE", "vector")
 @patch("tools.document_rag._embeddings")
 def test_search_returns_formatted_chunks(mock_embeddings):
-    # First DB call: COUNT returns 2 (thread has uploads)
+    # First DB call: registry lists one upload
     # Second DB call: similarity search returns 2 rows
     pool = MagicMock()
     conn = MagicMock()
 
-    count_cursor = MagicMock()
-    count_cursor.fetchone.return_value = (2,)
+    registry_cursor = MagicMock()
+    registry_cursor.fetchall.return_value = [("report.pdf", "abc", 2, None)]
 
     search_cursor = MagicMock()
     search_cursor.fetchall.return_value = [
-        ("Chunk A text", "report.pdf"),
-        ("Chunk B text", "report.pdf"),
+        ("Chunk A text", "report.pdf", "pdf_upload", 0.1, 0, [1.0, 0.0]),
+        ("Chunk B text", "report.pdf", "pdf_upload", 0.2, 7, [0.0, 1.0]),
     ]
 
-    conn.execute.side_effect = [count_cursor, search_cursor]
+    conn.execute.side_effect = [registry_cursor, search_cursor]
     pool.connection.return_value.__enter__.return_value = conn
 
     mock_embeddings.embed_query.return_value = [0.1] * 1536
@@ -166,9 +343,148 @@ def test_search_returns_formatted_chunks(mock_embeddings):
     assert "Chunk A text" in result
     assert "Chunk B text" in result
     assert "---" in result   # separator between chunks
-    search_args = conn.execute.call_args_list[1][0][1]
-    assert isinstance(search_args[1], str)
-    assert search_args[1].startswith("[0.1,")
+    search_sql, search_args = conn.execute.call_args_list[1][0]
+    # Query vector is bound as a float32 array (binary pgvector), not a text literal.
+    assert isinstance(search_args["q"], np.ndarray)
+    assert search_args["q"].dtype == np.float32
+    assert search_args["thread_id"] == "thread-1"
+    assert "unnest" not in search_sql   # no URL scope requested
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("AB-1234", True),
+    ("clause 4.2.1", True),
+    ("SKU12345", True),
+    ("INV/2024/001", True),
+    ("Q3 revenue", False),
+    ("FAQ summary", False),
+    ("page 12", False),
+    ("AAPL", False),
+    ("what is the revenue?", False),
+    ("summarize the termination clause for me", False),
+])
+def test_is_identifier_query(query, expected):
+    assert _is_identifier_query(query) is expected
+
+
+@patch("tools.document_rag._embeddings")
+def test_search_uploads_identifier_query_skips_embedding(mock_embeddings):
+    pool, conn, cursor = _make_mock_pool(fetchall_return=[("Part AB-1234 spec", "parts.pdf", 3, [0.1], 1, True)])
+    set_connection(pool)
+
+    results = search_uploads("thread-1", "AB-1234 spec")
+
+    mock_embeddings.embed_query.assert_not_called()
+    assert results[0]["content"] == "Part AB-1234 spec"
+    sql, params = conn.execute.call_args[0]
+    assert "content_tsv @@" in sql and "<=>" not in sql
+    # User text is only ever parsed by websearch_to_tsquery/plainto_tsquery.
+    assert "quote_literal" not in sql and "::tsquery" not in sql
+    assert params["text"] == "AB-1234 spec"
+    assert params["terms"] == "AB-1234 or spec"
+
+
+@patch("tools.document_rag._embeddings")
+def test_search_uploads_identifier_query_with_weak_text_hit_falls_back_to_hybrid(mock_embeddings):
+    # The best full-text hit matches "spec" but not the identifier itself.
+    pool, conn, cursor = _make_mock_pool(fetchall_return=[("Spec sheet", "parts.pdf", 0, [0.1], 1, False)])
+    mock_embeddings.embed_query.return_value = [0.1] * 1536
+    set_connection(pool)
+
+    search_uploads("thread-1", "AB-1234 spec")
+
+    mock_embeddings.embed_query.assert_called_once_with("AB-1234 spec")
+    assert "FULL OUTER JOIN" in conn.execute.call_args[0][0]
+
+
+@patch("tools.document_rag._embeddings")
+def test_search_uploads_identifier_query_without_text_hits_falls_back_to_hybrid(mock_embeddings):
+    pool, conn, cursor = _make_mock_pool(fetchall_return=[])
+    mock_embeddings.embed_query.return_value = [0.1] * 1536
+    set_connection(pool)
+
+    search_uploads("thread-1", "AB-1234")
+
+    mock_embeddings.embed_query.assert_called_once_with("AB-1234")
+    assert conn.execute.call_count == 2
+    assert "FULL OUTER JOIN" in conn.execute.call_args[0][0]
+
+
+@patch("tools.document_rag._embeddings")
+def test_search_uploads_fuses_lexical_and_vector_ranks_in_one_query(mock_embeddings):
+    pool, conn, cursor = _make_mock_pool(
+        fetchall_return=[
+            ("both lists", "a.pdf", 0, [1.0, 0.0], 2 / 61, 0.3),
+            ("vector only", "a.pdf", 5, [0.0, 1.0], 1 / 62, 0.35),
+        ]
+    )
+    mock_embeddings.embed_query.return_value = [0.1] * 1536
+    set_connection(pool)
+
+    results = search_uploads("thread-1", "what does the contract say about renewal?", top_k=2)
+
+    conn.execute.assert_called_once()
+    sql, params = conn.execute.call_args[0]
+    assert "lexical" in sql and "semantic" in sql and "FULL OUTER JOIN" in sql
+    assert params["rrf_k"] == 60 and params["k"] == 2 and params["n"] >= 2
+    assert isinstance(params["q"], np.ndarray)
+    assert [r["content"] for r in results] == ["both lists", "vector only"]
+    assert results[0]["score"] == pytest.approx(2 / 61)
+    assert results[0]["distance"] == 0.3
+
+
+@patch("tools.document_rag._embeddings")
+def test_search_chunks_takes_top_k_per_url_in_one_query(mock_embeddings):
+    pool, conn, cursor = _make_mock_pool()
+    cursor.fetchall.return_value = [
+        ("web text", "https://a.example", "web_scrape", 0.05, 2, [0.1]),
+        ("other page", "https://b.example", "web_scrape", 0.3, 0, [0.2]),
+    ]
+    mock_embeddings.embed_query.return_value = [0.1] * 1536
+    set_connection(pool)
+
+    results = retrieve("query", urls=["https://a.example", "https://b.example"], top_k=2)
+
+    mock_embeddings.embed_query.assert_called_once_with("query")
+    conn.execute.assert_called_once()
+    sql, params = conn.execute.call_args[0]
+    assert "LATERAL" in sql and "pdf_upload" not in sql
+    assert params["urls"] == ["https://a.example", "https://b.example"] and params["k"] == 2
+    assert results[0] == {
+        "content": "web text", "source": "https://a.example", "source_type": "web_scrape",
+        "distance": 0.05, "chunk_index": 2, "embedding": [0.1],
+    }
+
+
+def test_search_chunks_rejects_mixed_scopes():
+    with pytest.raises(ValueError):
+        document_rag.search_chunks([0.1], thread_id="thread-1", urls=["https://a.example"])
+
+
+@patch("tools.document_rag._embeddings")
+def test_retrieve_without_scope_skips_embedding(mock_embeddings):
+    assert retrieve("query") == []
+    mock_embeddings.embed_query.assert_not_called()
+
+
+@patch("tools.document_rag.search_uploads")
+def test_search_injects_only_passages_close_to_the_message(mock_search):
+    pool, conn, cursor = _make_mock_pool(fetchall_return=[("report.pdf", "abc", 3, None)])
+    set_connection(pool)
+
+    def chunk(content, index, distance):
+        return {
+            "content": content, "source": "report.pdf", "source_type": "pdf_upload",
+            "score": None, "distance": distance, "chunk_index": index, "embedding": [float(index), 1.0],
+        }
+
+    mock_search.return_value = [chunk("unrelated", 0, 0.9), chunk("weak", 5, 0.8)]
+    assert search_thread_documents("thread-1", "thanks, that helps") == ""
+
+    mock_search.return_value = [chunk("strong match", 2, 0.3), chunk("far behind", 8, 0.55)]
+    result = search_thread_documents("thread-1", "what is the notice period?")
+    assert "strong match" in result
+    assert "far behind" not in result   # outside the margin of the best match
 
 
 @patch("tools.document_rag._embeddings")
@@ -196,7 +512,7 @@ def test_list_thread_files_returns_formatted_list():
     ts = datetime(2025, 5, 15, 10, 0, 0)
 
     pool, conn, cursor = _make_mock_pool(
-        fetchall_return=[("report.pdf", 42, ts), ("slides.pdf", 18, ts)]
+        fetchall_return=[("report.pdf", "h1", 42, ts), ("slides.pdf", "h2", 18, ts)]
     )
     set_connection(pool)
 
@@ -205,6 +521,7 @@ def test_list_thread_files_returns_formatted_list():
     assert len(result) == 2
     assert result[0] == {"filename": "report.pdf", "chunks": 42, "uploaded_at": ts.isoformat()}
     assert result[1]["filename"] == "slides.pdf"
+    assert "FROM thread_documents" in conn.execute.call_args[0][0]   # no document_chunks scan
 
 
 def test_list_thread_files_returns_empty_on_db_error():
@@ -1,6 +1,15 @@
+import threading
+import time
+import numpy as np
 import pytest
-from unittest.mock import MagicMock
+from datetime import date
+from unittest.mock import MagicMock, patch
+import memory.service as memory_service
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
 from threads.service import set_connection, get_all_threads, save_title, delete_thread, pin_thread, rename_thread
+from threads.service import update_timestamp
+from threads.service import format_history, get_cached_history, cache_history, get_threads_page
+from datetime import datetime
 
 @pytest.fixture
 def mock_pool():
@@ -37,27 +46,103 @@ def test_get_all_threads(mock_pool):
     assert result[1] == {"id": "thread-456", "title": "Second Chat", "is_pinned": False}
 
 
+def test_get_all_threads_is_cached_until_a_write(mock_pool):
+    pool, conn, cursor = mock_pool
+    cursor.fetchall.return_value = [("thread-123", "First Chat", False)]
+
+    get_all_threads()
+    get_all_threads()
+    assert conn.execute.call_count == 1
+
+    save_title("thread-456", "New Chat")
+    get_all_threads()
+    assert conn.execute.call_count == 3
+
+
+def test_get_threads_page_returns_keyset_cursor(mock_pool):
+    pool, conn, cursor = mock_pool
+    ts = datetime(2026, 1, 1, 12, 0, 0)
+    cursor.fetchall.return_value = [
+        ("thread-3", "Third", True, ts),
+        ("thread-2", "Second", False, ts),
+        ("thread-1", "First", False, ts),
+    ]
+
+    threads, next_cursor = get_threads_page(2)
+
+    assert [t["id"] for t in threads] == ["thread-3", "thread-2"]
+    assert next_cursor is not None
+    assert conn.execute.call_args[0][1] == (3,)
+
+    cursor.fetchall.return_value = [("thread-1", "First", False, ts)]
+    threads, last_cursor = get_threads_page(2, next_cursor)
+
+    sql, params = conn.execute.call_args[0]
+    assert "(is_pinned, last_updated, thread_id) <" in sql
+    assert params == (False, ts, "thread-2", 3)
+    assert [t["id"] for t in threads] == ["thread-1"]
+    assert last_cursor is None
+
+
+def test_get_threads_page_rejects_malformed_cursor(mock_pool):
+    with pytest.raises(ValueError):
+        get_threads_page(10, "not-a-cursor")
+
+
 def test_delete_thread(mock_pool):
     pool, conn, cursor = mock_pool
 
     result = delete_thread("thread-999")
 
     # Verify it checked for document_chunks and deleted all thread-owned state.
-    assert conn.execute.call_count == 6
+    assert conn.execute.call_count == 8
 
     calls = conn.execute.call_args_list
     assert "DELETE FROM thread_metadata" in calls[0][0][0]
     assert "SELECT to_regclass" in calls[1][0][0]
     assert "DELETE FROM document_chunks" in calls[2][0][0]
-    assert "DELETE FROM checkpoints" in calls[3][0][0]
-    assert "DELETE FROM checkpoint_writes" in calls[4][0][0]
-    assert "DELETE FROM checkpoint_blobs" in calls[5][0][0]
+    assert "DELETE FROM thread_documents" in calls[3][0][0]
+    # Other workers drop their cached registry rows when this commits.
+    assert "pg_notify" in calls[4][0][0] and calls[4][0][1][1] == "thread-999"
+    assert "DELETE FROM checkpoints" in calls[5][0][0]
+    assert "DELETE FROM checkpoint_writes" in calls[6][0][0]
+    assert "DELETE FROM checkpoint_blobs" in calls[7][0][0]
     assert calls[0][0][1] == ("thread-999",)
 
     conn.commit.assert_called_once()
     assert result is True
 
 
+def test_delete_thread_evicts_cached_history(mock_pool):
+    cache_history("thread-999", "ckpt-1", [{"role": "user", "content": "hi", "name": None}])
+
+    delete_thread("thread-999")
+
+    assert get_cached_history("thread-999", "ckpt-1") is None
+
+
+def test_history_cache_is_keyed_on_checkpoint_id():
+    cache_history("thread-1", "ckpt-1", [{"role": "user", "content": "hi", "name": None}])
+
+    assert get_cached_history("thread-1", "ckpt-1") is not None
+    assert get_cached_history("thread-1", "ckpt-2") is None
+
+
+def test_format_history_skips_tool_call_triggers():
+    messages = [
+        HumanMessage(content="Search this", id="m1"),
+        AIMessage(content="", tool_calls=[{"name": "search_tool", "args": {}, "id": "c1"}], id="m2"),
+        ToolMessage(content="results", tool_call_id="c1", name="search_tool", id="m3"),
+        AIMessage(content="Here you go", id="m4"),
+    ]
+
+    assert format_history(messages) == [
+        {"id": "m1", "role": "user", "content": "Search this", "name": None},
+        {"id": "m3", "role": "tool", "content": "results", "name": "search_tool"},
+        {"id": "m4", "role": "assistant", "content": "Here you go", "name": None},
+    ]
+
+
 def test_pin_thread(mock_pool):
     pool, conn, cursor = mock_pool
 
@@ -120,3 +205,556 @@ def test_rename_thread_returns_false_when_no_row_updated(mock_pool):
     result = rename_thread("missing-thread", "New Title")
 
     assert result is False
+
+
+def test_update_timestamp_reports_new_thread(mock_pool):
+    pool, conn, cursor = mock_pool
+    cursor.fetchone.return_value = (True,)
+
+    assert update_timestamp("thread-new") is True
+    conn.execute.assert_called_once()
+    assert "RETURNING (xmax = 0)" in conn.execute.call_args[0][0]
+    assert "pending_turns=thread_metadata.pending_turns + 1" in conn.execute.call_args[0][0]
+
+    cursor.fetchone.return_value = (False,)
+    assert update_timestamp("thread-new") is False
+
+
+def test_update_timestamp_db_error_is_not_new(mock_pool):
+    pool, conn, cursor = mock_pool
+    conn.execute.side_effect = Exception("DB down")
+
+    assert update_timestamp("thread-1") is False
+
+
+# ---------------------------------------------------------------------------
+# memory/service.py — in-process cache
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def memory_pool():
+    """Inject a mock pool into memory.service with a fresh cache."""
+    pool = MagicMock()
+    conn = MagicMock()
+    cursor = MagicMock()
+    cursor.rowcount = 1
+    cursor.fetchall.return_value = [(1, "Likes tea", date(2025, 1, 1))]
+
+    conn.execute.return_value = cursor
+    pool.connection.return_value.__enter__.return_value = conn
+    memory_service.set_connection(pool)
+
+    yield pool, conn, cursor
+    memory_service.set_connection(None)
+
+
+def test_get_all_memories_is_served_from_cache(memory_pool):
+    pool, conn, cursor = memory_pool
+
+    first = memory_service.get_all_memories()
+    second = memory_service.get_all_memories()
+
+    assert first == second == "- [ID: 1] Likes tea (Saved: 2025-01-01)"
+    conn.execute.assert_called_once()
+    assert memory_service.get_memory_rows() == [
+        {"id": 1, "fact": "Likes tea", "saved": date(2025, 1, 1)}
+    ]
+
+
+def test_save_fact_invalidates_cache_and_notifies(memory_pool):
+    pool, conn, cursor = memory_pool
+    memory_service.get_all_memories()
+
+    result = memory_service.save_fact("Lives in Paris")
+
+    assert result == "Fact remembered."
+    assert "pg_notify" in conn.execute.call_args_list[-1][0][0]
+
+    cursor.fetchall.return_value = [
+        (1, "Likes tea", date(2025, 1, 1)),
+        (2, "Lives in Paris", date(2025, 1, 2)),
+    ]
+    assert "Lives in Paris" in memory_service.get_all_memories()
+
+
+def test_noop_write_does_not_notify(memory_pool):
+    pool, conn, cursor = memory_pool
+    cursor.rowcount = 0
+
+    result = memory_service.forget_fact(42)
+
+    assert result == "No memory found with ID 42."
+    assert all("pg_notify" not in c[0][0] for c in conn.execute.call_args_list)
+
+
+def test_change_listener_forwards_payloads_and_resets_on_connect():
+    from types import SimpleNamespace
+    from core.notify import ChangeListener
+
+    received = []
+    done = threading.Event()
+    listener = None
+
+    def on_change(payload):
+        received.append(payload)
+        if len(received) == 3:
+            listener._stop.set()
+            done.set()
+
+    listener = ChangeListener("some_channel", on_change, name="test-listener")
+    conn = MagicMock()
+    conn.notifies.return_value = [SimpleNamespace(payload="thread-1"), SimpleNamespace(payload="")]
+    with patch("core.notify.psycopg.connect") as mock_connect:
+        mock_connect.return_value.__enter__.return_value = conn
+        listener.start("postgresql://example")
+        assert done.wait(5)
+        listener.stop()
+
+    conn.execute.assert_called_once_with("LISTEN some_channel")
+    # Connect drops everything (missed notifications); "" also means everything.
+    assert received == [None, "thread-1", None]
+
+
+# ---------------------------------------------------------------------------
+# memory/service.py — relevance-ranked injection
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def ranked_memory_pool(memory_pool):
+    """Enable embedding-based ranking on top of the mock memory pool."""
+    embeddings = MagicMock()
+    embeddings.embed_query.return_value = [0.1] * 1536
+    embeddings.embed_documents.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+    memory_service.set_embeddings(embeddings)
+    memory_service.set_vector_available(True)
+    yield (*memory_pool, embeddings)
+    memory_service.set_embeddings(None)
+    memory_service.set_vector_available(False)
+
+
+def test_relevant_memories_skip_embedding_within_budget(ranked_memory_pool):
+    pool, conn, cursor, embeddings = ranked_memory_pool
+    cursor.fetchall.return_value = [(1, "Likes tea", date(2025, 1, 1), True)]
+
+    result = memory_service.get_relevant_memories("what do I drink?", top_k=5)
+
+    assert result == "- [ID: 1] Likes tea (Saved: 2025-01-01)"
+    embeddings.embed_query.assert_not_called()
+
+
+def test_relevant_memories_ranks_when_over_budget(ranked_memory_pool):
+    pool, conn, cursor, embeddings = ranked_memory_pool
+    all_rows = [
+        (1, "Likes tea", date(2025, 1, 1), True),
+        (2, "Lives in Paris", date(2025, 1, 2), True),
+        (3, "Has a cat", date(2025, 1, 3), True),
+        (4, "Old unindexed fact", date(2025, 1, 4), False),
+    ]
+    ranked_ids = [(3,), (1,)]
+    cursor.fetchall.side_effect = [all_rows, ranked_ids]
+
+    result = memory_service.get_relevant_memories("tell me about my pets", top_k=2)
+
+    embeddings.embed_query.assert_called_once_with("tell me about my pets")
+    assert "ORDER BY embedding <=>" in conn.execute.call_args[0][0]
+    # Chronological order is preserved; unindexed facts are always kept.
+    assert result.splitlines() == [
+        "- [ID: 1] Likes tea (Saved: 2025-01-01)",
+        "- [ID: 3] Has a cat (Saved: 2025-01-03)",
+        "- [ID: 4] Old unindexed fact (Saved: 2025-01-04)",
+    ]
+
+
+def test_save_fact_stores_embedding_when_ranking_enabled(ranked_memory_pool):
+    pool, conn, cursor, embeddings = ranked_memory_pool
+
+    memory_service.save_fact("Likes tea")
+
+    insert_sql, insert_args = conn.execute.call_args_list[0][0]
+    assert "embedding" in insert_sql
+    assert insert_args[0] == "Likes tea"
+    assert insert_args[1].dtype == np.float32
+    # Facts bypass the query-embedding cache.
+    embeddings.embed_documents.assert_called_once_with(["Likes tea"])
+    embeddings.embed_query.assert_not_called()
+
+
+# ---------------------------------------------------------------------------
+# ingestion/service.py — background ingest jobs
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def ingest_pool():
+    import ingestion.service as ingestion_service
+
+    pool = MagicMock()
+    conn = MagicMock()
+    pool.connection.return_value.__enter__.return_value = conn
+    ingestion_service.set_connection(pool)
+    # Drain anything a previous test queued.
+    while not ingestion_service._queue.empty():
+        ingestion_service._queue.get_nowait()
+    ingestion_service._enqueued.clear()
+    yield ingestion_service, conn
+    ingestion_service.set_connection(None)
+
+
+def test_enqueue_job_persists_and_queues(ingest_pool):
+    ingestion_service, conn = ingest_pool
+    conn.execute.return_value.fetchone.return_value = None   # no in-flight duplicate
+
+    job_id = ingestion_service.enqueue_job("/spool/a.pdf", "a.pdf", "thread-1", "hash-1")
+
+    insert_sql, insert_args = conn.execute.call_args_list[1][0]
+    assert "INSERT INTO ingest_jobs" in insert_sql
+    assert insert_args == (job_id, "thread-1", "a.pdf", "/spool/a.pdf", "hash-1")
+    conn.commit.assert_called_once()
+    assert ingestion_service._queue.get_nowait() == job_id
+
+
+def test_enqueue_job_reuses_in_flight_job(ingest_pool, tmp_path):
+    ingestion_service, conn = ingest_pool
+    spooled = tmp_path / "a.pdf"
+    spooled.write_bytes(b"%PDF")
+    conn.execute.return_value.fetchone.return_value = ("existing-job",)
+
+    job_id = ingestion_service.enqueue_job(str(spooled), "a.pdf", "thread-1", "hash-1")
+
+    assert job_id == "existing-job"
+    assert not spooled.exists()
+    assert ingestion_service._queue.empty()
+
+
+def test_run_job_records_result_and_removes_file(ingest_pool, tmp_path):
+    ingestion_service, conn = ingest_pool
+    spooled = tmp_path / "a.pdf"
+    spooled.write_bytes(b"%PDF")
+    conn.execute.return_value.fetchone.return_value = (str(spooled), "a.pdf", "thread-1", "hash-1")
+
+    def fake_ingest(path, filename, thread_id, file_hash, progress):
+        progress(3, 10, 64)
+        return {"status": "success", "chunks": 64, "filename": filename}
+
+    with patch("ingestion.service.document_rag.ingest_pdf", side_effect=fake_ingest):
+        ingestion_service.run_job("job-1")
+
+    updates = [c[0] for c in conn.execute.call_args_list[1:]]
+    assert updates[0][1] == (3, 10, 64, "job-1")
+    assert "status = %s" in updates[-1][0]
+    assert updates[-1][1] == ("success", 64, "job-1")
+    assert not spooled.exists()
+
+
+def test_run_job_records_failure(ingest_pool, tmp_path):
+    ingestion_service, conn = ingest_pool
+    spooled = tmp_path / "a.pdf"
+    spooled.write_bytes(b"%PDF")
+    conn.execute.return_value.fetchone.return_value = (str(spooled), "a.pdf", "thread-1", "hash-1")
+
+    with patch("ingestion.service.document_rag.ingest_pdf", side_effect=RuntimeError("embed API down")):
+        ingestion_service.run_job("job-1")
+
+    sql, args = conn.execute.call_args[0]
+    assert args == ("failed", "embed API down", "job-1")
+    assert not spooled.exists()
+
+
+def test_run_job_skips_job_claimed_elsewhere(ingest_pool):
+    ingestion_service, conn = ingest_pool
+    conn.execute.return_value.fetchone.return_value = None   # conditional UPDATE matched nothing
+
+    with patch("ingestion.service.document_rag.ingest_pdf") as mock_ingest:
+        ingestion_service.run_job("job-1")
+
+    mock_ingest.assert_not_called()
+
+
+def test_resume_pending_requeues_unfinished_jobs(ingest_pool):
+    ingestion_service, conn = ingest_pool
+    conn.execute.return_value.fetchall.return_value = [("job-1",), ("job-2",)]
+    conn.execute.return_value.rowcount = 1
+
+    assert ingestion_service.resume_pending() == 2
+
+    assert "status = 'running'" in conn.execute.call_args_list[0][0][0]
+    assert ingestion_service._queue.get_nowait() == "job-1"
+    assert ingestion_service._queue.get_nowait() == "job-2"
+
+
+def test_resume_pending_does_not_queue_a_waiting_job_twice(ingest_pool):
+    """Periodic sweeps skip jobs already waiting in this process's queue."""
+    ingestion_service, conn = ingest_pool
+    conn.execute.return_value.fetchall.return_value = [("job-1",)]
+    conn.execute.return_value.rowcount = 0
+
+    assert ingestion_service.resume_pending() == 1
+    assert ingestion_service.resume_pending() == 0
+    assert ingestion_service._queue.qsize() == 1
+
+
+def test_run_job_interrupted_by_shutdown_is_requeued_with_its_file(ingest_pool, tmp_path):
+    ingestion_service, conn = ingest_pool
+    spooled = tmp_path / "a.pdf"
+    spooled.write_bytes(b"%PDF")
+    conn.execute.return_value.fetchone.return_value = (str(spooled), "a.pdf", "thread-1", "hash-1")
+    conn.execute.return_value.rowcount = 1
+
+    def fake_ingest(path, filename, thread_id, file_hash, progress):
+        ingestion_service._stopping.set()
+        progress(1, 10, 8)
+        return {"status": "success", "chunks": 8, "filename": filename}
+
+    try:
+        with patch("ingestion.service.document_rag.ingest_pdf", side_effect=fake_ingest):
+            ingestion_service.run_job("job-1")
+    finally:
+        ingestion_service._stopping.clear()
+
+    sql, args = conn.execute.call_args[0]
+    assert "status = 'queued'" in sql and "owner = %s" in sql
+    assert args == (ingestion_service._OWNER, "job-1")
+    assert spooled.exists()
+
+
+def test_stop_workers_leaves_queued_jobs_unprocessed(ingest_pool):
+    """Stop is signalled ahead of queued work: a busy worker takes no new job after it."""
+    ingestion_service, conn = ingest_pool
+    conn.execute.return_value.rowcount = 0
+    started, release = [], threading.Event()
+
+    def fake_run(job_id):
+        started.append(job_id)
+        release.wait(5)
+
+    with patch("ingestion.service.run_job", side_effect=fake_run):
+        for job_id in ("job-1", "job-2", "job-3"):
+            ingestion_service._put(job_id)
+        worker = threading.Thread(target=ingestion_service._worker_loop)
+        ingestion_service._workers.append(worker)
+        worker.start()
+        while not started:
+            time.sleep(0.01)
+        stopper = threading.Thread(target=ingestion_service.stop_workers, kwargs={"timeout": 5})
+        stopper.start()
+        ingestion_service._stopping.wait(5)
+        release.set()
+        stopper.join(5)
+    ingestion_service._stopping.clear()
+
+    assert started == ["job-1"]
+    assert ingestion_service._queue.empty()
+    # Jobs this process still owned are handed back to the queue in Postgres.
+    assert "owner = %s" in conn.execute.call_args[0][0]
+
+
+def test_get_job_rejects_malformed_id_without_querying(ingest_pool):
+    ingestion_service, conn = ingest_pool
+
+    assert ingestion_service.get_job("not-a-uuid") is None
+    conn.execute.assert_not_called()
+
+
+# ---------------------------------------------------------------------------
+# core/embeddings.py — batched embedding client
+# ---------------------------------------------------------------------------
+
+def test_batched_embeddings_splits_by_token_budget_and_keeps_order():
+    from core.embeddings import BatchedEmbeddings
+
+    client = MagicMock()
+    client.embed_documents.side_effect = lambda batch: [[float(len(t))] for t in batch]
+    embedder = BatchedEmbeddings(client, max_batch_tokens=10, max_batch_inputs=3, concurrency=3)
+
+    texts = ["aaaa", "bbbb", "cc", "d", "eeeeeeee", "f", "g"]
+    vectors = embedder.embed_documents(texts)
+
+    assert vectors == [[4.0], [4.0], [2.0], [1.0], [8.0], [1.0], [1.0]]
+    batches = sorted(c[0][0] for c in client.embed_documents.call_args_list)
+    # ["aaaa","bbbb","cc"] hits the token budget, ["d","eeeeeeee","f"] the input cap.
+    assert batches == [["aaaa", "bbbb", "cc"], ["d", "eeeeeeee", "f"], ["g"]]
+
+
+def test_batched_embeddings_retries_rate_limits():
+    import httpx
+    import openai
+    from core.embeddings import BatchedEmbeddings
+
+    response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com"))
+    rate_limited = openai.RateLimitError("slow down", response=response, body=None)
+    client = MagicMock()
+    client.embed_documents.side_effect = [rate_limited, [[0.5]]]
+    embedder = BatchedEmbeddings(client, max_retries=2, backoff_seconds=0)
+
+    assert embedder.embed_documents(["hello"]) == [[0.5]]
+    assert client.embed_documents.call_count == 2
+
+
+def test_batched_embeddings_gives_up_after_max_retries():
+    import openai
+    from core.embeddings import BatchedEmbeddings
+
+    client = MagicMock()
+    client.embed_query.side_effect = openai.APIConnectionError(request=MagicMock())
+    embedder = BatchedEmbeddings(client, max_retries=1, backoff_seconds=0)
+
+    with pytest.raises(openai.APIConnectionError):
+        embedder.embed_query("hello")
+    assert client.embed_query.call_count == 2
+    assert embedder.stats()["retries"] == 1
+
+
+def test_batched_embeddings_queries_do_not_queue_behind_batches():
+    """Batches leave a slot free, so a query runs while an ingest saturates its workers."""
+    import threading
+    from core.embeddings import BatchedEmbeddings
+
+    started, release = threading.Event(), threading.Event()
+    in_flight = []
+    client = MagicMock()
+    client.embed_documents.side_effect = (
+        lambda batch: in_flight.append(batch) or started.set() or release.wait(5) and [[0.1]]
+    )
+    client.embed_query.return_value = [0.2]
+    embedder = BatchedEmbeddings(client, max_batch_inputs=1, concurrency=2)
+
+    ingest = threading.Thread(target=embedder.embed_documents, args=(["a", "b", "c"],))
+    ingest.start()
+    try:
+        assert started.wait(5)
+        assert embedder.embed_query("a query") == [0.2]
+        assert len(in_flight) == 1   # only one batch worker; the rest wait in its queue
+    finally:
+        release.set()
+        ingest.join(5)
+    stats = embedder.stats()
+    assert stats["requests"] == 4 and stats["texts"] == 4
+
+
+def test_batched_embeddings_release_the_slot_while_backing_off():
+    import httpx
+    import openai
+    from core.embeddings import BatchedEmbeddings
+
+    response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com"))
+    rate_limited = openai.RateLimitError("slow down", response=response, body=None)
+    client = MagicMock()
+    client.embed_query.side_effect = [rate_limited, [0.2]]
+    embedder = BatchedEmbeddings(client, concurrency=1, max_retries=1)
+
+    slot_free_during_sleep = []
+    with patch("core.embeddings.time.sleep", side_effect=lambda _: slot_free_during_sleep.append(
+        embedder._slots.acquire(blocking=False) and (embedder._slots.release() or True)
+    )):
+        assert embedder.embed_query("a query") == [0.2]
+    assert slot_free_during_sleep == [True]
+
+
+@pytest.fixture
+def embedding_cache_pool():
+    import core.embeddings as embeddings
+
+    pool = MagicMock()
+    conn = MagicMock()
+    pool.connection.return_value.__enter__.return_value = conn
+    embeddings.set_connection(pool)
+    yield conn
+    embeddings.set_connection(None)
+
+
+def test_cached_embeddings_only_embeds_unseen_chunks(embedding_cache_pool):
+    from core.embeddings import CachedEmbeddings, content_hash
+
+    conn = embedding_cache_pool
+    conn.execute.return_value.fetchall.return_value = [(content_hash("boilerplate  license"), [9.0])]
+    inner = MagicMock()
+    inner.embed_documents.side_effect = lambda texts: [[float(len(t))] for t in texts]
+
+    vectors = CachedEmbeddings(inner, model="m").embed_documents(
+        ["boilerplate license", "new text", "new   text"]
+    )
+
+    # The cached chunk is served from the table; duplicate new chunks are embedded once.
+    inner.embed_documents.assert_called_once_with(["new   text"])
+    assert vectors == [[9.0], [10.0], [10.0]]
+    stored = conn.cursor.return_value.__enter__.return_value.executemany.call_args[0][1]
+    assert [(key, model) for key, model, _vec in stored] == [(content_hash("new text"), "m")]
+
+
+def test_cached_embeddings_falls_back_when_cache_unavailable(embedding_cache_pool):
+    from core.embeddings import CachedEmbeddings
+
+    embedding_cache_pool.execute.side_effect = Exception("relation does not exist")
+    inner = MagicMock()
+    inner.embed_documents.return_value = [[1.0], [2.0]]
+
+    assert CachedEmbeddings(inner).embed_documents(["a", "b"]) == [[1.0], [2.0]]
+
+
+def test_query_embeddings_are_memoized_in_lru():
+    from core.embeddings import CachedEmbeddings
+
+    inner = MagicMock()
+    inner.embed_query.return_value = [0.5, 0.25]
+    embedder = CachedEmbeddings(inner, model="m", query_cache_size=1)
+
+    with patch("core.embeddings.cache_get", return_value=None), patch("core.embeddings.cache_set"):
+        first = embedder.embed_query("what is revenue?")
+        second = embedder.embed_query("what is revenue?")
+        embedder.embed_query("another question")   # evicts the first entry
+        embedder.embed_query("what is revenue?")
+
+    assert np.array_equal(first, second)
+    assert inner.embed_query.call_count == 3
+    assert embedder.query_cache_stats() == {
+        "lru_hits": 1, "redis_hits": 0, "coalesced": 0, "misses": 3, "size": 1, "hit_ratio": 0.25,
+    }
+
+
+def test_concurrent_identical_queries_share_one_request():
+    import threading
+    from core.embeddings import CachedEmbeddings
+
+    started, release = threading.Event(), threading.Event()
+    inner = MagicMock()
+    inner.embed_query.side_effect = lambda text: started.set() or release.wait(5) and [0.5, 0.25]
+    embedder = CachedEmbeddings(inner, model="m")
+    results = []
+
+    with patch("core.embeddings.cache_get", return_value=None), patch("core.embeddings.cache_set"):
+        leader = threading.Thread(target=lambda: results.append(embedder.embed_query("what is revenue?")))
+        leader.start()
+        assert started.wait(5)
+        follower = threading.Thread(target=lambda: results.append(embedder.embed_query("what is revenue?")))
+        follower.start()
+        deadline = time.monotonic() + 5
+        while embedder.query_cache_stats()["coalesced"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+    inner.embed_query.assert_called_once()
+    assert len(results) == 2 and np.array_equal(results[0], results[1])
+    assert embedder.query_cache_stats()["coalesced"] == 1
+
+
+def test_query_embeddings_fall_back_to_redis_tier():
+    import base64
+    from core.embeddings import CachedEmbeddings
+
+    inner = MagicMock()
+    stored = {}
+    vector = np.array([0.5, -1.0], dtype="<f4")
+    encoded = base64.b64encode(vector.tobytes()).decode()
+
+    with patch("core.embeddings.cache_get", side_effect=lambda key: stored.get(key)), \
+         patch("core.embeddings.cache_set", side_effect=lambda key, value, ttl: stored.update({key: value})):
+        inner.embed_query.return_value = vector.tolist()
+        CachedEmbeddings(inner, model="m").embed_query("q")       # process A: miss, writes Redis
+        fresh_process = CachedEmbeddings(inner, model="m")
+        result = fresh_process.embed_query("q")                   # process B: Redis hit
+
+    assert list(stored.values()) == [encoded]
+    assert inner.embed_query.call_count == 1
+    assert np.array_equal(result, vector)
+    assert fresh_process.query_cache_stats()["redis_hits"] == 1
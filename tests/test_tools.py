@@ -1,6 +1,15 @@
+import threading
 import pytest
-from unittest.mock import MagicMock
-from tools.scraper import _clean_markdown, cleanup_old_chunks, set_connection
+from datetime import date, datetime, timezone
+from unittest.mock import MagicMock, patch
+from core.database import drop_expired_web_partitions, ensure_web_partitions
+from tools.scraper import (
+    _clean_markdown,
+    cleanup_old_chunks,
+    set_connection,
+    start_cleanup_scheduler,
+    stop_cleanup_scheduler,
+)
 
 
 # ---------------------------------------------------------------------------
@@ -66,24 +75,58 @@ def test_cleanup_old_chunks_returns_zero_when_no_pool():
     assert result == 0
 
 
-def test_cleanup_old_chunks_executes_correct_delete(mock_scraper_pool):
+@patch("tools.scraper.drop_expired_web_partitions", return_value=[])
+@patch("tools.scraper.ensure_web_partitions")
+def test_cleanup_old_chunks_executes_correct_delete(mock_ensure, mock_drop, mock_scraper_pool):
     pool, conn, cursor = mock_scraper_pool
     cursor.rowcount = 5   # simulate 5 rows deleted
 
     result = cleanup_old_chunks()
 
+    # Whole expired weeks are dropped first; the DELETE only sees the boundary week.
+    mock_drop.assert_called_once_with(conn, 30)
+    mock_ensure.assert_called_once()
     conn.execute.assert_called_once()
-    sql = conn.execute.call_args[0][0]
+    sql, params = conn.execute.call_args[0]
 
     # Must target only web_scrape rows, not pdf_upload
     assert "DELETE FROM document_chunks" in sql
     assert "source_type = 'web_scrape'" in sql
-    assert "INTERVAL '30 days'" in sql
+    assert params == (30,)
 
     conn.commit.assert_called_once()
     assert result == 5
 
 
+def test_drop_expired_web_partitions_drops_only_weeks_past_the_ttl():
+    conn = MagicMock()
+    conn.execute.return_value.fetchall.return_value = [
+        ("document_chunks_web_p20260803",),     # ends 08-10: expired
+        ("document_chunks_web_p20260907",),     # ends 09-14: exactly at the cutoff
+        ("document_chunks_web_p20260914",),     # straddles the cutoff
+        ("document_chunks_web_p20261012",),
+        ("document_chunks_web_default",),
+    ]
+
+    dropped = drop_expired_web_partitions(conn, 30, now=datetime(2026, 10, 14, tzinfo=timezone.utc))
+
+    assert dropped == ["document_chunks_web_p20260803", "document_chunks_web_p20260907"]
+    drop_sql = conn.execute.call_args_list[-1][0][0].as_string(None)
+    assert drop_sql == 'DROP TABLE IF EXISTS "document_chunks_web_p20260907"'
+
+
+def test_ensure_web_partitions_creates_one_partition_per_week():
+    conn = MagicMock()
+
+    ensure_web_partitions(conn, date(2026, 10, 14), date(2026, 10, 27))
+
+    statements = [c[0][0].as_string(None) for c in conn.execute.call_args_list]
+    assert [s.split()[5] for s in statements] == [
+        '"document_chunks_web_p20261012"', '"document_chunks_web_p20261019"', '"document_chunks_web_p20261026"',
+    ]
+    assert "FOR VALUES FROM ('2026-10-12 00:00:00+00:00'::timestamptz)" in statements[0]
+
+
 def test_cleanup_old_chunks_returns_zero_when_nothing_to_delete(mock_scraper_pool):
     pool, conn, cursor = mock_scraper_pool
     cursor.rowcount = 0
@@ -101,3 +144,133 @@ def test_cleanup_old_chunks_handles_db_error(mock_scraper_pool):
     result = cleanup_old_chunks()
 
     assert result == 0   # must not raise
+
+
+def test_cleanup_scheduler_repeats_until_stopped():
+    runs = []
+    ran_twice = threading.Event()
+
+    def fake_cleanup():
+        runs.append(1)
+        if len(runs) >= 2:
+            ran_twice.set()
+        return 0
+
+    with patch("tools.scraper.cleanup_old_chunks", side_effect=fake_cleanup):
+        start_cleanup_scheduler(interval_hours=0.01 / 3600)
+        try:
+            # Partitions keep being created ahead after startup, not only once.
+            assert ran_twice.wait(timeout=5)
+        finally:
+            stop_cleanup_scheduler()
+
+
+# ---------------------------------------------------------------------------
+# vector_utils — binary pgvector adapters
+# ---------------------------------------------------------------------------
+
+def test_vector_binary_dumper_matches_pgvector_wire_format():
+    import struct
+    import numpy as np
+    from tools.vector_utils import VectorBinaryDumper
+
+    data = VectorBinaryDumper(np.ndarray).dump(np.array([1.5, -2.0], dtype=np.float32))
+
+    assert data == struct.pack(">HHff", 2, 0, 1.5, -2.0)
+
+
+def test_vector_loaders_round_trip():
+    import numpy as np
+    from tools.vector_utils import VectorBinaryDumper, VectorBinaryLoader, VectorTextLoader
+
+    vec = np.array([0.25, 0.5, -1.0], dtype=np.float32)
+    binary = VectorBinaryDumper(np.ndarray).dump(vec)
+
+    assert np.array_equal(VectorBinaryLoader(0).load(binary), vec)
+    assert np.array_equal(VectorTextLoader(0).load(b"[0.25,0.5,-1]"), vec)
+
+
+def test_register_vector_skips_when_extension_missing(monkeypatch):
+    from tools import vector_utils
+
+    monkeypatch.setattr(vector_utils.TypeInfo, "fetch", classmethod(lambda cls, conn, name: None))
+    conn = MagicMock()
+
+    assert vector_utils.register_vector(conn) is False
+    conn.adapters.register_dumper.assert_not_called()
+
+
+# ---------------------------------------------------------------------------
+# rerank — adjacent-chunk merge, MMR and token packing
+# ---------------------------------------------------------------------------
+
+def _candidate(content, index, embedding, distance=0.1, source="a.pdf"):
+    return {
+        "content": content, "source": source, "source_type": "pdf_upload",
+        "distance": distance, "chunk_index": index, "embedding": embedding,
+    }
+
+
+def test_apply_cutoff_drops_far_candidates_and_adapts_k():
+    from tools.rerank import apply_cutoff
+
+    candidates = [{"distance": 0.30}, {"distance": 0.35}, {"distance": 0.60}, {"distance": None}]
+
+    assert apply_cutoff(candidates, max_distance=0.75, margin=0.1) == [
+        {"distance": 0.30}, {"distance": 0.35}, {"distance": None},   # exact text match kept
+    ]
+    assert apply_cutoff([{"distance": 0.9}], max_distance=0.75, margin=0.1) == []
+
+
+def test_merge_adjacent_joins_neighbours_and_drops_repeated_overlap():
+    from tools.rerank import merge_adjacent
+
+    overlap = "shared sentence that the splitter repeated. "
+    passages = merge_adjacent([
+        _candidate(overlap + "second part.", 4, [0.0, 1.0], distance=0.2),
+        _candidate("first part. " + overlap, 3, [1.0, 0.0], distance=0.1),
+        _candidate("unrelated chunk", 9, [1.0, 1.0], distance=0.5),
+    ])
+
+    assert passages[0]["content"] == "first part. " + overlap + "second part."
+    assert passages[0]["chunks"] == 2
+    assert passages[0]["relevance"] == pytest.approx(0.9)
+    assert passages[0]["embedding"].tolist() == [0.5, 0.5]
+    assert passages[1]["content"] == "unrelated chunk"
+
+
+def test_mmr_prefers_a_diverse_passage_over_a_near_duplicate():
+    import numpy as np
+    from tools.rerank import mmr
+
+    relevance = np.array([0.9, 0.89, 0.7])
+    vectors = np.array([[1.0, 0.0], [0.99, 0.01], [0.0, 1.0]])
+
+    assert mmr(relevance, vectors, 2) == [0, 2]
+    assert mmr(relevance, vectors, 2, lambda_=1.0) == [0, 1]
+
+
+def test_select_passages_without_embeddings_keeps_relevance_order():
+    from tools.rerank import select_passages
+
+    passages = select_passages(
+        [_candidate("b", None, None, 0.3), _candidate("a", None, None, 0.1), _candidate("c", None, None, 0.5)],
+        max_passages=2,
+    )
+
+    assert [p["content"] for p in passages] == ["a", "b"]
+
+
+def test_pack_stays_within_token_budget():
+    from core.tokens import count_tokens
+    from tools.rerank import pack
+
+    passages = [{"content": "alpha " * 20}, {"content": "beta " * 200}, {"content": "gamma"}]
+    budget = count_tokens("alpha " * 20) + count_tokens("\n\n---\n\n") + count_tokens("gamma")
+
+    block = pack(passages, budget)
+
+    assert "beta" not in block   # too large: skipped, later shorter passage still fits
+    assert block.endswith("gamma")
+    assert count_tokens(block) <= budget
+    assert count_tokens(pack(passages[1:2], 10)) <= 10   # first passage is truncated, not dropped
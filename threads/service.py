@@ -12,19 +12,41 @@ memory/service.py to avoid circular imports until core/database.py
 is extracted in Step 7.
 """
 
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
 from langchain_openai import ChatOpenAI
+from core.config import THREADS_CACHE_TTL_SECONDS
 from core.logger import get_logger
+import documents.service as document_service
 
 logger = get_logger(__name__)
 
 _pool = None
 _llm: ChatOpenAI | None = None
 
+# Formatted /history payloads keyed by thread_id → (checkpoint_id, messages).
+# A new checkpoint ID means the thread changed, so stale entries never serve.
+_HISTORY_CACHE_SIZE = 256
+_history_cache: OrderedDict[str, tuple[str, list[dict]]] = OrderedDict()
+_history_lock = threading.Lock()
+
+# Sidebar listings keyed by (limit, cursor) → (expires_at, result). Writes in
+# this process clear it; other workers see changes within the TTL.
+_threads_cache: dict[tuple, tuple[float, object]] = {}
+_threads_lock = threading.Lock()
+
 
 def set_connection(pool) -> None:
     """Inject the connection pool. Must be called before any function is used."""
     global _pool
     _pool = pool
+    invalidate_threads_cache()
 
 
 def set_llm(llm: ChatOpenAI) -> None:
@@ -33,18 +55,103 @@ def set_llm(llm: ChatOpenAI) -> None:
     _llm = llm
 
 
+# ---------------------------------------------------------------------------
+# Sidebar listing — short-TTL cache + keyset pagination
+# ---------------------------------------------------------------------------
+
+def invalidate_threads_cache() -> None:
+    """Drop cached sidebar listings after any thread_metadata write."""
+    with _threads_lock:
+        _threads_cache.clear()
+
+
+def _cached_listing(key: tuple, loader):
+    """Return a cached listing for key, calling loader() when missing or expired."""
+    now = time.monotonic()
+    with _threads_lock:
+        entry = _threads_cache.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+    result = loader()
+    if THREADS_CACHE_TTL_SECONDS > 0:
+        with _threads_lock:
+            _threads_cache[key] = (now + THREADS_CACHE_TTL_SECONDS, result)
+    return result
+
+
+def _encode_cursor(is_pinned: bool, last_updated: datetime, thread_id: str) -> str:
+    raw = json.dumps([bool(is_pinned), last_updated.isoformat(), thread_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[bool, datetime, str]:
+    """Decode a page cursor. Raises ValueError if it is malformed."""
+    try:
+        is_pinned, last_updated, thread_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return bool(is_pinned), datetime.fromisoformat(last_updated), str(thread_id)
+    except Exception as e:
+        raise ValueError(f"Invalid thread cursor: {cursor!r}") from e
+
+
 def get_all_threads() -> list[dict]:
     """Return all threads — pinned first, then ordered by most recently updated."""
-    with _pool.connection() as conn:
-        cursor = conn.execute(
-            """SELECT thread_id, title, is_pinned
-               FROM thread_metadata
-               ORDER BY is_pinned DESC, last_updated DESC"""
+    def load() -> list[dict]:
+        with _pool.connection() as conn:
+            cursor = conn.execute(
+                """SELECT thread_id, title, is_pinned
+                   FROM thread_metadata
+                   ORDER BY is_pinned DESC, last_updated DESC"""
+            )
+            return [
+                {"id": row[0], "title": row[1], "is_pinned": row[2]}
+                for row in cursor.fetchall()
+            ]
+
+    return _cached_listing(("all",), load)
+
+
+def get_threads_page(limit: int, cursor: str | None = None) -> tuple[list[dict], str | None]:
+    """
+    Return one page of threads in sidebar order plus the cursor for the next
+    page (None on the last page). Keyset pagination on
+    (is_pinned, last_updated, thread_id) walks idx_thread_metadata_sidebar,
+    so deep pages cost the same as the first.
+    Raises ValueError for a malformed cursor.
+    """
+    after = _decode_cursor(cursor) if cursor else None
+
+    def load() -> tuple[list[dict], str | None]:
+        with _pool.connection() as conn:
+            if after is None:
+                result = conn.execute(
+                    """SELECT thread_id, title, is_pinned, last_updated
+                       FROM thread_metadata
+                       ORDER BY is_pinned DESC, last_updated DESC, thread_id DESC
+                       LIMIT %s""",
+                    (limit + 1,),
+                )
+            else:
+                result = conn.execute(
+                    """SELECT thread_id, title, is_pinned, last_updated
+                       FROM thread_metadata
+                       WHERE (is_pinned, last_updated, thread_id) < (%s, %s, %s)
+                       ORDER BY is_pinned DESC, last_updated DESC, thread_id DESC
+                       LIMIT %s""",
+                    (*after, limit + 1),
+                )
+            rows = result.fetchall()
+
+        page = rows[:limit]
+        next_cursor = None
+        if len(rows) > limit:
+            last = page[-1]
+            next_cursor = _encode_cursor(last[2], last[3], last[0])
+        return (
+            [{"id": row[0], "title": row[1], "is_pinned": row[2]} for row in page],
+            next_cursor,
         )
-        return [
-            {"id": row[0], "title": row[1], "is_pinned": row[2]}
-            for row in cursor.fetchall()
-        ]
+
+    return _cached_listing(("page", limit, cursor), load)
 
 
 def save_title(thread_id: str, title: str) -> None:
@@ -62,26 +169,67 @@ def save_title(thread_id: str, title: str) -> None:
                 (thread_id, title),
             )
             conn.commit()
+        invalidate_threads_cache()
     except Exception as e:
         logger.error(f"Error saving title: {e}")
 
 
-def update_timestamp(thread_id: str) -> None:
-    """Ensure a thread exists in metadata and refresh its timestamp."""
+def update_timestamp(thread_id: str) -> bool:
+    """
+    Ensure a thread exists in metadata and refresh its timestamp, in one
+    round-trip, counting the turn towards pending_turns. Returns True if this
+    call created the thread (xmax = 0 only for a freshly inserted row), False
+    if it already existed or on error.
+    """
     try:
         with _pool.connection() as conn:
-            conn.execute(
+            cursor = conn.execute(
                 """
-                INSERT INTO thread_metadata (thread_id, title, last_updated)
-                VALUES (%s, 'New Chat', CURRENT_TIMESTAMP)
+                INSERT INTO thread_metadata (thread_id, title, last_updated, pending_turns)
+                VALUES (%s, 'New Chat', CURRENT_TIMESTAMP, 1)
                 ON CONFLICT (thread_id) DO UPDATE SET
-                    last_updated=CURRENT_TIMESTAMP
+                    last_updated=CURRENT_TIMESTAMP,
+                    pending_turns=thread_metadata.pending_turns + 1
+                RETURNING (xmax = 0)
                 """,
                 (thread_id,),
             )
+            row = cursor.fetchone()
             conn.commit()
+        invalidate_threads_cache()
+        return bool(row and row[0])
     except Exception as e:
         logger.error(f"Error updating timestamp: {e}")
+        return False
+
+
+def get_pending_turns(thread_id: str) -> int | None:
+    """
+    Return the number of turns not yet folded into the thread's rolling
+    summary, or None when unknown (legacy row, missing thread, or error).
+    """
+    try:
+        with _pool.connection() as conn:
+            row = conn.execute(
+                "SELECT pending_turns FROM thread_metadata WHERE thread_id = %s", (thread_id,)
+            ).fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        logger.error(f"Error reading pending turns for thread {thread_id}: {e}")
+        return None
+
+
+def set_pending_turns(thread_id: str, turns: int) -> None:
+    """Record the thread's unsummarized turn count, as counted from its checkpoint."""
+    try:
+        with _pool.connection() as conn:
+            conn.execute(
+                "UPDATE thread_metadata SET pending_turns = %s WHERE thread_id = %s",
+                (turns, thread_id),
+            )
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error recording pending turns for thread {thread_id}: {e}")
 
 
 def pin_thread(thread_id: str, pinned: bool) -> bool:
@@ -93,6 +241,7 @@ def pin_thread(thread_id: str, pinned: bool) -> bool:
                 (pinned, thread_id),
             )
             conn.commit()
+        invalidate_threads_cache()
         return cursor.rowcount > 0
     except Exception as e:
         logger.error(f"Error pinning thread {thread_id}: {e}")
@@ -108,6 +257,7 @@ def rename_thread(thread_id: str, title: str) -> bool:
                 (title, thread_id),
             )
             conn.commit()
+        invalidate_threads_cache()
         return cursor.rowcount > 0
     except Exception as e:
         logger.error(f"Error renaming thread {thread_id}: {e}")
@@ -128,6 +278,111 @@ def generate_title(message_content: str) -> str:
         return "New Conversation"
 
 
+def summarize_conversation(previous_summary: str, transcript: str) -> str:
+    """
+    Fold a transcript of older turns into the thread's running summary.
+    Returns "" on failure so the caller keeps the previous summary.
+    """
+    try:
+        prompt = (
+            "You maintain a running summary of a conversation between a user and an AI assistant. "
+            "Update the summary with the new transcript below. Keep facts, decisions, names, numbers, "
+            "open questions and cited URLs; drop pleasantries. Reply with the summary only, "
+            "in at most 300 words.\n\n"
+            f"Current summary:\n{previous_summary or '(none)'}\n\n"
+            f"New transcript:\n{transcript}"
+        )
+        response = _llm.invoke(prompt)
+        return response.content.strip()
+    except Exception as e:
+        logger.error(f"Error summarizing conversation: {e}")
+        return ""
+
+
+# ---------------------------------------------------------------------------
+# History — formatted message list for GET /history/{thread_id}
+# ---------------------------------------------------------------------------
+
+def latest_checkpoint_id(thread_id: str) -> str | None:
+    """
+    Return the ID of the thread's newest root checkpoint without loading it.
+    Checkpoint IDs are time-ordered, so this is a primary-key range scan.
+    """
+    with _pool.connection() as conn:
+        cursor = conn.execute(
+            """
+            SELECT checkpoint_id FROM checkpoints
+            WHERE thread_id = %s AND checkpoint_ns = ''
+            ORDER BY checkpoint_id DESC
+            LIMIT 1
+            """,
+            (thread_id,),
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def format_history(messages: list[BaseMessage]) -> list[dict]:
+    """Project graph messages to the id/role/content/name dicts the UI renders."""
+    formatted = []
+    for msg in messages:
+        if isinstance(msg, HumanMessage):
+            role = "user"
+        elif isinstance(msg, ToolMessage):
+            role = "tool"
+        else:
+            role = "assistant"
+
+        # Skip empty assistant messages (tool call triggers)
+        if role == "assistant" and not msg.content.strip():
+            continue
+
+        formatted.append({
+            "id": msg.id,
+            "role": role,
+            "content": msg.content,
+            "name": getattr(msg, 'name', 'tool') if role == "tool" else None
+        })
+    return formatted
+
+
+def get_cached_history(thread_id: str, checkpoint_id: str) -> list[dict] | None:
+    """Return the cached formatted history if it is for this checkpoint."""
+    with _history_lock:
+        entry = _history_cache.get(thread_id)
+        if entry is None or entry[0] != checkpoint_id:
+            return None
+        _history_cache.move_to_end(thread_id)
+        return entry[1]
+
+
+def cache_history(thread_id: str, checkpoint_id: str, messages: list[dict]) -> None:
+    """Store a formatted history, evicting the least recently used thread."""
+    with _history_lock:
+        _history_cache[thread_id] = (checkpoint_id, messages)
+        _history_cache.move_to_end(thread_id)
+        while len(_history_cache) > _HISTORY_CACHE_SIZE:
+            _history_cache.popitem(last=False)
+
+
+def paginate_history(messages: list[dict], before: str | None, limit: int | None) -> tuple[list[dict], str | None]:
+    """
+    Return the page of messages ending just before the message with ID
+    `before` (newest page when None) and the cursor for the next-older page:
+    the ID of the page's oldest message, or None at the start. Message IDs
+    stay valid as the thread grows or is summarized, unlike positions.
+    Raises ValueError if `before` is not a message of this thread.
+    """
+    if before is None:
+        end = len(messages)
+    else:
+        end = next((i for i, m in enumerate(messages) if m["id"] == before), None)
+        if end is None:
+            raise ValueError(f"Unknown history cursor: {before!r}")
+    start = 0 if limit is None else max(0, end - limit)
+    return messages[start:end], (messages[start]["id"] if start > 0 else None)
+
+
 def delete_thread(thread_id: str) -> bool:
     """Delete a thread and all its checkpointed state from the database."""
     try:
@@ -138,8 +393,13 @@ def delete_thread(thread_id: str) -> bool:
 
             cursor = conn.execute("SELECT to_regclass('public.document_chunks')")
             if cursor.fetchone()[0] is not None:
-                cursor = conn.execute("DELETE FROM document_chunks WHERE thread_id = %s", (thread_id,))
+                cursor = conn.execute(
+                    "DELETE FROM document_chunks WHERE source_type = 'pdf_upload' AND thread_id = %s",
+                    (thread_id,),
+                )
                 deleted_rows += max(cursor.rowcount, 0)
+                # Created in the same migration step as document_chunks.
+                document_service.delete_thread_documents(conn, thread_id)
 
             cursor = conn.execute("DELETE FROM checkpoints WHERE thread_id = %s", (thread_id,))
             deleted_rows += max(cursor.rowcount, 0)
@@ -148,6 +408,10 @@ def delete_thread(thread_id: str) -> bool:
             cursor = conn.execute("DELETE FROM checkpoint_blobs WHERE thread_id = %s", (thread_id,))
             deleted_rows += max(cursor.rowcount, 0)
             conn.commit()
+        invalidate_threads_cache()
+        document_service.invalidate_thread_documents(thread_id)
+        with _history_lock:
+            _history_cache.pop(thread_id, None)
         return deleted_rows > 0
     except Exception as e:
         logger.error(f"Error deleting thread: {e}")
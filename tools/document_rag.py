@@ -4,8 +4,19 @@ tools/document_rag.py
 Thread-scoped PDF ingestion and retrieval for the RAG pipeline.
 
 Responsibilities:
-  - ingest_pdf():              Parse → chunk → embed → store (source_type='pdf_upload')
-  - search_thread_documents(): Similarity search scoped to one thread's uploads
+  - ingest_pdf():              Parse → chunk → embed → store (source_type='pdf_upload'),
+                               streamed page by page in INGEST_BATCH_CHUNKS batches
+  - search_chunks() / retrieve(): Vector similarity search over document_chunks,
+                               scoped to a thread's PDFs or to a set of URLs
+                               (top-K per URL in one SQL statement)
+  - search_uploads():          Hybrid full-text + vector search over one thread's
+                               uploads (RAG_RETRIEVAL_MODE), fused by reciprocal rank
+  - search_thread_documents(): search_uploads() over-fetched, merged, MMR-reranked and
+                               packed into a token-budgeted block (tools/rerank.py)
+  - list_thread_files():       Uploads from the thread_documents registry
+                               (documents/service.py), which also serves the
+                               per-message "does this thread have uploads?"
+                               check and dedup without scanning document_chunks
   - set_connection():          Pool injection (same pattern as all other services)
 
 This module is intentionally separate from tools/scraper.py:
@@ -17,15 +28,25 @@ Both share the same document_chunks table and embedding model.
 """
 
 import hashlib
-import json
+import itertools
+import re
 import uuid
+from collections.abc import Callable, Iterable, Iterator
 
 import fitz  # PyMuPDF
-from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from core.config import (
+    INGEST_BATCH_CHUNKS,
+    RAG_CANDIDATES,
+    RAG_CONTEXT_MAX_TOKENS,
+    RAG_RETRIEVAL_MODE,
+)
+from core.embeddings import get_cached_embeddings
 from core.logger import get_logger
-from tools.vector_utils import to_pgvector_literal
+from documents.service import get_thread_documents, invalidate_thread_documents, register_document
+from tools import rerank
+from tools.vector_utils import copy_chunks, to_vector
 
 logger = get_logger(__name__)
 
@@ -34,7 +55,7 @@ logger = get_logger(__name__)
 # ---------------------------------------------------------------------------
 _pool = None
 _vector_available = True
-_embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+_embeddings = get_cached_embeddings()
 _splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
 
 
@@ -56,7 +77,7 @@ def is_vector_available() -> bool:
 
 
 # ---------------------------------------------------------------------------
-# Deduplication
+# Dedup — backed by the thread_documents registry (documents/service.py)
 # ---------------------------------------------------------------------------
 
 def _is_already_ingested(file_hash: str, thread_id: str) -> bool:
@@ -64,18 +85,8 @@ def _is_already_ingested(file_hash: str, thread_id: str) -> bool:
     if not _pool or not _vector_available:
         return False
     try:
-        with _pool.connection() as conn:
-            cursor = conn.execute(
-                """
-                SELECT 1 FROM document_chunks
-                WHERE thread_id = %s
-                  AND source_type = 'pdf_upload'
-                  AND metadata->>'file_hash' = %s
-                LIMIT 1
-                """,
-                (thread_id, file_hash),
-            )
-            return cursor.fetchone() is not None
+        # Bypass the cache: an upload handled by another worker must still dedup.
+        return any(doc["file_hash"] == file_hash for doc in get_thread_documents(thread_id, fresh=True))
     except Exception as e:
         logger.error(f"Dedup check failed: {e}")
         return False
@@ -85,9 +96,86 @@ def _is_already_ingested(file_hash: str, thread_id: str) -> bool:
 # Ingestion
 # ---------------------------------------------------------------------------
 
-def ingest_pdf(file_bytes: bytes, filename: str, thread_id: str) -> dict:
+def hash_file(path: str, block_size: int = 1024 * 1024) -> str:
+    """Return the SHA-256 hex digest of a file, read in fixed-size blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _iter_chunks(pages: Iterable) -> Iterator[str]:
+    """
+    Yield text chunks from PyMuPDF pages, reading one page at a time.
+
+    Only the last, possibly incomplete chunk of each page is carried over to
+    join the next page's text, so memory is bounded by a page, not the file.
+    """
+    carry = ""
+    for page in pages:
+        text = page.get_text()
+        if not text.strip():
+            continue
+        chunks = _splitter.split_text(f"{carry}\n\n{text}" if carry else text)
+        if not chunks:
+            continue
+        yield from chunks[:-1]
+        carry = chunks[-1]
+    if carry:
+        yield carry
+
+
+def _batched(chunks: Iterator[str], size: int) -> Iterator[list[str]]:
+    batch: list[str] = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _discard_chunks(thread_id: str, file_hash: str, ingest_id: str | None = None) -> None:
+    """
+    Delete stored chunks of an upload that was never registered: those of one
+    ingest run (ingest_id), or, without it, any left behind by an interrupted run.
+    """
+    sql = """
+        DELETE FROM document_chunks
+        WHERE source_type = 'pdf_upload' AND thread_id = %s AND metadata->>'file_hash' = %s
     """
-    Parse a PDF, chunk it, embed it, and store in document_chunks.
+    params: tuple = (thread_id, file_hash)
+    if ingest_id:
+        sql += " AND metadata->>'ingest_id' = %s"
+        params += (ingest_id,)
+    with _pool.connection() as conn:
+        conn.execute(sql, params)
+        conn.commit()
+
+
+def ingest_pdf(
+    path: str,
+    filename: str,
+    thread_id: str,
+    file_hash: str | None = None,
+    progress: Callable[[int, int, int], None] | None = None,
+) -> dict:
+    """
+    Parse a PDF file on disk, chunk it, embed it, and store in document_chunks.
+
+    Pages are read lazily and chunks are embedded and COPY'd in batches of
+    INGEST_BATCH_CHUNKS as they are produced, so memory stays flat regardless
+    of PDF size. Each batch is embedded before a connection is taken and
+    COPY'd in its own short transaction, so a long ingest never pins a pooled
+    connection across embedding API calls. The upload becomes visible in the
+    thread_documents registry only after its last batch; a failed ingest
+    deletes the chunks it wrote. If given, progress(pages_done, pages_total,
+    chunks_stored) is called after each batch.
+
+    Callers must not ingest the same file into the same thread concurrently
+    (ingestion.service runs one job per thread and file hash).
 
     Returns:
         {"status": "success", "chunks": N, "filename": filename}
@@ -95,108 +183,345 @@ def ingest_pdf(file_bytes: bytes, filename: str, thread_id: str) -> dict:
         {"status": "empty", "chunks": 0}
     """
     # 1. Hash for deduplication (SHA-256 of raw bytes)
-    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    file_hash = file_hash or hash_file(path)
 
     if _is_already_ingested(file_hash, thread_id):
         logger.info(f"ingest_pdf: duplicate detected for '{filename}' in thread {thread_id}")
         return {"status": "duplicate", "chunks": 0}
 
-    # 2. Extract text with PyMuPDF
+    # 2. Open lazily with PyMuPDF — pages are parsed on iteration
     try:
-        doc = fitz.open(stream=file_bytes, filetype="pdf")
-        pages_text = [page.get_text() for page in doc]
-        doc.close()
+        doc = fitz.open(path, filetype="pdf")
     except Exception as e:
         logger.error(f"ingest_pdf: PyMuPDF failed for '{filename}': {e}")
         raise
 
-    full_text = "\n\n".join(pages_text).strip()
-    if not full_text:
-        logger.warning(f"ingest_pdf: '{filename}' contains no extractable text (image-only PDF?)")
-        return {"status": "empty", "chunks": 0}
+    # 3. Chunk → embed → store, one batch at a time
+    ingest_id = str(uuid.uuid4())
+    metadata_base = {"filename": filename, "file_hash": file_hash, "ingest_id": ingest_id}
+    stored = 0
+    pages_done = 0
+    pages_total = doc.page_count
+
+    def pages():
+        nonlocal pages_done
+        for page in doc:
+            pages_done += 1
+            yield page
+
+    try:
+        chunks = _iter_chunks(pages())
+        first = next(chunks, None)
+        if first is None:
+            logger.warning(f"ingest_pdf: '{filename}' contains no extractable text (image-only PDF?)")
+            return {"status": "empty", "chunks": 0}
+
+        # Chunks of a run interrupted before registering (e.g. a restart mid-job).
+        _discard_chunks(thread_id, file_hash)
+        try:
+            for batch in _batched(itertools.chain([first], chunks), INGEST_BATCH_CHUNKS):
+                embeddings = _embeddings.embed_documents(batch)
+                with _pool.connection() as conn:
+                    copy_chunks(
+                        conn,
+                        (
+                            (thread_id, "pdf_upload", chunk, {**metadata_base, "chunk_index": stored + i}, embedding)
+                            for i, (chunk, embedding) in enumerate(zip(batch, embeddings))
+                        ),
+                    )
+                    conn.commit()
+                stored += len(batch)
+                logger.debug(f"ingest_pdf: '{filename}' wrote {stored} chunks so far")
+                if progress:
+                    progress(pages_done, pages_total, stored)
+
+            with _pool.connection() as conn:
+                registered = register_document(conn, thread_id, file_hash, filename, stored)
+                if registered:
+                    conn.commit()
+                else:
+                    conn.rollback()
+        except Exception:
+            try:
+                _discard_chunks(thread_id, file_hash, ingest_id)
+            except Exception as e:
+                logger.error(f"ingest_pdf: could not remove partial chunks of '{filename}': {e}")
+            raise
+        if not registered:
+            # A concurrent ingest of the same file registered first.
+            _discard_chunks(thread_id, file_hash, ingest_id)
+            logger.info(f"ingest_pdf: duplicate detected for '{filename}' in thread {thread_id}")
+            return {"status": "duplicate", "chunks": 0}
+    finally:
+        doc.close()
+        invalidate_thread_documents(thread_id)
+
+    logger.info(f"ingest_pdf: stored {stored} chunks for '{filename}' in thread {thread_id}")
+    return {"status": "success", "chunks": stored, "filename": filename}
+
+
+# ---------------------------------------------------------------------------
+# Vector retrieval — a thread's PDFs, or one or more URLs
+# ---------------------------------------------------------------------------
+
+_PDF_SCOPE = """
+    (SELECT content, metadata->>'filename' AS source, 'pdf_upload' AS source_type,
+            embedding <=> %(q)s::vector AS distance,
+            (metadata->>'chunk_index')::int AS chunk_index, embedding
+     FROM document_chunks
+     WHERE thread_id = %(thread_id)s AND source_type = 'pdf_upload'
+     ORDER BY embedding <=> %(q)s::vector
+     LIMIT %(k)s)
+"""
+
+# Top-K per URL, not across them, so one long page cannot crowd out the rest.
+_URL_SCOPE = """
+    (SELECT c.content, u.url AS source, 'web_scrape' AS source_type, c.distance,
+            c.chunk_index, c.embedding
+     FROM unnest(%(urls)s::text[]) AS u(url)
+     CROSS JOIN LATERAL (
+         SELECT content, embedding <=> %(q)s::vector AS distance,
+                (metadata->>'chunk_index')::int AS chunk_index, embedding
+         FROM document_chunks
+         WHERE source_type = 'web_scrape' AND metadata->>'url' = u.url
+         ORDER BY embedding <=> %(q)s::vector
+         LIMIT %(k)s
+     ) c)
+"""
+
+
+def search_chunks(
+    query_vector,
+    thread_id: str | None = None,
+    urls: list[str] | tuple[str, ...] = (),
+    top_k: int = 3,
+) -> list[dict]:
+    """
+    Return the top_k chunks nearest to query_vector from this thread's PDFs,
+    or the top_k of each URL merged by distance, in a single SQL statement.
+    Pass either thread_id or urls: the chat context node (thread PDFs, user
+    message) and read_webpage (URLs, the tool's own query) search different
+    text, so there is no caller for a mixed search.
+
+    Each result is {"content", "source" (filename or URL), "source_type",
+    "distance", "chunk_index", "embedding"}.
+    Raises ValueError if both scopes are given, and on database errors;
+    callers decide how to degrade.
+    """
+    if thread_id and urls:
+        raise ValueError("search_chunks searches either a thread's PDFs or URLs, not both")
+    params = {"q": to_vector(query_vector), "k": top_k}
+    if thread_id:
+        scope = _PDF_SCOPE
+        params["thread_id"] = thread_id
+    elif urls:
+        scope = _URL_SCOPE
+        params["urls"] = list(urls)
+    else:
+        return []
+
+    with _pool.connection() as conn:
+        cursor = conn.execute(scope + " ORDER BY distance", params)
+        return [
+            {
+                "content": row[0],
+                "source": row[1],
+                "source_type": row[2],
+                "distance": row[3],
+                "chunk_index": row[4],
+                "embedding": row[5],
+            }
+            for row in cursor.fetchall()
+        ]
+
+
+def retrieve(
+    query: str,
+    thread_id: str | None = None,
+    urls: list[str] | tuple[str, ...] = (),
+    top_k: int = 3,
+) -> list[dict]:
+    """Embed query once (via the shared query-embedding cache) and run search_chunks()."""
+    if not thread_id and not urls:
+        return []
+    return search_chunks(_embeddings.embed_query(query), thread_id=thread_id, urls=urls, top_k=top_k)
+
+
+# ---------------------------------------------------------------------------
+# Hybrid retrieval over uploads — full-text (content_tsv) + vector, fused by RRF
+# ---------------------------------------------------------------------------
+
+# Reciprocal-rank fusion constant (score = Σ 1 / (k + rank)); 60 is the usual choice.
+_RRF_K = 60
+# Candidates taken from each ranking before fusion.
+_HYBRID_CANDIDATES = 20
+
+# Codes such as "AB-1234", "10-K", "INV/2024/001" or "SKU12345" (letters and
+# digits with a separator, or at least five characters), and section numbers
+# or dates such as "4.2.1". "Q3", "page 12" or "FAQ" are ordinary words.
+# All-caps tickers ("AAPL") look like acronyms ("FAQ"), so they go through
+# hybrid search on purpose; full-text still ranks exact hits there via RRF.
+_IDENTIFIER = re.compile(
+    r"(?=[\w./#:-]*[^\W\d_])(?=[\w./#:-]*\d)(?:\w+[./#:-][\w./#:-]+|\w{5,})"
+    r"|\d+(?:[./-]\d+){2,}"
+)
+
+# Query terms OR'ed together, so a chunk matching any term is a candidate;
+# ts_rank_cd then favours chunks matching more of them, close together.
+# websearch_to_tsquery parses untrusted text without raising, so no lexeme
+# quoting is needed. all_terms marks chunks containing every query term.
+_LEXICAL_CTE = """
+    lexical AS (
+        SELECT id, content, metadata->>'filename' AS source,
+               (metadata->>'chunk_index')::int AS chunk_index, embedding,
+               content_tsv @@ plainto_tsquery('english', %(text)s) AS all_terms,
+               row_number() OVER (ORDER BY ts_rank_cd(content_tsv, q.query) DESC, id) AS rank
+        FROM document_chunks, websearch_to_tsquery('english', %(terms)s) AS q(query)
+        WHERE thread_id = %(thread_id)s AND source_type = 'pdf_upload'
+          AND content_tsv @@ q.query
+        ORDER BY rank
+        LIMIT %(n)s
+    )
+"""
+
+_SEMANTIC_CTE = """
+    semantic AS (
+        SELECT id, content, metadata->>'filename' AS source,
+               (metadata->>'chunk_index')::int AS chunk_index, embedding,
+               row_number() OVER (ORDER BY embedding <=> %(q)s::vector, id) AS rank
+        FROM document_chunks
+        WHERE thread_id = %(thread_id)s AND source_type = 'pdf_upload'
+        ORDER BY rank
+        LIMIT %(n)s
+    )
+"""
+
+
+def _is_identifier_query(query: str) -> bool:
+    """True for short queries naming an exact token, e.g. "AB-1234" or "clause 4.2.1"."""
+    words = [w.strip("\"'()[]{},;:?!") for w in query.split()]
+    return 0 < len(words) <= 3 and any(_IDENTIFIER.fullmatch(w) for w in words if w)
+
+
+def _any_term_query(query: str) -> str:
+    """Rewrite query as websearch_to_tsquery input that matches any of its words."""
+    words = (w.strip("\"-") for w in query.split())
+    return " or ".join(w for w in words if w and w.lower() != "or")
+
 
-    # 3. Chunk
-    chunks = _splitter.split_text(full_text)
-    logger.info(f"ingest_pdf: '{filename}' → {len(chunks)} chunks")
+def _upload_result(row: tuple, score: float, distance: float | None = None) -> dict:
+    content, source, chunk_index, embedding = row
+    return {
+        "content": content,
+        "source": source,
+        "source_type": "pdf_upload",
+        "score": score,
+        "distance": distance,
+        "chunk_index": chunk_index,
+        "embedding": embedding,
+    }
 
-    # 4. Embed all chunks in a single API call (batch)
-    embeddings = _embeddings.embed_documents(chunks)
 
-    # 5. Store
-    metadata_base = {"filename": filename, "file_hash": file_hash}
+def _lexical_search(thread_id: str, query: str, top_k: int) -> tuple[list[dict], bool]:
+    """Return full-text matches and whether the top one contains every query term."""
     with _pool.connection() as conn:
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            conn.execute(
-                """
-                INSERT INTO document_chunks
-                    (id, thread_id, source_type, content, metadata, embedding)
-                VALUES (%s, %s, 'pdf_upload', %s, %s, %s::vector)
-                """,
-                (
-                    str(uuid.uuid4()),
-                    thread_id,
-                    chunk,
-                    json.dumps({**metadata_base, "chunk_index": i}),
-                    to_pgvector_literal(embedding),
-                ),
-            )
-        conn.commit()
+        cursor = conn.execute(
+            "WITH " + _LEXICAL_CTE
+            + "SELECT content, source, chunk_index, embedding, rank, all_terms FROM lexical ORDER BY rank",
+            {"text": query, "terms": _any_term_query(query), "thread_id": thread_id, "n": top_k},
+        )
+        rows = cursor.fetchall()
+    results = [_upload_result(row[:4], 1.0 / (_RRF_K + row[4])) for row in rows]
+    return results, bool(rows and rows[0][5])
 
-    logger.info(f"ingest_pdf: stored {len(chunks)} chunks for '{filename}' in thread {thread_id}")
-    return {"status": "success", "chunks": len(chunks), "filename": filename}
+
+def _hybrid_search(thread_id: str, query: str, query_vector, top_k: int) -> list[dict]:
+    with _pool.connection() as conn:
+        cursor = conn.execute(
+            "WITH " + _LEXICAL_CTE + ", " + _SEMANTIC_CTE + """
+            SELECT COALESCE(l.content, s.content), COALESCE(l.source, s.source),
+                   COALESCE(l.chunk_index, s.chunk_index), COALESCE(l.embedding, s.embedding),
+                   COALESCE(1.0 / (%(rrf_k)s + l.rank), 0)
+                 + COALESCE(1.0 / (%(rrf_k)s + s.rank), 0) AS score,
+                   COALESCE(l.embedding, s.embedding) <=> %(q)s::vector AS distance
+            FROM lexical l FULL OUTER JOIN semantic s ON s.id = l.id
+            ORDER BY score DESC
+            LIMIT %(k)s
+            """,
+            {
+                "text": query,
+                "terms": _any_term_query(query),
+                "q": to_vector(query_vector),
+                "thread_id": thread_id,
+                "n": max(top_k, _HYBRID_CANDIDATES),
+                "k": top_k,
+                "rrf_k": _RRF_K,
+            },
+        )
+        return [_upload_result(row[:4], float(row[4]), row[5]) for row in cursor.fetchall()]
+
+
+def search_uploads(thread_id: str, query: str, top_k: int = 3) -> list[dict]:
+    """
+    Return the top_k chunks of this thread's uploads for query. Results carry
+    their cosine "distance" to the query, except full-text-only matches (None).
+
+    In "hybrid" mode an identifier-like query is answered by full-text search
+    alone when its top hit contains every query term — no embedding call;
+    otherwise full-text and vector rankings are fused by reciprocal rank in
+    one SQL statement. In "vector" mode this is retrieve() scoped to the thread.
+    Raises on database or embedding errors.
+    """
+    if RAG_RETRIEVAL_MODE != "hybrid":
+        return retrieve(query, thread_id=thread_id, top_k=top_k)
+    if _is_identifier_query(query):
+        results, strong = _lexical_search(thread_id, query, top_k)
+        if strong:
+            logger.debug(f"search_uploads: lexical fast path for {query!r} ({len(results)} hit(s))")
+            return results
+    return _hybrid_search(thread_id, query, _embeddings.embed_query(query), top_k)
 
 
 # ---------------------------------------------------------------------------
 # Retrieval — called automatically by chat_node on every message
 # ---------------------------------------------------------------------------
 
-def search_thread_documents(thread_id: str, query: str, top_k: int = 3) -> str:
+def search_thread_documents(
+    thread_id: str,
+    query: str,
+    candidates: int = RAG_CANDIDATES,
+    max_tokens: int = RAG_CONTEXT_MAX_TOKENS,
+) -> str:
     """
-    Semantic search over PDF chunks belonging to this thread.
+    Search this thread's PDF chunks and build the context block for the prompt.
 
-    Returns a formatted string of top-K relevant passages ready to inject
-    into the system prompt, or an empty string if:
+    Over-fetches `candidates` chunks, drops those beyond RAG_MAX_DISTANCE or
+    much farther than the best match (adaptive K), merges adjacent ones,
+    keeps a few diverse passages by MMR and packs them into max_tokens.
+    Returns the formatted block, or an empty string if:
       - the pool is not set
       - this thread has no uploaded documents
+      - no passage is close enough to the message to be worth sending
       - any error occurs (never raises — must not crash a chat turn)
     """
     if not _pool or not _vector_available:
         return ""
     try:
-        # Fast COUNT check — skip embedding cost if no uploads exist
-        with _pool.connection() as conn:
-            cursor = conn.execute(
-                """
-                SELECT COUNT(*) FROM document_chunks
-                WHERE thread_id = %s AND source_type = 'pdf_upload'
-                """,
-                (thread_id,),
-            )
-            if cursor.fetchone()[0] == 0:
-                return ""
-
-        # Embed the user's query
-        query_embedding = _embeddings.embed_query(query)
-
-        # Cosine similarity search scoped to this thread's PDF chunks
-        with _pool.connection() as conn:
-            cursor = conn.execute(
-                """
-                SELECT content, metadata->>'filename' AS filename
-                FROM document_chunks
-                WHERE thread_id = %s AND source_type = 'pdf_upload'
-                ORDER BY embedding <=> %s::vector
-                LIMIT %s
-                """,
-                (thread_id, to_pgvector_literal(query_embedding), top_k),
-            )
-            rows = cursor.fetchall()
-
-        if not rows:
+        # Registry check (usually cached) — skip embedding cost if no uploads exist
+        if not get_thread_documents(thread_id):
+            return ""
+
+        results = search_uploads(thread_id, query, top_k=candidates)
+        relevant = rerank.apply_cutoff(results)
+        logger.debug(
+            f"search_thread_documents: kept {len(relevant)} of {len(results)} candidate(s), distances "
+            f"{[round(r['distance'], 3) for r in results if r.get('distance') is not None][:5]}"
+        )
+        if not relevant:
             return ""
 
-        chunks = [f"[From: {row[1]}]\n{row[0]}" for row in rows]
-        return "\n\n---\n\n".join(chunks)
+        passages = rerank.select_passages(relevant)
+        return rerank.pack(passages, max_tokens, render=lambda p: f"[From: {p['source']}]\n{p['content']}")
 
     except Exception as e:
         logger.error(f"search_thread_documents failed for thread {thread_id}: {e}")
@@ -209,34 +534,20 @@ def search_thread_documents(thread_id: str, query: str, top_k: int = 3) -> str:
 
 def list_thread_files(thread_id: str) -> list[dict]:
     """
-    Return distinct filenames uploaded to this thread with their chunk counts.
+    Return the files uploaded to this thread with their chunk counts, newest first.
     Returns [] on any error.
     """
     if not _pool or not _vector_available:
         return []
     try:
-        with _pool.connection() as conn:
-            cursor = conn.execute(
-                """
-                SELECT
-                    metadata->>'filename'  AS filename,
-                    COUNT(*)               AS chunk_count,
-                    MAX(created_at)        AS uploaded_at
-                FROM document_chunks
-                WHERE thread_id = %s AND source_type = 'pdf_upload'
-                GROUP BY metadata->>'filename'
-                ORDER BY MAX(created_at) DESC
-                """,
-                (thread_id,),
-            )
-            return [
-                {
-                    "filename": row[0],
-                    "chunks": row[1],
-                    "uploaded_at": row[2].isoformat() if row[2] else None,
-                }
-                for row in cursor.fetchall()
-            ]
+        return [
+            {
+                "filename": doc["filename"],
+                "chunks": doc["chunks"],
+                "uploaded_at": doc["uploaded_at"].isoformat() if doc["uploaded_at"] else None,
+            }
+            for doc in get_thread_documents(thread_id)
+        ]
     except Exception as e:
         logger.error(f"list_thread_files failed for thread {thread_id}: {e}")
         return []
@@ -45,3 +45,8 @@ def update_memory(old_memory_id: int, new_fact: str) -> str:
     The `old_memory_id` MUST be the exact integer found inside the `[ID: X]` tag of the existing memory you are replacing.
     """
     return memory_service.update_fact(old_memory_id, new_fact)
+
+
+# Tools that mutate user_memory. The agent graph re-reads memories after any
+# of these run so the next LLM hop sees the change within the same turn.
+MEMORY_WRITE_TOOLS = {save_memory.name, forget_memory.name, update_memory.name}
@@ -7,18 +7,34 @@ This is the only file that server.py or agent/graph.py should ever import
 tools from — they never import individual tools directly.
 """
 
+import json
+
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from langchain_openai import ChatOpenAI
 
+from core.tokens import count_tokens
+
 from tools.search import search_tool
 from tools.calculator import calculator
 from tools.stock import get_stock_price
 from tools.memory_tools import save_memory, forget_memory, update_memory
 from tools.scraper import read_webpage
 
-# The canonical tool list for the entire application
+# The canonical tool list for the entire application. The serialized schemas
+# lead every request's prompt, so keep the order stable for prompt caching.
 ALL_TOOLS = [search_tool, get_stock_price, calculator, save_memory, forget_memory, update_memory, read_webpage]
 
+_schema_tokens: int | None = None
+
 
 def build_llm_with_tools(llm: ChatOpenAI) -> ChatOpenAI:
     """Bind all tools to the provided LLM instance. Called once at startup."""
     return llm.bind_tools(ALL_TOOLS)
+
+
+def tool_schema_tokens() -> int:
+    """Approximate prompt tokens of the bound tool schemas, counted once."""
+    global _schema_tokens
+    if _schema_tokens is None:
+        _schema_tokens = count_tokens(json.dumps([convert_to_openai_tool(t) for t in ALL_TOOLS]))
+    return _schema_tokens
@@ -0,0 +1,182 @@
+"""
+tools/rerank.py
+---------------
+Retrieval post-processing: turn an over-fetched candidate list into a small,
+non-redundant, token-budgeted set of passages.
+
+  0. apply_cutoff(): drops candidates too far from the query, and those much
+     farther than the best match (adaptive K).
+  1. merge_adjacent(): chunks from the same source with consecutive
+     chunk_index values are joined into one passage, dropping the text the
+     splitter repeated between them (chunk_overlap).
+  2. mmr(): maximal marginal relevance picks passages that are relevant to
+     the query but dissimilar to those already picked, using the chunk
+     embeddings returned by the search (NumPy, no extra API call).
+  3. pack(): rendered passages are kept in order until the token budget is spent.
+
+Candidates are dicts as returned by tools/document_rag.py searches: content,
+source, source_type, chunk_index, embedding, and a relevance signal — either
+"score" (higher is better) or cosine "distance".
+"""
+
+from collections.abc import Callable
+
+import numpy as np
+
+from core.config import RAG_DISTANCE_MARGIN, RAG_MAX_DISTANCE, RAG_MAX_PASSAGES
+from core.tokens import count_tokens, truncate_tokens
+
+# Weight of relevance against novelty in MMR: 1.0 is plain relevance order.
+MMR_LAMBDA = 0.7
+
+# Overlap search bounds when joining neighbouring chunks (characters).
+_MIN_OVERLAP = 20
+_MAX_OVERLAP = 1000
+
+
+def _relevance(candidate: dict) -> float:
+    if candidate.get("score") is not None:
+        return float(candidate["score"])
+    return 1.0 - float(candidate["distance"])
+
+
+def apply_cutoff(
+    candidates: list[dict],
+    max_distance: float = RAG_MAX_DISTANCE,
+    margin: float = RAG_DISTANCE_MARGIN,
+) -> list[dict]:
+    """
+    Keep candidates within max_distance of the query and within margin of the
+    closest one. Candidates without a distance (exact full-text matches) are kept.
+    """
+    distances = [c["distance"] for c in candidates if c.get("distance") is not None]
+    if not distances:
+        return list(candidates)
+    limit = min(max_distance, min(distances) + margin)
+    return [c for c in candidates if c.get("distance") is None or c["distance"] <= limit]
+
+
+def _overlap(a: str, b: str) -> int:
+    """Return the length of the longest suffix of a that is a prefix of b."""
+    probe = b[:_MIN_OVERLAP]
+    if len(probe) < _MIN_OVERLAP:
+        return 0
+    start = max(0, len(a) - _MAX_OVERLAP)
+    while (pos := a.find(probe, start)) != -1:
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        start = pos + 1
+    return 0
+
+
+def _join(a: str, b: str) -> str:
+    overlap = _overlap(a, b)
+    return a + b[overlap:] if overlap else f"{a}\n{b}"
+
+
+def merge_adjacent(candidates: list[dict]) -> list[dict]:
+    """
+    Merge candidates that are consecutive chunks of the same source.
+    A merged passage keeps the best relevance of its parts and the mean of
+    their embeddings. Candidates without a chunk_index are left as they are.
+    Output is ordered by relevance, best first.
+    """
+    groups: dict[tuple, list[dict]] = {}
+    passages: list[dict] = []
+    for candidate in candidates:
+        if candidate.get("chunk_index") is None:
+            passages.append({**candidate, "relevance": _relevance(candidate)})
+        else:
+            groups.setdefault((candidate["source_type"], candidate["source"]), []).append(candidate)
+
+    for chunks in groups.values():
+        chunks.sort(key=lambda c: c["chunk_index"])
+        run = [chunks[0]]
+        for chunk in chunks[1:] + [None]:
+            if chunk is not None and chunk["chunk_index"] == run[-1]["chunk_index"] + 1:
+                run.append(chunk)
+                continue
+            content = run[0]["content"]
+            for part in run[1:]:
+                content = _join(content, part["content"])
+            vectors = [c["embedding"] for c in run if c.get("embedding") is not None]
+            passages.append({
+                "content": content,
+                "source": run[0]["source"],
+                "source_type": run[0]["source_type"],
+                "chunk_index": run[0]["chunk_index"],
+                "chunks": len(run),
+                "relevance": max(_relevance(c) for c in run),
+                "embedding": np.mean(np.asarray(vectors, dtype=np.float32), axis=0) if vectors else None,
+            })
+            run = [chunk]
+
+    passages.sort(key=lambda p: p["relevance"], reverse=True)
+    return passages
+
+
+def mmr(relevance: np.ndarray, vectors: np.ndarray, k: int, lambda_: float = MMR_LAMBDA) -> list[int]:
+    """
+    Return the indices of up to k rows chosen by maximal marginal relevance.
+    relevance is scaled so the best row is 1.0, putting RRF scores and cosine
+    similarities on the same footing as the similarity penalty.
+    """
+    n = len(relevance)
+    if n == 0 or k <= 0:
+        return []
+    rel = np.clip(relevance, 0, None)
+    rel = rel / rel.max() if rel.max() > 0 else np.ones(n)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(norms == 0, 1, norms)
+    similarity = unit @ unit.T
+
+    selected = [int(np.argmax(rel))]
+    while len(selected) < min(k, n):
+        redundancy = similarity[:, selected].max(axis=1)
+        score = lambda_ * rel - (1 - lambda_) * redundancy
+        score[selected] = -np.inf
+        selected.append(int(np.argmax(score)))
+    return selected
+
+
+def select_passages(
+    candidates: list[dict],
+    max_passages: int = RAG_MAX_PASSAGES,
+    lambda_: float = MMR_LAMBDA,
+) -> list[dict]:
+    """Merge adjacent chunks, then pick up to max_passages diverse passages by MMR."""
+    passages = merge_adjacent(candidates)
+    embedded = [p for p in passages if p["embedding"] is not None]
+    if len(embedded) < len(passages) or len(passages) <= 1:
+        # Missing vectors: fall back to relevance order.
+        return passages[:max_passages]
+    relevance = np.array([p["relevance"] for p in passages], dtype=np.float32)
+    vectors = np.stack([np.asarray(p["embedding"], dtype=np.float32) for p in passages])
+    return [passages[i] for i in mmr(relevance, vectors, max_passages, lambda_)]
+
+
+def pack(
+    passages: list[dict],
+    max_tokens: int,
+    render: Callable[[dict], str] = lambda p: p["content"],
+    separator: str = "\n\n---\n\n",
+) -> str:
+    """
+    Render passages in order, stopping before the block exceeds max_tokens.
+    A passage that does not fit is skipped in favour of later, shorter ones;
+    the first passage is truncated rather than dropped.
+    """
+    blocks: list[str] = []
+    used = 0
+    separator_tokens = count_tokens(separator)
+    for passage in passages:
+        text = render(passage)
+        cost = count_tokens(text) + (separator_tokens if blocks else 0)
+        if used + cost > max_tokens:
+            if blocks:
+                continue
+            text = truncate_tokens(text, max_tokens)
+            cost = max_tokens
+        blocks.append(text)
+        used += cost
+    return separator.join(blocks)
@@ -7,24 +7,28 @@ Pipeline for read_webpage(url, query):
   1. Check document_chunks: is this URL already indexed?
      - HIT  → run cosine similarity search directly (zero Jina + embedding cost)
      - MISS → fetch via Jina → clean → chunk (600 tok / 100 overlap) → embed → store → search
-  2. Return top-3 most relevant passages (~1,800 tokens max) instead of a
-     raw 70,000-token page — eliminating 429 RateLimitError from the LLM.
+  2. Over-fetch the nearest chunks, merge adjacent ones, keep a few diverse
+     passages (MMR, tools/rerank.py) and return them within RAG_CONTEXT_MAX_TOKENS
+     instead of a raw 70,000-token page — eliminating 429 RateLimitError from the LLM.
 """
 
 import re
-import uuid
-import json
+import threading
+from datetime import datetime, timedelta, timezone
 
-import tiktoken
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from langchain_core.tools import tool
-from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from core.config import RAG_CANDIDATES, RAG_CONTEXT_MAX_TOKENS, WEB_CHUNK_TTL_DAYS, WEB_CLEANUP_INTERVAL_HOURS
+from core.database import WEB_PARTITION_WEEKS_AHEAD, drop_expired_web_partitions, ensure_web_partitions
+from core.embeddings import get_cached_embeddings
 from core.logger import get_logger
-from tools.vector_utils import to_pgvector_literal
+from core.tokens import count_tokens
+from tools import document_rag, rerank
+from tools.vector_utils import copy_chunks
 
 logger = get_logger(__name__)
 
@@ -34,6 +38,9 @@ logger = get_logger(__name__)
 _pool = None
 _vector_available = True
 
+_cleanup_thread: threading.Thread | None = None
+_cleanup_stop = threading.Event()
+
 
 def set_connection(pool) -> None:
     """Inject the connection pool. Must be called before any tool is invoked."""
@@ -50,18 +57,12 @@ def set_vector_available(is_available: bool) -> None:
 # ---------------------------------------------------------------------------
 # Embeddings + text splitter — module-level singletons (created once)
 # ---------------------------------------------------------------------------
-_embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-_enc = tiktoken.get_encoding("cl100k_base")
-
-
-def _token_len(text: str) -> int:
-    return len(_enc.encode(text))
-
+_embeddings = get_cached_embeddings()
 
 _splitter = RecursiveCharacterTextSplitter(
     chunk_size=600,       # ~600 tokens per chunk
     chunk_overlap=100,    # 100-token overlap prevents sentence boundary loss
-    length_function=_token_len,
+    length_function=count_tokens,
 )
 
 # ---------------------------------------------------------------------------
@@ -127,18 +128,17 @@ _JINA_HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
 # pgvector helpers
 # ---------------------------------------------------------------------------
 
-def _vec_str(embedding: list[float]) -> str:
-    """Serialize a float list to a pgvector-compatible string literal."""
-    return to_pgvector_literal(embedding)
-
-
 def _url_already_indexed(url: str) -> bool:
     """Return True if at least one chunk for this URL exists in document_chunks."""
     if _pool is None:
         return False
     with _pool.connection() as conn:
         cursor = conn.execute(
-            "SELECT 1 FROM document_chunks WHERE metadata->>'url' = %s LIMIT 1",
+            """
+            SELECT 1 FROM document_chunks
+            WHERE source_type = 'web_scrape' AND metadata->>'url' = %s
+            LIMIT 1
+            """,
             (url,),
         )
         return cursor.fetchone() is not None
@@ -148,62 +148,56 @@ def _embed_and_store(url: str, chunks: list[str]) -> None:
     """Batch-embed chunks and insert them into document_chunks."""
     embeddings = _embeddings.embed_documents(chunks)
     with _pool.connection() as conn:
-        for chunk_text, emb in zip(chunks, embeddings):
-            conn.execute(
-                """
-                INSERT INTO document_chunks (id, source_type, content, metadata, embedding)
-                VALUES (%s, 'web_scrape', %s, %s, %s::vector)
-                """,
-                (
-                    str(uuid.uuid4()),
-                    chunk_text,
-                    json.dumps({"url": url}),
-                    _vec_str(emb),
-                ),
-            )
+        copy_chunks(
+            conn,
+            (
+                (None, "web_scrape", chunk_text, {"url": url, "chunk_index": i}, emb)
+                for i, (chunk_text, emb) in enumerate(zip(chunks, embeddings))
+            ),
+        )
         conn.commit()
     logger.info(f"Stored {len(chunks)} chunks for {url}")
 
 
-def _search_chunks(url: str, query: str, top_k: int = 3) -> list[str]:
-    """Return the top_k chunks most similar to query, scoped to this URL."""
-    q_emb = _embeddings.embed_query(query)
-    with _pool.connection() as conn:
-        cursor = conn.execute(
-            """
-            SELECT content
-            FROM   document_chunks
-            WHERE  metadata->>'url' = %s
-            ORDER  BY embedding <=> %s::vector
-            LIMIT  %s
-            """,
-            (url, _vec_str(q_emb), top_k),
-        )
-        return [row[0] for row in cursor.fetchall()]
+def _search_chunks(url: str, query: str, candidates: int = RAG_CANDIDATES) -> list[dict]:
+    """
+    Return the passages of this URL to show for query: the nearest
+    `candidates` chunks, adjacent ones merged, diversified by MMR.
+    """
+    return rerank.select_passages(document_rag.retrieve(query, urls=[url], top_k=candidates))
 
 
 def cleanup_old_chunks() -> int:
     """
-    Delete web_scrape chunks older than 30 days.
+    Expire web_scrape chunks older than WEB_CHUNK_TTL_DAYS.
+    Weekly partitions that are entirely past the TTL are dropped whole; only
+    rows in the boundary week (or the default partition) are deleted one by
+    one. Also creates the partitions for the coming weeks.
     PDF uploads (source_type='pdf_upload') are exempt — they are never auto-deleted.
-    Returns the number of rows deleted.
+    Returns the number of rows deleted individually.
     """
     if _pool is None:
         return 0
     try:
         with _pool.connection() as conn:
+            today = datetime.now(timezone.utc).date()
+            ensure_web_partitions(conn, today, today + timedelta(weeks=WEB_PARTITION_WEEKS_AHEAD))
+            dropped = drop_expired_web_partitions(conn, WEB_CHUNK_TTL_DAYS)
             result = conn.execute(
                 """
                 DELETE FROM document_chunks
                 WHERE  source_type = 'web_scrape'
-                AND    created_at  < NOW() - INTERVAL '30 days'
-                """
+                AND    created_at  < NOW() - make_interval(days => %s)
+                """,
+                (WEB_CHUNK_TTL_DAYS,),
             )
             conn.commit()
             deleted = result.rowcount
+            if dropped:
+                logger.info(f"TTL cleanup: dropped {len(dropped)} expired web_scrape partition(s): {', '.join(dropped)}")
             if deleted:
                 logger.info(f"TTL cleanup: removed {deleted} stale web_scrape chunk(s)")
-            else:
+            elif not dropped:
                 logger.info("TTL cleanup: no stale chunks found")
             return deleted
     except Exception as e:
@@ -211,6 +205,41 @@ def cleanup_old_chunks() -> int:
         return 0
 
 
+def _cleanup_loop(interval_seconds: float) -> None:
+    """Run cleanup_old_chunks() now and then every interval until stopped."""
+    while not _cleanup_stop.is_set():
+        cleanup_old_chunks()
+        if interval_seconds <= 0:
+            return
+        _cleanup_stop.wait(interval_seconds)
+
+
+def start_cleanup_scheduler(interval_hours: float = WEB_CLEANUP_INTERVAL_HOURS) -> None:
+    """
+    Start the background thread that expires web chunks and keeps
+    WEB_PARTITION_WEEKS_AHEAD weeks of partitions in place, so new pages
+    never fall into the default partition on a long-running server.
+    Safe to call more than once.
+    """
+    global _cleanup_thread
+    if _cleanup_thread is not None and _cleanup_thread.is_alive():
+        return
+    _cleanup_stop.clear()
+    _cleanup_thread = threading.Thread(
+        target=_cleanup_loop, args=(interval_hours * 3600,), name="web-cleanup", daemon=True
+    )
+    _cleanup_thread.start()
+
+
+def stop_cleanup_scheduler() -> None:
+    """Signal the cleanup thread to exit and wait briefly for it."""
+    global _cleanup_thread
+    _cleanup_stop.set()
+    if _cleanup_thread is not None:
+        _cleanup_thread.join(timeout=10)
+    _cleanup_thread = None
+
+
 # ---------------------------------------------------------------------------
 # Jina fetch + index pipeline
 # ---------------------------------------------------------------------------
@@ -241,8 +270,8 @@ def _fetch_and_index(url: str) -> None:
 def read_webpage(url: str, query: str) -> str:
     """
     Fetches a webpage and returns the most relevant sections for your query
-    using semantic vector search. Only the top 3 matching passages (~1,800 tokens)
-    are returned, not the entire page.
+    using semantic vector search. Only a few of the most relevant, non-overlapping
+    passages (a fixed token budget) are returned, not the entire page.
 
     Args:
         url:   The full URL of the webpage to read.
@@ -265,11 +294,11 @@ def read_webpage(url: str, query: str) -> str:
         else:
             logger.info(f"Cache HIT for {url} — skipping Jina, querying pgvector directly")
 
-        chunks = _search_chunks(url, query)
-        if not chunks:
+        passages = _search_chunks(url, query)
+        if not passages:
             return "No relevant content found in this webpage for your query."
 
-        body = "\n\n---\n\n".join(chunks)
+        body = rerank.pack(passages, RAG_CONTEXT_MAX_TOKENS)
         return f"Source: {url}\n\n{body}"
 
     except requests.HTTPError as e:
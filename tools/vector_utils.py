@@ -2,9 +2,105 @@
 tools/vector_utils.py
 ---------------------
 Small helpers for storing embeddings in pgvector columns.
+
+Embeddings travel as NumPy float32 arrays over pgvector's binary wire
+format: register_vector() installs a psycopg dumper/loader for the `vector`
+type on each pooled connection (ConnectionPool configure callback), so a
+1536-dim embedding is sent as ~6 KB of raw bytes instead of a ~30 KB text
+literal that Python formats and Postgres re-parses.
 """
 
+import struct
+import uuid
+from collections.abc import Iterable
+
+import numpy as np
+from psycopg.adapt import Dumper, Loader
+from psycopg.pq import Format
+from psycopg.types import TypeInfo
+
+_HEADER = struct.Struct(">HH")     # dimensions, unused
+
+
+def to_vector(embedding) -> np.ndarray:
+    """Return an embedding as a float32 array, ready to bind as a vector parameter."""
+    return np.asarray(embedding, dtype=np.float32)
+
+
+class VectorBinaryDumper(Dumper):
+    """Dump a 1-D array to pgvector's binary format (int16 dim, int16 unused, float32 BE × dim)."""
+
+    format = Format.BINARY
+
+    def dump(self, obj) -> bytes:
+        arr = np.asarray(obj, dtype=">f4")
+        if arr.ndim != 1:
+            raise ValueError(f"expected a 1-D embedding, got shape {arr.shape}")
+        return _HEADER.pack(arr.shape[0], 0) + arr.tobytes()
+
+
+class VectorBinaryLoader(Loader):
+    format = Format.BINARY
+
+    def load(self, data) -> np.ndarray:
+        dim, _unused = _HEADER.unpack_from(data)
+        return np.frombuffer(data, dtype=">f4", count=dim, offset=_HEADER.size).astype(np.float32)
+
+
+class VectorTextLoader(Loader):
+    format = Format.TEXT
+
+    def load(self, data) -> np.ndarray:
+        text = bytes(data).decode()
+        return np.array(text[1:-1].split(","), dtype=np.float32)
+
+
+def register_vector(conn) -> bool:
+    """
+    Register the vector adapters on a connection. Returns False (and leaves
+    the connection untouched) if the pgvector extension is not installed.
+    Suitable as a psycopg_pool configure callback.
+    """
+    info = TypeInfo.fetch(conn, "vector")
+    if info is None:
+        return False
+    info.register(conn)
+    dumper = type("VectorBinaryDumper", (VectorBinaryDumper,), {"oid": info.oid})
+    conn.adapters.register_dumper(np.ndarray, dumper)
+    conn.adapters.register_loader(info.oid, VectorBinaryLoader)
+    conn.adapters.register_loader(info.oid, VectorTextLoader)
+    return True
+
+
+def copy_chunks(
+    conn,
+    chunks: Iterable[tuple[str | None, str, str, dict, list[float]]],
+) -> int:
+    """
+    Bulk-insert document_chunks rows with a single binary COPY ... FROM STDIN.
+
+    Each item is (thread_id, source_type, content, metadata, embedding); a
+    fresh UUID is assigned per row. The caller owns the transaction and
+    commits. Returns the number of rows written.
 
-def to_pgvector_literal(embedding: list[float]) -> str:
-    """Serialize an embedding to the text literal format accepted by pgvector."""
-    return "[" + ",".join(str(x) for x in embedding) + "]"
+    One COPY streams every row in one round-trip, instead of one INSERT
+    per chunk, so ingest time is bound by the embedding API, not Postgres latency.
+    """
+    written = 0
+    with conn.cursor() as cur:
+        with cur.copy(
+            "COPY document_chunks (id, thread_id, source_type, content, metadata, embedding) "
+            "FROM STDIN (FORMAT BINARY)"
+        ) as copy:
+            copy.set_types(["uuid", "text", "varchar", "jsonb", "vector"])
+            for thread_id, source_type, content, metadata, embedding in chunks:
+                copy.write_row((
+                    uuid.uuid4(),
+                    thread_id,
+                    source_type,
+                    content,
+                    metadata,
+                    to_vector(embedding),
+                ))
+                written += 1
+    return written